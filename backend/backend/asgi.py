@@ -3,6 +3,9 @@ ASGI config for backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Set USERS_API_ASYNC_VIEWS=1 to serve the user endpoints with the native async
+views of users_api/async_views.py.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
 """
@@ -1,24 +1,129 @@
+import atexit
+import copy
+import json
 import logging
+import queue
+import re
 import sys
+import uuid
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+# Identifiant de la requête en cours (ajouté à chaque log)
+request_id = ContextVar("request_id", default="-")
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "function": record.funcName,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    `QueueHandler` leaving the formatting to the listener's thread: the stock
+    `prepare` formats the message on the calling thread and drops `exc_info`,
+    so tracebacks ended up in "message" instead of "exception"
+    """
+
+    def prepare(self, record):
+        # A copy, the record's args and exc_info are formatted by the listener's handler
+        return copy.copy(record)
+
 
 # === 1. Créer un logger personnalisé === #
 logger = logging.getLogger(__name__)
 
 # === 2. Créer un ou plusieurs handler === #
-# Diriger les logs vers "standard output"
+# Diriger les logs vers "standard output", écrits par un thread dédié :
+# les vues ne font que poser les records dans une file
 stream_handler = logging.StreamHandler(sys.stdout)
+log_queue = queue.SimpleQueue()
+queue_handler = DeferredQueueHandler(log_queue)
+queue_handler.addFilter(RequestIdFilter())
 
 # === 3. Ajouter les handlers au logger === #
-logger.addHandler(stream_handler)
+logger.addHandler(queue_handler)
+logger.propagate = False
 
 # === 4. Choisir un niveau de journalisation minimum === #
-logger.setLevel(logging.DEBUG)
+# Défini par LOG_LEVEL dans les settings (variable d'environnement DJANGO_LOG_LEVEL)
+logger.setLevel(getattr(settings, "LOG_LEVEL", "INFO"))
 
 # === 5. Définir le format des logs === #
-# Définir un format pour la console
-stream_format = logging.Formatter(
-    "[%(asctime)s] [%(levelname)s] {%(module)s -> %(funcName)s} - %(message)s"
-)
+# JSON par défaut, texte lisible avec LOG_FORMAT = "text"
+if getattr(settings, "LOG_FORMAT", "json") == "text":
+    stream_format = logging.Formatter(
+        "[%(asctime)s] [%(levelname)s] [%(request_id)s] {%(module)s -> %(funcName)s} - %(message)s"
+    )
+else:
+    stream_format = JSONFormatter()
 
 # Associer les formats au handlers
 stream_handler.setFormatter(stream_format)
+
+# === 6. Démarrer le thread d'écriture === #
+listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+listener.start()
+atexit.register(listener.stop)
+
+
+# === Identifiant de corrélation des requêtes === #
+REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+
+class RequestIdMiddleware:
+    """
+    Tag every log of a request with its id (X-Request-ID header or a new one)
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def get_request_id(self, request):
+        value = request.headers.get("X-Request-ID", "")
+        return value if REQUEST_ID_RE.match(value) else uuid.uuid4().hex
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = request_id.set(self.get_request_id(request))
+        try:
+            response = self.get_response(request)
+            response["X-Request-ID"] = request_id.get()
+        finally:
+            request_id.reset(token)
+        return response
+
+    async def __acall__(self, request):
+        token = request_id.set(self.get_request_id(request))
+        try:
+            response = await self.get_response(request)
+            response["X-Request-ID"] = request_id.get()
+        finally:
+            request_id.reset(token)
+        return response
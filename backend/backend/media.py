@@ -0,0 +1,171 @@
+"""
+Serving of user uploaded media (avatars and their derivatives).
+
+Unlike `django.views.static.serve` this view is meant for production: files
+are streamed, conditional requests (If-Modified-Since / If-None-Match) and
+single byte ranges are supported, and the transfer can be handed over to the
+front web server with X-Sendfile or X-Accel-Redirect.
+
+Content addressed files (named after the hash of their content: uploaded
+avatars, see users_api/models.py, and their derivatives, see
+users_api/avatars.py) never change, so they are sent as `immutable`.
+"""
+
+import mimetypes
+import posixpath
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseNotAllowed,
+    HttpResponseNotModified,
+    StreamingHttpResponse,
+)
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_etags
+from django.views.static import was_modified_since
+
+DEFAULTS = {
+    # None, "x-sendfile" (Apache, lighttpd) or "x-accel-redirect" (nginx)
+    "SENDFILE": None,
+    # Internal nginx location mapped to MEDIA_ROOT
+    "ACCEL_REDIRECT_PREFIX": "/protected-media/",
+    # Cache lifetime (seconds) of files which may change
+    "MAX_AGE": 3600,
+}
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Hash, then a derivative size or the suffix the storage adds to a name taken
+# (by the same content)
+HASHED_NAME_RE = re.compile(r"(?:^|/)[0-9a-f]{32,64}(?:-\d+|_[A-Za-z0-9]{7})?\.\w+$")
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+CHUNK_SIZE = 64 * 1024
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, "MEDIA_SERVING", {}))
+    return config
+
+
+def parse_range(header, size):
+    """
+    Parse a single-range Range header and return (start, end) inclusive.
+
+    Returns None if the header should be ignored and raises ValueError if the
+    range can't be satisfied.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        # Suffix range: the last N bytes
+        start = max(size - int(last), 0)
+        end = size - 1
+    if start > end or start >= size:
+        raise ValueError("Unsatisfiable range")
+    return start, end
+
+
+def iter_range(f, start, length):
+    with f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def serve(request, path):
+    if request.method not in ("GET", "HEAD"):
+        return HttpResponseNotAllowed(["GET", "HEAD"])
+
+    path = posixpath.normpath(path).lstrip("/")
+    try:
+        fullpath = Path(safe_join(settings.MEDIA_ROOT, path))
+    except SuspiciousFileOperation:
+        raise Http404("Invalid path")
+    if not fullpath.is_file():
+        raise Http404(f"{path} does not exist")
+
+    config = get_config()
+    stat = fullpath.stat()
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    last_modified = http_date(stat.st_mtime)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": last_modified,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": (
+            IMMUTABLE_CACHE_CONTROL
+            if HASHED_NAME_RE.search(path)
+            else f"public, max-age={config['MAX_AGE']}"
+        ),
+    }
+
+    # Conditional requests
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match:
+        # Weak comparison, as RFC 9110 requires for If-None-Match
+        etags = (e.removeprefix("W/") for e in parse_etags(if_none_match))
+        not_modified = etag in etags or if_none_match.strip() == "*"
+    else:
+        not_modified = not was_modified_since(
+            request.headers.get("If-Modified-Since"), stat.st_mtime
+        )
+    if not_modified:
+        response = HttpResponseNotModified()
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    content_type, encoding = mimetypes.guess_type(str(fullpath))
+    content_type = content_type or "application/octet-stream"
+
+    # Let the web server send the file
+    if config["SENDFILE"]:
+        response = HttpResponse(content_type=content_type, headers=headers)
+        if config["SENDFILE"] == "x-accel-redirect":
+            response["X-Accel-Redirect"] = config["ACCEL_REDIRECT_PREFIX"] + path
+        else:
+            response["X-Sendfile"] = str(fullpath)
+        return response
+
+    # Byte range (only if the file didn't change since the client got its part)
+    range_header = request.headers.get("Range")
+    if_range = request.headers.get("If-Range")
+    if range_header and (not if_range or if_range in (etag, last_modified)):
+        try:
+            byte_range = parse_range(range_header, stat.st_size)
+        except ValueError:
+            response = HttpResponse(status=416, headers=headers)
+            response["Content-Range"] = f"bytes */{stat.st_size}"
+            return response
+        if byte_range:
+            start, end = byte_range
+            length = end - start + 1
+            response = StreamingHttpResponse(
+                iter_range(fullpath.open("rb"), start, length),
+                status=206,
+                content_type=content_type,
+                headers=headers,
+            )
+            response["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+            response["Content-Length"] = str(length)
+            return response
+
+    response = FileResponse(fullpath.open("rb"), content_type=content_type, headers=headers)
+    if encoding:
+        response["Content-Encoding"] = encoding
+    return response
@@ -0,0 +1,254 @@
+"""
+Request metrics in the Prometheus text format.
+
+`MetricsMiddleware` records, per URL name: request counts by status code, a
+latency histogram and the number/duration of database queries. The hashing
+pool records password hashing time. Everything is aggregated in a
+per-process registry (a dict behind a lock, no dependency).
+
+With several worker processes set METRICS["MULTIPROCESS_DIR"]: every process
+then dumps its registry to `<dir>/<pid>.json` (at most every
+FLUSH_INTERVAL seconds) and the scrape endpoint sums all the files.
+
+Database queries are counted for synchronous requests (the async views run
+their queries in other threads).
+"""
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+DEFAULTS = {
+    # Clients allowed to scrape the metrics endpoint
+    "ALLOWED_IPS": ["127.0.0.1", "::1"],
+    # Directory shared by the worker processes (None = single process)
+    "MULTIPROCESS_DIR": None,
+    # Minimum delay (seconds) between two dumps of a process' registry
+    "FLUSH_INTERVAL": 5,
+}
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+DESCRIPTIONS = {
+    "http_requests_total": ("counter", "HTTP requests by URL name, method and status"),
+    "http_request_duration_seconds": ("histogram", "HTTP request latency by URL name"),
+    "db_queries_total": ("counter", "Database queries by URL name"),
+    "db_query_duration_seconds_total": ("counter", "Time spent in database queries by URL name"),
+    "password_hash_duration_seconds": ("histogram", "Password hashing time (queue wait included)"),
+    "expired_sessions_deleted_total": ("counter", "Expired sessions deleted by the sweeper"),
+}
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, "METRICS", {}))
+    return config
+
+
+class Registry:
+    """
+    Counters and histograms keyed by (metric name, labels)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = defaultdict(float)
+        # key -> [count per bucket..., +Inf count, sum]
+        self.histograms = {}
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] += value
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(BUCKETS) + 2)
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram[i] += 1
+                    break
+            else:
+                histogram[len(BUCKETS)] += 1
+            histogram[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": [[name, labels, value] for (name, labels), value in self.counters.items()],
+                "histograms": [
+                    [name, labels, list(values)] for (name, labels), values in self.histograms.items()
+                ],
+            }
+
+    def merge(self, snapshot):
+        with self._lock:
+            for name, labels, value in snapshot["counters"]:
+                self.counters[(name, tuple(map(tuple, labels)))] += value
+            for name, labels, values in snapshot["histograms"]:
+                key = (name, tuple(map(tuple, labels)))
+                histogram = self.histograms.setdefault(key, [0] * len(values))
+                for i, value in enumerate(values):
+                    histogram[i] += value
+
+    def render(self):
+        """
+        Return the registry in the Prometheus text exposition format
+        """
+        series = defaultdict(list)
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                series[name].append(f"{name}{format_labels(labels)} {format_value(value)}")
+            for (name, labels), values in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip((*BUCKETS, "+Inf"), values):
+                    cumulative += count
+                    le = (("le", str(bound)),)
+                    series[name].append(f"{name}_bucket{format_labels(labels + le)} {cumulative}")
+                series[name].append(
+                    f"{name}_sum{format_labels(labels)} {format_value(values[-1])}"
+                )
+                series[name].append(f"{name}_count{format_labels(labels)} {cumulative}")
+
+        lines = []
+        for name, samples in series.items():
+            metric_type, description = DESCRIPTIONS.get(name, ("untyped", name))
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+def format_value(value):
+    # Every digit: rate() needs the exact counter values
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+registry = Registry()
+_last_flush = 0
+
+
+def flush(force=False):
+    """
+    Dump this process' registry for the other processes (multiprocess mode)
+    """
+    global _last_flush
+    config = get_config()
+    if not config["MULTIPROCESS_DIR"]:
+        return
+    now = time.monotonic()
+    if not force and now - _last_flush < config["FLUSH_INTERVAL"]:
+        return
+    _last_flush = now
+    directory = Path(config["MULTIPROCESS_DIR"])
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{os.getpid()}.json"
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(registry.snapshot()))
+    os.replace(tmp_path, path)
+
+
+def collect():
+    """
+    Return a registry aggregating every process (or this one only)
+    """
+    config = get_config()
+    if not config["MULTIPROCESS_DIR"]:
+        return registry
+    flush(force=True)
+    merged = Registry()
+    for path in Path(config["MULTIPROCESS_DIR"]).glob("*.json"):
+        try:
+            merged.merge(json.loads(path.read_text()))
+        except (OSError, ValueError):
+            # File being replaced by its process, skip it this time
+            continue
+    return merged
+
+
+def observe_password_hash(operation, seconds):
+    registry.observe("password_hash_duration_seconds", {"operation": operation}, seconds)
+
+
+class QueryCounter:
+    # Database execute wrapper counting queries and their duration
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        counter = QueryCounter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(counter))
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - start, counter)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - start, None)
+        return response
+
+    def record(self, request, response, duration, counter):
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match else "unmatched"
+        registry.inc(
+            "http_requests_total",
+            {"view": view, "method": request.method, "status": response.status_code},
+        )
+        registry.observe("http_request_duration_seconds", {"view": view}, duration)
+        if counter is not None:
+            registry.inc("db_queries_total", {"view": view}, counter.count)
+            registry.inc("db_query_duration_seconds_total", {"view": view}, counter.duration)
+        flush()
+
+
+def metrics_view(request):
+    if request.META.get("REMOTE_ADDR") not in get_config()["ALLOWED_IPS"]:
+        return HttpResponseForbidden()
+    return HttpResponse(collect().render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,156 @@
+"""
+Read replica routing.
+
+`ReplicaRouter` sends reads to one of the DATABASE_REPLICAS aliases and writes
+to `default`. Replicas lag behind the primary, so:
+
+- sessions are always read from the primary (a fresh login must be visible
+  on the next request),
+- during a write request (POST, PUT, ...) every query goes to the primary,
+- after a successful write `PrimaryPinMiddleware` sets a short-lived cookie
+  pinning that client's reads to the primary for REPLICA_ROUTING["PIN_SECONDS"],
+  so a user always reads their own writes,
+- background jobs following a write (avatar derivatives, account purge) run
+  under `primary()`, outside of any request,
+- a replica failing its health check is skipped for RETRY_SECONDS.
+
+Locally, replicas can be plain SQLite files kept in sync with
+`manage.py sync_replicas`.
+"""
+
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+from backend.logging_config import logger
+
+DEFAULTS = {
+    # Seconds during which a client reads from the primary after a write
+    "PIN_SECONDS": 5,
+    # Seconds before a replica that failed its health check is tried again
+    "RETRY_SECONDS": 30,
+    "COOKIE_NAME": "pin_primary",
+}
+
+# Apps whose reads must never be stale
+PRIMARY_ONLY_APPS = {"sessions"}
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+_pin_primary = ContextVar("pin_primary", default=False)
+# alias -> time before which the replica is considered down
+_down_until = {}
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, "REPLICA_ROUTING", {}))
+    return config
+
+
+def is_available(alias):
+    if _down_until.get(alias, 0) > time.monotonic():
+        return False
+    try:
+        db = settings.DATABASES[alias]
+        # Connecting to a missing SQLite file would silently create it
+        if db["ENGINE"].endswith("sqlite3") and not Path(db["NAME"]).exists():
+            raise DatabaseError(f"{db['NAME']} does not exist")
+        connections[alias].ensure_connection()
+    except DatabaseError as e:
+        logger.warning("Replica %s unavailable, reading from primary: %s", alias, e)
+        _down_until[alias] = time.monotonic() + get_config()["RETRY_SECONDS"]
+        return False
+    return True
+
+
+@contextmanager
+def primary():
+    """
+    Route the reads of the block (or decorated function) to the primary
+    """
+    token = _pin_primary.set(True)
+    try:
+        yield
+    finally:
+        _pin_primary.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, "DATABASE_REPLICAS", [])
+        if not replicas or _pin_primary.get() or model._meta.app_label in PRIMARY_ONLY_APPS:
+            return "default"
+        available = [alias for alias in replicas if is_available(alias)]
+        return random.choice(available) if available else "default"
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary
+        return db == "default"
+
+
+class PrimaryPinMiddleware:
+    """
+    Route the reads of a request to the primary during and after writes
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _pin_primary.set(self.must_pin(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            _pin_primary.reset(token)
+        return self.process_response(request, response)
+
+    async def __acall__(self, request):
+        token = _pin_primary.set(self.must_pin(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            _pin_primary.reset(token)
+        return self.process_response(request, response)
+
+    def must_pin(self, request):
+        return (
+            request.method not in SAFE_METHODS
+            or get_config()["COOKIE_NAME"] in request.COOKIES
+        )
+
+    def process_response(self, request, response):
+        if (
+            getattr(settings, "DATABASE_REPLICAS", [])
+            and request.method not in SAFE_METHODS
+            and response.status_code < 400
+        ):
+            config = get_config()
+            response.set_cookie(
+                config["COOKIE_NAME"],
+                "1",
+                max_age=config["PIN_SECONDS"],
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
@@ -10,6 +10,9 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import importlib.util
+import json
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,7 +46,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "backend.metrics.MetricsMiddleware",
+    "backend.logging_config.RequestIdMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    "backend.routers.PrimaryPinMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "corsheaders.middleware.CorsMiddleware",
@@ -72,16 +78,66 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "backend.wsgi.application"
+ASGI_APPLICATION = "backend.asgi.application"
+
+# Serve the user endpoints with native async views (for ASGI deployments)
+USERS_API_ASYNC_VIEWS = os.environ.get("USERS_API_ASYNC_VIEWS", "0") == "1"
 
 
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# "production" enables WAL, tuned pragmas and persistent connections
+SQLITE_PROFILE = os.environ.get("DJANGO_SQLITE_PROFILE", "development")
+
+SQLITE_PROFILES = {
+    "development": {
+        "CONN_MAX_AGE": 0,
+        "PRAGMAS": {},
+    },
+    "production": {
+        "CONN_MAX_AGE": 600,
+        # Applied on each new connection (see backend/sqlite.py)
+        "PRAGMAS": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "busy_timeout": 5000,  # ms
+            "cache_size": -20000,  # KiB
+            "mmap_size": 268435456,  # bytes
+            "temp_store": "MEMORY",
+        },
+    },
+}
+
+SQLITE_PRAGMAS = SQLITE_PROFILES[SQLITE_PROFILE]["PRAGMAS"]
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        "CONN_MAX_AGE": SQLITE_PROFILES[SQLITE_PROFILE]["CONN_MAX_AGE"],
+        "CONN_HEALTH_CHECKS": True,
+    }
+}
+
+# Read replicas, e.g. DJANGO_DB_REPLICAS=replica1.sqlite3,replica2.sqlite3
+# (local SQLite replicas are kept in sync with `manage.py sync_replicas`)
+DATABASE_REPLICAS = []
+for index, name in enumerate(filter(None, os.environ.get("DJANGO_DB_REPLICAS", "").split(","))):
+    alias = f"replica{index + 1}"
+    DATABASES[alias] = {
+        **DATABASES["default"],
+        "NAME": BASE_DIR / name.strip(),
+        "TEST": {"MIRROR": "default"},
     }
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ["backend.routers.ReplicaRouter"]
+
+# See backend/routers.py
+REPLICA_ROUTING = {
+    "PIN_SECONDS": 5,
+    "RETRY_SECONDS": 30,
 }
 
 
@@ -96,13 +152,20 @@ AUTH_PASSWORD_VALIDATORS = [
         "NAME": "django.contrib.auth.password_validation.MinimumLengthValidator",
     },
     {
-        "NAME": "django.contrib.auth.password_validation.CommonPasswordValidator",
+        "NAME": "users_api.password_filter.FilterPasswordValidator",
     },
     {
         "NAME": "django.contrib.auth.password_validation.NumericPasswordValidator",
     },
 ]
 
+# Memory-mapped filter of common or breached passwords, built by
+# `manage.py build_password_filter` (see users_api/password_filter.py)
+PASSWORD_FILTER = {
+    "PATH": BASE_DIR / "password_filter.bloom",
+    "ERROR_RATE": 0.001,
+}
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.0/topics/i18n/
@@ -123,6 +186,30 @@ STATIC_URL = "static/"
 MEDIA_ROOT = BASE_DIR / "media"
 MEDIA_URL = "/media/"
 
+# Media serving (see backend/media.py)
+MEDIA_SERVING = {
+    # None, "x-sendfile" or "x-accel-redirect" to let the web server send the files
+    "SENDFILE": None,
+    "ACCEL_REDIRECT_PREFIX": "/protected-media/",
+    "MAX_AGE": 3600,
+}
+
+# Resized copies of the avatars, generated in the background (see users_api/avatars.py)
+AVATAR_DERIVATIVES = {
+    "SIZES": (64, 128, 256),
+    "FORMATS": ("webp", "jpeg"),
+    "DIRECTORY": "avatars",
+    "ASYNC": True,
+}
+
+# Removal of deleted accounts in the background (see users_api/purge.py)
+ACCOUNT_PURGE = {
+    "ASYNC": True,
+    "BATCH_SIZE": 500,
+    "MAX_ATTEMPTS": 5,
+    "RETRY_DELAY": 60,
+}
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
@@ -136,11 +223,140 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 # Custom user model
 AUTH_USER_MODEL = "users_api.AppUser"
 
+# MessagePack (application/msgpack) is offered when msgpack is installed (see users_api/renderers.py)
+MSGPACK_ENABLED = importlib.util.find_spec("msgpack") is not None
+
 REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": ("rest_framework.permissions.IsAuthenticated",),
+    # orjson-backed when installed, same output as DRF's JSONRenderer
+    "DEFAULT_RENDERER_CLASSES": (
+        "users_api.renderers.FastJSONRenderer",
+        *(("users_api.renderers.MessagePackRenderer",) if MSGPACK_ENABLED else ()),
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ),
+    "DEFAULT_PARSER_CLASSES": (
+        "rest_framework.parsers.JSONParser",
+        *(("users_api.renderers.MessagePackParser",) if MSGPACK_ENABLED else ()),
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ),
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework.authentication.SessionAuthentication",
+        "users_api.user_cache.CachedSessionAuthentication",
     ),
+    # Reverse proxies in front of the app: clients are identified by REMOTE_ADDR
+    # (0) or by the X-Forwarded-For entry the last proxy added, never by the raw header
+    "NUM_PROXIES": int(os.environ.get("DJANGO_NUM_PROXIES", "0")),
+    "DEFAULT_THROTTLE_RATES": {
+        "availability": "60/minute",
+    },
+}
+
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    # Common to the worker processes of a host (point it to Redis or Memcached across hosts)
+    "shared": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.environ.get("DJANGO_SHARED_CACHE_DIR", str(BASE_DIR / ".cache")),
+    },
+}
+
+# Sessions are cached in memory in front of the database (see users_api/session_backend.py)
+SESSION_ENGINE = "users_api.session_backend"
+SESSION_CACHE = {
+    "MAX_ENTRIES": 10000,
+    "TTL": 60,
+    # Set to an alias from CACHES (e.g. a FileBasedCache) to share sessions between workers
+    "SHARED_CACHE_ALIAS": None,
+    "WRITE_INTERVAL": 300,
+}
+
+# Deletion of expired sessions in small batches (see users_api/sweeper.py)
+SESSION_SWEEPER = {
+    "BATCH_SIZE": 500,
+    "PAUSE": 0.1,
+    "INTERVAL": 300,
+}
+
+# Authenticated users cached in memory, skipping the user query (see users_api/user_cache.py)
+USER_CACHE = {
+    "MAX_ENTRIES": 10000,
+    # Staleness window of the other worker processes: a change made by one worker
+    # (profile update, avatar derivatives generated in the background) only drops
+    # its own copy and the shared tier, the others keep serving the previous ETag
+    # and avatar_thumbnails for up to TTL seconds
+    "TTL": 30,
+    # Set to an alias from CACHES to share the cache between workers
+    "SHARED_CACHE_ALIAS": None,
+}
+
+# Stateless signed cookie answering the read endpoints (see users_api/signed_session.py)
+SIGNED_SESSION = {
+    "ENABLED": os.environ.get("DJANGO_SIGNED_SESSION", "0") == "1",
+    "MAX_AGE": 300,
+    # Must be shared by every worker process (e.g. a FileBasedCache), checked at startup
+    "DENYLIST_CACHE_ALIAS": "default",
+}
+
+# In-memory filter of the registered emails answering register/availability (see users_api/availability.py)
+EMAIL_AVAILABILITY = {
+    "ASYNC": True,
+    # Counts the requests of each client, must be shared by every worker process (checked at startup)
+    "THROTTLE_CACHE_ALIAS": "shared",
+    "ERROR_RATE": 0.01,
+    "HEADROOM": 10000,
+    # Seconds before the registrations of the other workers are seen
+    "REFRESH_INTERVAL": 1,
+    "REBUILD_INTERVAL": 300,
+}
+
+# Password hashing worker pool (see users_api/hashing.py)
+PASSWORD_HASHING = {
+    "WORKERS": None,  # One process per core
+    "QUEUE_DEPTH": 64,
+    "QUEUE_TIMEOUT": 5,
+}
+
+# Hasher costs measured on this host by `manage.py calibrate_hasher` (see users_api/hashers.py)
+PASSWORD_HASHER_CALIBRATION_FILE = BASE_DIR / "hasher_calibration.json"
+PASSWORD_HASHER_CALIBRATION = (
+    json.loads(PASSWORD_HASHER_CALIBRATION_FILE.read_text())
+    if PASSWORD_HASHER_CALIBRATION_FILE.exists()
+    else {}
+)
+# New hashes use the first hasher, the others still verify existing hashes
+# (which are upgraded on the next login). Django's default list and order.
+PASSWORD_HASHERS = {
+    "pbkdf2_sha256": "users_api.hashers.CalibratedPBKDF2PasswordHasher",
+    "pbkdf2_sha1": "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+    "argon2": "users_api.hashers.CalibratedArgon2PasswordHasher",
+    "bcrypt_sha256": "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+    "scrypt": "users_api.hashers.CalibratedScryptPasswordHasher",
+}
+_preferred_hasher = PASSWORD_HASHER_CALIBRATION.get("algorithm", "pbkdf2_sha256")
+# argon2-cffi isn't a dependency of the project: only preferred where it's installed
+if _preferred_hasher == "argon2" and importlib.util.find_spec("argon2") is None:
+    _preferred_hasher = "pbkdf2_sha256"
+PASSWORD_HASHERS = [PASSWORD_HASHERS.pop(_preferred_hasher), *PASSWORD_HASHERS.values()]
+
+# ============================== #
+# ====== LOGGING SETTINGS ====== #
+# ============================== #
+
+# See backend/logging_config.py
+LOG_LEVEL = os.environ.get("DJANGO_LOG_LEVEL", "DEBUG" if DEBUG else "INFO").upper()
+# "json" or "text"
+LOG_FORMAT = os.environ.get("DJANGO_LOG_FORMAT", "json")
+
+# ============================== #
+# ====== METRICS SETTINGS ====== #
+# ============================== #
+
+# Prometheus metrics served at /metrics (see backend/metrics.py)
+METRICS = {
+    "ALLOWED_IPS": ["127.0.0.1", "::1"],
+    # Directory shared by the worker processes, e.g. DJANGO_METRICS_DIR=/tmp/metrics
+    "MULTIPROCESS_DIR": os.environ.get("DJANGO_METRICS_DIR"),
+    "FLUSH_INTERVAL": 5,
 }
 
 # =========================== #
@@ -0,0 +1,18 @@
+"""
+SQLite tuning.
+
+`set_pragmas` runs on every new database connection (connected in
+users_api/apps.py) and applies the pragmas of the active SQLITE_PROFILE from
+settings. With persistent connections (CONN_MAX_AGE) this happens once per
+worker thread instead of once per request.
+"""
+
+from django.conf import settings
+
+
+def set_pragmas(sender, connection, **kwargs):
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {pragma} = {value}")
@@ -14,12 +14,24 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.contrib import admin
-from django.urls import path, include
-from django.conf.urls.static import static
+from django.urls import path, re_path, include
 from django.conf import settings
 
+from . import media, metrics
+
 urlpatterns = [
     path("admin/", admin.site.urls),
-    path("api/", include("users_api.urls")),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path("metrics", metrics.metrics_view, name="metrics"),
+    path(
+        "api/",
+        include("users_api.async_urls" if settings.USERS_API_ASYNC_VIEWS else "users_api.urls"),
+    ),
+    re_path(
+        r"^%s(?P<path>.*)$" % re.escape(settings.MEDIA_URL.lstrip("/")),
+        media.serve,
+        name="media",
+    ),
+]
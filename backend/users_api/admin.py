@@ -1,6 +1,35 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 
 # Register your models here.
+from . import bulk_ops
 from .models import AppUser
 
-admin.site.register(AppUser)
+
+def bulk_action(action, description):
+    def run(modeladmin, request, queryset):
+        user_ids = queryset.exclude(pk=request.user.pk).values_list("pk", flat=True)
+        changed, sessions = bulk_ops.apply(action, user_ids)
+        modeladmin.message_user(
+            request, f"{changed} users changed, {sessions} sessions deleted", messages.SUCCESS
+        )
+
+    run.__name__ = f"{action}_users"
+    run.short_description = description
+    return run
+
+
+@admin.register(AppUser)
+class AppUserAdmin(admin.ModelAdmin):
+    list_display = ("email", "username", "is_active", "is_admin", "date_joined")
+    list_filter = ("is_active", "is_admin")
+    search_fields = ("email_normalized", "username")
+    actions = (
+        bulk_action("activate", "Activate selected users"),
+        bulk_action("deactivate", "Deactivate selected users and end their sessions"),
+        bulk_action("promote", "Make selected users admins"),
+        bulk_action("demote", "Remove admin rights of selected users"),
+    )
+
+    def delete_queryset(self, request, queryset):
+        # Used by the "Delete selected" action, after its confirmation page
+        bulk_ops.apply("delete", queryset.values_list("pk", flat=True))
@@ -4,3 +4,36 @@ from django.apps import AppConfig
 class UsersApiConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "users_api"
+
+    def ready(self):
+        from django.contrib.auth.signals import user_logged_in, user_logged_out
+        from django.db.backends.signals import connection_created
+        from django.core import checks
+        from django.db.models.signals import post_delete, post_save
+        from backend.sqlite import set_pragmas
+        from .availability import add_on_save, check_throttle_cache
+        from .bulk_ops import track_session, untrack_session
+        from .models import AppUser
+        from .signed_session import check_denylist_cache, revoke_on_change
+        from .user_cache import invalidate_on_change
+
+        checks.register(check_denylist_cache, checks.Tags.security)
+        checks.register(check_throttle_cache, checks.Tags.security)
+        connection_created.connect(set_pragmas, dispatch_uid="users_api.sqlite_pragmas")
+        user_logged_in.connect(track_session, dispatch_uid="users_api.track_session")
+        user_logged_out.connect(untrack_session, dispatch_uid="users_api.untrack_session")
+        post_save.connect(
+            revoke_on_change, sender=AppUser, dispatch_uid="users_api.revoke_on_save"
+        )
+        post_delete.connect(
+            revoke_on_change, sender=AppUser, dispatch_uid="users_api.revoke_on_delete"
+        )
+        post_save.connect(
+            invalidate_on_change, sender=AppUser, dispatch_uid="users_api.invalidate_on_save"
+        )
+        post_delete.connect(
+            invalidate_on_change, sender=AppUser, dispatch_uid="users_api.invalidate_on_delete"
+        )
+        post_save.connect(
+            add_on_save, sender=AppUser, dispatch_uid="users_api.availability_on_save"
+        )
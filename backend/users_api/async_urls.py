@@ -0,0 +1,17 @@
+from django.urls import path
+from . import async_views, views
+
+# Same routes as urls.py, served by the async views (see USERS_API_ASYNC_VIEWS)
+urlpatterns = [
+    path("user", async_views.UserRetrieveView.as_view(), name="user"),
+    path("login", async_views.UserLogin.as_view(), name="login"),
+    path("logout", async_views.UserLogout.as_view(), name="logout"),
+    path("register", async_views.UserCreateView.as_view(), name="register"),
+    path("register/batch", views.UserBatchCreateView.as_view(), name="register_batch"),
+    path("register/availability", views.EmailAvailabilityView.as_view(), name="email_availability"),
+    path("update", async_views.UserUpdateView.as_view(), name="update"),
+    path("change_password", async_views.ChangePasswordView.as_view(), name="change_password"),
+    path("delete", async_views.UserDeleteView.as_view(), name="delete"),
+    path("export", views.UserExportView.as_view(), name="export"),
+    path("users/bulk", views.UserBulkActionView.as_view(), name="bulk_users"),
+]
@@ -0,0 +1,266 @@
+"""
+Native async versions of the user endpoints.
+
+DRF views are synchronous, so under an ASGI server every request holds a
+thread while it waits on the database or the hashing pool. These views are
+plain Django async views using the async ORM and auth helpers: one worker can
+multiplex many slow clients. They answer with the same payloads as the views
+in views.py and are enabled with USERS_API_ASYNC_VIEWS (see backend/urls.py).
+"""
+
+import json
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import alogin, alogout, aupdate_session_auth_hash
+from django.http import HttpResponse, QueryDict
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.authentication import CSRFCheck
+from rest_framework.exceptions import ValidationError
+
+from backend.logging_config import logger
+from backend.settings import DEBUG
+
+from . import hashing, purge, renderers, signed_session
+from .models import AppUser, canonical_email
+from .fast_serializers import serialize_user
+from .serializers import UserSerializer, insert_user
+from .views import etag_matches, update_user
+
+NOT_AUTHENTICATED = {"detail": "Authentication credentials were not provided."}
+
+
+class DataResponse(HttpResponse):
+    """
+    Response keeping its data until `AsyncAPIView` renders it in the format
+    negotiated from the Accept header (JSON, or MessagePack)
+    """
+
+    def __init__(self, data, status=200, headers=None):
+        super().__init__(status=status, headers=headers)
+        self.data = data
+
+    def encode(self, accept):
+        renderer = renderers.negotiate(accept)
+        self.content = renderer.render(self.data)
+        self["Content-Type"] = renderer.media_type
+
+
+def hashing_busy_response():
+    return DataResponse(
+        {"error_msg": {"server_busy": ["Server is busy, please try again later"]}},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": "1"},
+    )
+
+
+def parse_body(request):
+    """
+    Return the request data like DRF's `request.data` (JSON, MessagePack, form or multipart)
+    """
+    content_type = request.content_type or ""
+    if content_type == "application/json":
+        return json.loads(request.body or b"{}")
+    if content_type == renderers.MSGPACK_MEDIA_TYPE and renderers.msgpack is not None:
+        return renderers.unpackb(request.body) if request.body else {}
+    if content_type == "multipart/form-data":
+        if request.method == "POST":
+            data, files = request.POST, request.FILES
+        else:
+            data, files = request.parse_file_upload(request.META, request)
+        data = data.copy()
+        data.update(files)
+        return data
+    if content_type == "application/x-www-form-urlencoded":
+        return QueryDict(request.body)
+    return {}
+
+
+def csrf_failure(request):
+    """
+    Same CSRF check as DRF's SessionAuthentication, only for logged in users
+    """
+    check = CSRFCheck(lambda request: None)
+    check.process_request(request)
+    reason = check.process_view(request, None, (), {})
+    if reason:
+        return DataResponse(
+            {"detail": f"CSRF Failed: {reason}"}, status=status.HTTP_403_FORBIDDEN
+        )
+    return None
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncAPIView(View):
+    """
+    Base view: parses the body, authenticates the user from the session and
+    renders the `DataResponse`s
+    """
+
+    login_required = True
+
+    async def dispatch(self, request, *args, **kwargs):
+        response = await self.process(request, *args, **kwargs)
+        if isinstance(response, DataResponse):
+            response.encode(request.headers.get("Accept"))
+        return response
+
+    async def process(self, request, *args, **kwargs):
+        try:
+            self.data = parse_body(request)
+        except ValueError:
+            return DataResponse(
+                {"detail": "Malformed request."}, status=status.HTTP_400_BAD_REQUEST
+            )
+        self.user = await request.auser()
+        # Resolve the lazy request.user too (used by e.g. update_session_auth_hash)
+        request.user = self.user
+        if self.user.is_authenticated and self.user.is_active:
+            response = csrf_failure(request)
+            if response:
+                return response
+        elif self.login_required:
+            return DataResponse(NOT_AUTHENTICATED, status=status.HTTP_403_FORBIDDEN)
+        return await super().dispatch(request, *args, **kwargs)
+
+    def serialize(self, user):
+        # Must provide the request to get the full URL of the avatar
+        return serialize_user(user, self.request)
+
+
+class UserRetrieveView(AsyncAPIView):
+    async def get(self, request):
+        user = self.user
+        if DEBUG:
+            logger.debug("User logged: %s", user)
+        if etag_matches(request.headers.get("If-None-Match"), user.etag):
+            return HttpResponse(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": user.etag})
+        return DataResponse(self.serialize(user), headers={"ETag": user.etag})
+
+
+class UserCreateView(AsyncAPIView):
+    login_required = False
+
+    async def post(self, request):
+        serializer = UserSerializer(data=self.data)
+        if not await sync_to_async(serializer.is_valid)():
+            return DataResponse(
+                {"error_msg": serializer.errors}, status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            password = await hashing.amake_password(serializer.validated_data["password"])
+        except hashing.HashingPoolBusy:
+            return hashing_busy_response()
+        user = AppUser(
+            email=serializer.validated_data["email"],
+            username=serializer.validated_data["username"],
+            password=password,
+        )
+        try:
+            await sync_to_async(insert_user)(user)
+        except ValidationError as e:
+            return DataResponse({"error_msg": e.detail}, status=status.HTTP_400_BAD_REQUEST)
+        logger.info("New user created: %s", user)
+        return HttpResponse(status=status.HTTP_201_CREATED)
+
+
+class UserUpdateView(AsyncAPIView):
+    async def put(self, request):
+        # Same checks, body and cookie as the sync view
+        return await sync_to_async(update_user)(request, self.data, DataResponse)
+
+
+class ChangePasswordView(AsyncAPIView):
+    async def post(self, request):
+        user = self.user
+        old_password = self.data.get("old_password")
+        new_password = self.data.get("new_password")
+        try:
+            valid_password = await hashing.acheck_password(old_password, user.password)
+        except hashing.HashingPoolBusy:
+            return hashing_busy_response()
+        if not valid_password:
+            return DataResponse(
+                {"error_msg": {"password": ["Invalid old password"]}},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            UserSerializer().validate_password(new_password or "")
+        except ValidationError as e:
+            return DataResponse(
+                {"error_msg": {"password": [str(e.detail[0])]}},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            user.password = await hashing.amake_password(new_password)
+        except hashing.HashingPoolBusy:
+            return hashing_busy_response()
+        await user.asave(update_fields=["password"])
+        logger.info("Password updated: %s", user)
+        # Update session to prevent logging out the user after changing the password
+        await aupdate_session_auth_hash(request, user)
+        response = DataResponse({"success_msg": "Password updated successfully"})
+        return signed_session.set_cookie(response, user)
+
+
+class UserDeleteView(AsyncAPIView):
+    async def delete(self, request):
+        user = self.user
+        await sync_to_async(purge.soft_delete)(user)
+        await alogout(request)
+        logger.info("User account deleted: %s", user)
+        response = DataResponse({"message": "User account deleted successfully"})
+        return signed_session.delete_cookie(response)
+
+
+class UserLogin(AsyncAPIView):
+    login_required = False
+
+    async def post(self, request):
+        email = self.data.get("email")
+        password = self.data.get("password")
+        if not email or not password:
+            return DataResponse(
+                {"error_msg": {"login_infos": ["Email and password are required"]}},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        user = await AppUser.objects.filter(email_normalized=canonical_email(email)).afirst()
+        try:
+            valid_password = (
+                user and user.is_active and await hashing.acheck_password(password, user.password)
+            )
+        except hashing.HashingPoolBusy:
+            return hashing_busy_response()
+        if not valid_password:
+            return DataResponse(
+                {"error_msg": {"invalid_login": ["Invalid email or password"]}},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        if hashing.must_update(user.password):
+            try:
+                user.password = await hashing.amake_password(password)
+                await user.asave(update_fields=["password"])
+            except hashing.HashingPoolBusy:
+                pass  # Upgraded on a later login
+
+        await alogin(request, user)
+        return signed_session.set_cookie(DataResponse(self.serialize(user)), user)
+
+
+class UserLogout(AsyncAPIView):
+    login_required = False
+
+    async def post(self, request):
+        if self.user.is_authenticated:
+            await sync_to_async(signed_session.revoke)(self.user.pk)
+            await alogout(request)
+            response = DataResponse({"success_msg": "User logged out successfully"})
+            return signed_session.delete_cookie(response)
+        return DataResponse(
+            {"error_msg": {"logout_error": ["User is not logged in"]}},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
@@ -0,0 +1,219 @@
+"""
+Email availability for the live validation of the register form.
+
+Each process keeps a Bloom filter (see bloom.py) of the normalized emails in
+memory: an email absent from it is available without a query, only possible
+hits (taken emails, and ERROR_RATE of the free ones) are confirmed with a
+lookup of the unique `email_normalized` index.
+
+The filter is maintained off the request path by a background thread: every
+REFRESH_INTERVAL seconds it adds the emails of the users registered or
+updated since its last pass, by any worker process (range scans of the
+primary key and of `updated_at`, overlapping by CLOCK_SKEW seconds), and
+every REBUILD_INTERVAL seconds it rebuilds the filter from the email column,
+which drops the emails no longer in use. Local registrations and updates are
+added right away (`post_save` receiver, bulk registrations). Until the first
+build completes, every check is answered by the index lookup.
+
+The endpoint answers anonymous clients, so `AvailabilityThrottle` limits each
+of them (by address, see REST_FRAMEWORK["NUM_PROXIES"]) in a cache shared by
+the worker processes: a system check refuses process-local backends, which
+would multiply the rate by the number of workers.
+"""
+
+import os
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.throttling import ScopedRateThrottle
+
+from backend import routers
+from backend.logging_config import logger
+
+from . import bloom
+from .models import AppUser, canonical_email
+from .signed_session import PROCESS_LOCAL_CACHES
+
+DEFAULTS = {
+    # Maintain the filter in a background thread (False = on the request path)
+    "ASYNC": True,
+    # Alias from CACHES counting the requests of each client
+    "THROTTLE_CACHE_ALIAS": "shared",
+    "ERROR_RATE": 0.01,
+    # Room for the registrations until the next rebuild
+    "HEADROOM": 10000,
+    # Seconds between two reads of the newly registered and updated users
+    "REFRESH_INTERVAL": 1,
+    # Seconds each read goes back before the previous one (clocks of the
+    # workers, transactions committing after the update time they wrote)
+    "CLOCK_SKEW": 5,
+    # Seconds between two full rebuilds
+    "REBUILD_INTERVAL": 300,
+}
+
+_filter = None
+# Emails the filter was sized for, and added so far
+_capacity = 0
+_count = 0
+# Highest user id in the filter, and start of the last read of the updates
+_last_id = 0
+_read_at = None
+_built_at = 0
+_refreshed_at = 0
+_lock = threading.Lock()
+# Process the refresh thread runs in (it doesn't survive a fork)
+_thread_pid = None
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, "EMAIL_AVAILABILITY", {}))
+    return config
+
+
+def build():
+    read_at = timezone.now()
+    rows = list(AppUser.objects.values_list("user_id", "email_normalized"))
+    config = get_config()
+    capacity = 2 * len(rows) + config["HEADROOM"]
+    email_filter = bloom.BloomFilter.for_capacity(capacity, config["ERROR_RATE"])
+    for _, email in rows:
+        email_filter.add(email)
+    last_id = max((user_id for user_id, _ in rows), default=0)
+    return email_filter, capacity, len(rows), last_id, read_at
+
+
+@routers.primary()
+def refresh():
+    """
+    Rebuild the filter when due, otherwise add the users registered or
+    updated since the last refresh
+    """
+    global _filter, _capacity, _count, _last_id, _read_at, _built_at, _refreshed_at
+    config = get_config()
+    now = time.monotonic()
+    if _filter is None or now - _built_at > config["REBUILD_INTERVAL"]:
+        # Built without the lock, the requests keep using the previous filter
+        email_filter, capacity, count, last_id, read_at = build()
+        with _lock:
+            _filter, _capacity, _count = email_filter, capacity, count
+            _last_id, _read_at = last_id, read_at
+            _built_at = _refreshed_at = now
+        return
+    read_at = timezone.now()
+    since = _read_at - timedelta(seconds=config["CLOCK_SKEW"])
+    rows = list(
+        AppUser.objects.filter(Q(pk__gt=_last_id) | Q(updated_at__gte=since))
+        .order_by("pk")
+        .values_list("user_id", "email_normalized")
+    )
+    if rows:
+        add(*(email for _, email in rows))
+        _last_id = max(_last_id, rows[-1][0])
+    _read_at = read_at
+    _refreshed_at = now
+
+
+def _refresh_loop():
+    while True:
+        try:
+            refresh()
+        except Exception:
+            logger.exception("Email availability filter refresh failed")
+        finally:
+            connection.close_if_unusable_or_obsolete()
+        time.sleep(get_config()["REFRESH_INTERVAL"])
+
+
+def get_filter():
+    """
+    Return the filter, or None while it's being built
+    """
+    global _thread_pid
+    config = get_config()
+    if config["ASYNC"]:
+        if _thread_pid != os.getpid():
+            with _lock:
+                if _thread_pid != os.getpid():
+                    threading.Thread(
+                        target=_refresh_loop, name="email-availability", daemon=True
+                    ).start()
+                    _thread_pid = os.getpid()
+    elif _filter is None or time.monotonic() - _refreshed_at > config["REFRESH_INTERVAL"]:
+        refresh()
+    return _filter
+
+
+def add(*emails):
+    """
+    Record new emails (normalized) in the filter, if it's built
+    """
+    global _filter, _count
+    with _lock:
+        if _filter is None:
+            return
+        for email in emails:
+            # Already present (e.g. a save keeping the email): no capacity used
+            if email not in _filter:
+                _filter.add(email)
+                _count += 1
+        if _count > _capacity:
+            # Too many false positives past its capacity: rebuild
+            _filter = None
+
+
+def add_on_save(sender, instance, update_fields=None, **kwargs):
+    """`post_save` receiver"""
+    # e.g. the last_login saves of every login (saves keeping the email are skipped by add)
+    if update_fields is not None and "email_normalized" not in update_fields:
+        return
+    add(instance.email_normalized)
+
+
+def reset():
+    global _filter
+    with _lock:
+        _filter = None
+
+
+def is_taken(email):
+    email = canonical_email(email)
+    email_filter = get_filter()
+    if email_filter is not None and email not in email_filter:
+        return False
+    return AppUser.objects.filter(email_normalized=email).exists()
+
+
+def check_throttle_cache(app_configs, **kwargs):
+    """
+    System check: the request counts must be shared by every worker process
+    """
+    alias = get_config()["THROTTLE_CACHE_ALIAS"]
+    backend = settings.CACHES.get(alias, {}).get("BACKEND")
+    if backend is None or backend in PROCESS_LOCAL_CACHES:
+        return [
+            checks.Error(
+                f"EMAIL_AVAILABILITY['THROTTLE_CACHE_ALIAS'] ({alias!r}) is not a cache "
+                "shared by the worker processes: each one would allow the full rate.",
+                hint="Point it to a FileBasedCache, Redis or Memcached entry of CACHES.",
+                id="users_api.E002",
+            )
+        ]
+    return []
+
+
+class AvailabilityThrottle(ScopedRateThrottle):
+    """
+    `ScopedRateThrottle` counting in THROTTLE_CACHE_ALIAS
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.cache = caches[get_config()["THROTTLE_CACHE_ALIAS"]]
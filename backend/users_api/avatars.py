@@ -0,0 +1,146 @@
+"""
+Avatar derivatives.
+
+Uploaded avatars can weigh several megabytes, so once a new avatar is saved
+small fixed-size copies are generated in a background thread. Derivatives are
+content addressed (named after the hash of the original upload): identical
+uploads share files and a name never points to different content, which lets
+them be cached forever.
+
+Recording the hash bumps the user's version with an UPDATE (no `post_save`):
+the cached copies of the worker generating the derivatives are dropped
+explicitly, the other workers serve the previous ETag and an empty
+`avatar_thumbnails` until their copy expires (USER_CACHE["TTL"]).
+"""
+
+import hashlib
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from backend import routers
+from backend.logging_config import logger
+
+DEFAULTS = {
+    "SIZES": (64, 128, 256),
+    "FORMATS": ("webp", "jpeg"),
+    # Storage directory of the derivatives
+    "DIRECTORY": "avatars",
+    "QUALITY": 85,
+    # Generate derivatives in a background thread (False = inline)
+    "ASYNC": True,
+    "WORKERS": 2,
+}
+
+EXTENSIONS = {"webp": "webp", "jpeg": "jpg"}
+
+_lock = threading.Lock()
+_executor = None
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, "AVATAR_DERIVATIVES", {}))
+    return config
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=get_config()["WORKERS"], thread_name_prefix="avatars"
+                )
+    return _executor
+
+
+def derivative_name(digest, size, fmt):
+    config = get_config()
+    return f"{config['DIRECTORY']}/{digest}-{size}.{EXTENSIONS[fmt]}"
+
+
+def derivative_names(digest):
+    """
+    Return {size: {format: storage name}} for an avatar hash
+    """
+    config = get_config()
+    return {
+        size: {fmt: derivative_name(digest, size, fmt) for fmt in config["FORMATS"]}
+        for size in config["SIZES"]
+    }
+
+
+def render_derivative(image, size, fmt):
+    config = get_config()
+    thumbnail = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+    if fmt == "jpeg" and thumbnail.mode != "RGB":
+        thumbnail = thumbnail.convert("RGB")
+    buffer = io.BytesIO()
+    thumbnail.save(buffer, format=fmt.upper(), quality=config["QUALITY"])
+    return buffer.getvalue()
+
+
+# Scheduled right after the avatar is saved, a replica may not have it yet
+@routers.primary()
+def generate_derivatives(user_id):
+    """
+    Create the derivatives of a user's current avatar and record its hash
+    """
+    from . import signed_session, user_cache
+    from .models import AppUser
+
+    user = AppUser.objects.filter(pk=user_id).only("avatar").first()
+    if not user or not user.avatar:
+        return None
+    avatar_name = user.avatar.name
+
+    with default_storage.open(avatar_name, "rb") as f:
+        content = f.read()
+    digest = hashlib.sha256(content).hexdigest()[:32]
+
+    image = None
+    for size, names in derivative_names(digest).items():
+        for fmt, name in names.items():
+            if default_storage.exists(name):
+                continue
+            if image is None:
+                image = ImageOps.exif_transpose(Image.open(io.BytesIO(content)))
+            default_storage.save(name, ContentFile(render_derivative(image, size, fmt)))
+
+    # Only record the hash if the avatar wasn't replaced in the meantime
+    AppUser.objects.filter(pk=user_id, avatar=avatar_name).update(
+        avatar_hash=digest, version=F("version") + 1, updated_at=timezone.now()
+    )
+    signed_session.revoke(user_id)
+    user_cache.invalidate(user_id)
+    logger.info("Avatar derivatives generated for user %s: %s", user_id, digest)
+    return digest
+
+
+def _run(user_id):
+    try:
+        generate_derivatives(user_id)
+    except Exception:
+        logger.exception("Avatar derivatives failed for user %s", user_id)
+    finally:
+        # Worker threads get their own connection, don't leak it
+        connection.close()
+
+
+def schedule_derivatives(user):
+    """
+    Generate the derivatives of `user`'s avatar once the transaction commits
+    """
+    if get_config()["ASYNC"]:
+        transaction.on_commit(lambda: _get_executor().submit(_run, user.pk))
+    else:
+        transaction.on_commit(lambda: generate_derivatives(user.pk))
@@ -0,0 +1,123 @@
+"""
+Bloom filters.
+
+A `BloomFilter` answers "maybe present" or "certainly absent" with a fixed
+number of bit probes, whatever the number of items, in about 1.8 bytes per
+item at a 1/1000 false positive rate. Its bits live in a `bytearray` for a
+filter built in memory, or in a memory-mapped file (`build` / `load`): the
+worker processes of a host then share one copy through the page cache, and
+only the pages actually probed are read from disk.
+
+Items are hashed with SHA-1, the format of breached password lists such as
+Pwned Passwords (which can then be loaded without knowing the passwords); the
+probe positions are derived from the digest by double hashing.
+"""
+
+import hashlib
+import math
+import mmap
+import os
+import struct
+import tempfile
+
+MAGIC = b"UAPIBLM1"
+# Magic, number of bits, number of probes, flags (free for the caller)
+HEADER = struct.Struct("<8sQII")
+
+
+def digest(item):
+    if isinstance(item, str):
+        item = item.encode()
+    return hashlib.sha1(item).digest()
+
+
+def optimal_size(capacity, error_rate):
+    """
+    Return (num_bits, num_hashes) for `capacity` items at `error_rate`
+    """
+    capacity = max(capacity, 1)
+    num_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+    num_bits = max(64, (num_bits + 7) // 8 * 8)
+    num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+    return num_bits, num_hashes
+
+
+class BloomFilter:
+    def __init__(self, num_bits, num_hashes, bits=None, offset=0, flags=0):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        # Any buffer indexable by byte (bytearray, mmap), the bits starting at offset
+        self.bits = bytearray(num_bits // 8) if bits is None else bits
+        self.offset = offset
+        self.flags = flags
+
+    @classmethod
+    def for_capacity(cls, capacity, error_rate=0.001):
+        return cls(*optimal_size(capacity, error_rate))
+
+    def positions(self, item_digest):
+        h1 = int.from_bytes(item_digest[:8], "little")
+        h2 = int.from_bytes(item_digest[8:16], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add_digest(self, item_digest):
+        bits, offset = self.bits, self.offset
+        for position in self.positions(item_digest):
+            bits[offset + (position >> 3)] |= 1 << (position & 7)
+
+    def contains_digest(self, item_digest):
+        bits, offset = self.bits, self.offset
+        return all(
+            bits[offset + (position >> 3)] & (1 << (position & 7))
+            for position in self.positions(item_digest)
+        )
+
+    def add(self, item):
+        self.add_digest(digest(item))
+
+    def __contains__(self, item):
+        return self.contains_digest(digest(item))
+
+
+def build(path, digests, capacity, error_rate=0.001, flags=0):
+    """
+    Write a filter of `digests` to `path`, through a memory map so that filters
+    larger than the memory can be built; the file is replaced atomically.
+    Return the number of digests added.
+    """
+    num_bits, num_hashes = optimal_size(capacity, error_rate)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".bloom-")
+    count = 0
+    try:
+        with os.fdopen(fd, "r+b") as f:
+            f.write(HEADER.pack(MAGIC, num_bits, num_hashes, flags))
+            f.truncate(HEADER.size + num_bits // 8)
+            with mmap.mmap(f.fileno(), 0) as bits:
+                bloom = BloomFilter(num_bits, num_hashes, bits, HEADER.size, flags)
+                for item_digest in digests:
+                    bloom.add_digest(item_digest)
+                    count += 1
+                bits.flush()
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return count
+
+
+def load(path):
+    """
+    Memory-map the filter written by `build` (read-only)
+    """
+    with open(path, "rb") as f:
+        bits = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(bits) < HEADER.size:
+        magic, num_bits, num_hashes, flags = b"", 0, 0, 0
+    else:
+        magic, num_bits, num_hashes, flags = HEADER.unpack_from(bits)
+    if magic != MAGIC or len(bits) != HEADER.size + num_bits // 8:
+        bits.close()
+        raise ValueError(f"{path} is not a Bloom filter file")
+    return BloomFilter(num_bits, num_hashes, bits, HEADER.size, flags)
@@ -0,0 +1,148 @@
+"""
+Bulk user creation.
+
+Shared by the `import_users` management command and the batch registration
+endpoint. Rows are validated with the same rules as the registration
+endpoint, passwords are hashed in parallel by the hashing pool and users are
+inserted with `bulk_create`, one transaction per chunk.
+"""
+
+import csv
+import json
+
+from django.db import IntegrityError, transaction
+from rest_framework.exceptions import ValidationError
+
+from . import availability, hashing
+from .models import AppUser, canonical_email
+from .serializers import EMAIL_TAKEN, UserSerializer
+
+
+class BulkUserSerializer(UserSerializer):
+    """
+    Validate a user without the per-row uniqueness query: emails are checked
+    for a whole chunk at once by `create_users`.
+    """
+
+    def validate_email(self, value):
+        return value
+
+
+def iter_csv(f):
+    """
+    Yield (line number, row) for each row of a CSV file with a header
+    """
+    reader = csv.DictReader(f)
+    for row in reader:
+        # Line the row ends on (quoted values can span several lines)
+        yield reader.line_num, row
+
+
+def iter_jsonl(f):
+    """
+    Yield (line number, row) for each non-blank line of a JSONL file
+    """
+    for line_number, line in enumerate(f, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError:
+            # Rejected by the validation like any other malformed row
+            yield line_number, line
+
+
+READERS = {"csv": iter_csv, "jsonl": iter_jsonl}
+
+
+def iter_chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def create_users(rows, seen_emails=None):
+    """
+    Validate, hash and insert a chunk of rows in a single transaction.
+
+    `rows` is a list of dicts with email, username and password. Returns
+    (created users, rejects) where rejects is a list of (index, errors).
+    `seen_emails` collects the emails already taken in previous chunks.
+    """
+    if seen_emails is None:
+        seen_emails = set()
+    validator = BulkUserSerializer()
+    rejects = []
+    valid = []
+    for index, row in enumerate(rows):
+        try:
+            data = validator.run_validation(row)
+        except ValidationError as e:
+            rejects.append((index, e.detail))
+            continue
+        data["email"] = AppUser.objects.normalize_email(data["email"])
+        data["email_normalized"] = canonical_email(data["email"])
+        valid.append((index, data))
+
+    # Single query for the uniqueness check of the whole chunk
+    existing = set(
+        AppUser.objects.filter(
+            email_normalized__in=[data["email_normalized"] for _, data in valid]
+        ).values_list("email_normalized", flat=True)
+    )
+    unique = []
+    for index, data in valid:
+        key = data["email_normalized"]
+        if key in existing or key in seen_emails:
+            rejects.append((index, {"email": [EMAIL_TAKEN]}))
+            continue
+        seen_emails.add(key)
+        unique.append((index, data))
+
+    passwords = hashing.make_passwords([data["password"] for _, data in unique])
+    # bulk_create skips AppUser.save(), so email_normalized is set here
+    pending = [
+        (
+            index,
+            AppUser(
+                email=data["email"],
+                email_normalized=data["email_normalized"],
+                username=data["username"],
+                password=password,
+            ),
+        )
+        for (index, data), password in zip(unique, passwords)
+    ]
+    while True:
+        try:
+            with transaction.atomic():
+                created = AppUser.objects.bulk_create([user for _, user in pending])
+            break
+        except IntegrityError:
+            # Emails registered concurrently since the check: reject them and retry
+            taken = set(
+                AppUser.objects.filter(
+                    email_normalized__in=[user.email_normalized for _, user in pending]
+                ).values_list("email_normalized", flat=True)
+            )
+            if not taken:
+                # Not a duplicate email
+                raise
+            rejects.extend(
+                (index, {"email": [EMAIL_TAKEN]})
+                for index, user in pending
+                if user.email_normalized in taken
+            )
+            pending = [
+                (index, user) for index, user in pending if user.email_normalized not in taken
+            ]
+    # bulk_create doesn't send post_save
+    availability.add(*(user.email_normalized for user in created))
+    rejects.sort(key=lambda reject: reject[0])
+    return created, rejects
@@ -0,0 +1,153 @@
+"""
+Set-based admin operations on many users.
+
+Used by the bulk admin endpoint and the admin actions. Users are selected by
+ID list or filter, and changed with one UPDATE / DELETE per chunk of IDs
+instead of one save per user. Sessions of deactivated or deleted users are
+deleted in bulk too, through the session keys recorded at login
+(`UserSession`). Sessions opened before that table existed aren't tracked,
+they are still refused since the user is inactive or gone.
+"""
+
+from django.contrib.sessions.models import Session
+from django.db import transaction
+
+from backend.logging_config import logger
+
+from . import purge, session_backend, signed_session, user_cache
+from .models import AppUser, UserSession
+
+CHUNK_SIZE = 1000
+
+# action -> fields set by the UPDATE (None = delete the users)
+ACTIONS = {
+    "activate": {"is_active": True},
+    "deactivate": {"is_active": False},
+    "promote": {"is_admin": True},
+    "demote": {"is_admin": False},
+    "delete": None,
+}
+
+# Actions after which the users' sessions must go
+INVALIDATING_ACTIONS = {"deactivate", "delete"}
+
+# Lookups accepted in a filter
+FILTERS = {
+    "is_active",
+    "is_admin",
+    "email__iendswith",
+    "date_joined__lt",
+    "date_joined__gte",
+    "last_login__lt",
+    "last_login__isnull",
+}
+
+
+def iter_chunks(ids, size):
+    for start in range(0, len(ids), size):
+        yield ids[start : start + size]
+
+
+# === Sessions === #
+def track_session(sender, request, user, **kwargs):
+    """`user_logged_in` receiver recording the new session key"""
+    session = getattr(request, "session", None)
+    if session is None:
+        return
+    if session.session_key is None:
+        # Flushed by login() (another user was logged in): create the row now
+        session.save()
+    # Single INSERT, the key may already be recorded when a user logs in again
+    UserSession.objects.bulk_create(
+        [UserSession(session_key=session.session_key, user=user)], ignore_conflicts=True
+    )
+
+
+def rekey_session(old_session_key, new_session_key):
+    """
+    Follow a session whose key was rotated (`cycle_key`), so it's still invalidated
+    """
+    UserSession.objects.filter(session_key=old_session_key).update(session_key=new_session_key)
+
+
+def untrack_session(sender, request, user, **kwargs):
+    """`user_logged_out` receiver"""
+    session_key = getattr(request, "session", None) and request.session.session_key
+    if session_key:
+        UserSession.objects.filter(session_key=session_key).delete()
+
+
+def invalidate_sessions(user_ids, chunk_size=CHUNK_SIZE):
+    """
+    Delete every recorded session of `user_ids`, return the number of sessions deleted
+    """
+    deleted = 0
+    for chunk in iter_chunks(list(user_ids), chunk_size):
+        session_keys = list(
+            UserSession.objects.filter(user_id__in=chunk).values_list("session_key", flat=True)
+        )
+        if not session_keys:
+            continue
+        with transaction.atomic():
+            deleted += Session.objects.filter(session_key__in=session_keys).delete()[0]
+            UserSession.objects.filter(session_key__in=session_keys).delete()
+        session_backend.evict(session_keys)
+    return deleted
+
+
+# === Users === #
+def select_users(ids=None, filters=None, exclude=None):
+    """
+    IDs of the users matching an ID list or a filter (dict of FILTERS lookups)
+    """
+    users = AppUser.objects.all()
+    if ids is not None:
+        users = users.filter(pk__in=ids)
+    if filters:
+        unknown = set(filters) - FILTERS
+        if unknown:
+            raise ValueError(f"Unknown filters: {', '.join(sorted(unknown))}")
+        users = users.filter(**filters)
+    if exclude is not None:
+        users = users.exclude(pk=exclude)
+    return list(users.order_by("pk").values_list("pk", flat=True))
+
+
+def apply(action, user_ids, chunk_size=CHUNK_SIZE):
+    """
+    Apply `action` to `user_ids` chunk by chunk.
+
+    Returns the number of users changed and of sessions deleted.
+    """
+    if action not in ACTIONS:
+        raise ValueError(f"Unknown action: {action}")
+    user_ids = list(user_ids)
+
+    sessions = 0
+    if action in INVALIDATING_ACTIONS:
+        # Before the users go: deleting them cascades to their UserSession rows
+        sessions = invalidate_sessions(user_ids, chunk_size)
+
+    changed = 0
+    fields = ACTIONS[action]
+    for chunk in iter_chunks(user_ids, chunk_size):
+        # UPDATE and DELETE don't send post_save: drop the cached copies here
+        signed_session.revoke(*chunk)
+        user_cache.invalidate(*chunk)
+        with transaction.atomic():
+            if fields is None:
+                # Related rows (groups, permissions, sessions, admin log) are deleted
+                # by Django in a few set-based statements per chunk
+                changed += AppUser.objects.filter(pk__in=chunk).delete()[1].get(
+                    AppUser._meta.label, 0
+                )
+            else:
+                changed += AppUser.objects.filter(pk__in=chunk).update(**fields)
+            if action == "activate":
+                # Deleted accounts restored before their purge ran
+                purge.cancel(*chunk)
+
+    logger.info(
+        "Bulk %s: %s users changed, %s sessions deleted", action, changed, sessions
+    )
+    return changed, sessions
@@ -0,0 +1,68 @@
+"""
+Streaming user export.
+
+The table is walked with keyset pagination on `user_id` (no OFFSET, no
+materialized queryset) and rendered chunk by chunk, so memory stays flat
+whatever the number of users. Used by `UserExportView` and the
+`export_users` management command.
+"""
+
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import AppUser
+
+FIELDS = ("user_id", "email", "username", "is_active", "is_admin", "date_joined", "last_login")
+
+
+def iter_chunks(chunk_size=1000):
+    """
+    Yield lists of user rows (tuples ordered like FIELDS)
+    """
+    last_id = 0
+    while True:
+        rows = list(
+            AppUser.objects.filter(user_id__gt=last_id)
+            .order_by("user_id")
+            .values_list(*FIELDS)[:chunk_size]
+        )
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+class _Echo:
+    # File-like object handing back what csv.writer writes
+    def write(self, value):
+        return value
+
+
+def render_csv(chunks):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(FIELDS)
+    for rows in chunks:
+        yield "".join(writer.writerow(row) for row in rows)
+
+
+def render_jsonl(chunks):
+    for rows in chunks:
+        yield "".join(
+            json.dumps(dict(zip(FIELDS, row)), cls=DjangoJSONEncoder) + "\n" for row in rows
+        )
+
+
+RENDERERS = {
+    "csv": (render_csv, "text/csv"),
+    "jsonl": (render_jsonl, "application/jsonl"),
+}
+
+
+def export(file_format="csv", chunk_size=1000):
+    """
+    Return (iterator of str, content type) for the whole user table
+    """
+    render, content_type = RENDERERS[file_format]
+    return render(iter_chunks(chunk_size)), content_type
@@ -0,0 +1,87 @@
+"""
+Precompiled output path of the serializers.
+
+Instantiating a `ModelSerializer` builds its fields again (model
+introspection and deep copies) on every response. `compile_serializer` does
+it once, at import time, and turns the readable fields into a list of small
+getters; the resulting function renders an instance to the same dict as
+`serializer.data`, which the tests check byte for byte.
+
+Supported fields: plain model fields (strings, integers, booleans), file and
+image fields and `SerializerMethodField`s whose method only uses
+`self.context`. Any other field goes through its own `to_representation`.
+"""
+
+from operator import attrgetter
+
+from rest_framework import serializers
+from rest_framework.settings import api_settings
+
+from .serializers import UserSerializer
+
+STRING_FIELDS = (serializers.CharField, serializers.EmailField)
+PLAIN_FIELDS = (serializers.IntegerField, serializers.BooleanField)
+
+
+class _Context:
+    # Stands in for the serializer instance when calling a SerializerMethodField
+    __slots__ = ("context",)
+
+    def __init__(self, context):
+        self.context = context
+
+
+def _file_url(value, request):
+    # FileField.to_representation with use_url
+    if not value:
+        return None
+    try:
+        url = value.url
+    except AttributeError:
+        return None
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+def _compile_field(serializer_class, field):
+    get = attrgetter(field.source)
+    field_class = type(field)
+    if isinstance(field, serializers.SerializerMethodField):
+        method = getattr(serializer_class, field.method_name)
+        return lambda instance, context: method(context, instance)
+    if isinstance(field, serializers.FileField) and getattr(field, "use_url", api_settings.UPLOADED_FILES_USE_URL):
+        return lambda instance, context: _file_url(
+            get(instance), context.context.get("request")
+        )
+    if field_class in STRING_FIELDS:
+        # CharField.to_representation is str(), whitespace is only trimmed on input
+        return lambda instance, context: _none_or(get(instance), str)
+    if field_class in PLAIN_FIELDS:
+        to_representation = int if field_class is serializers.IntegerField else bool
+        return lambda instance, context: _none_or(get(instance), to_representation)
+    return lambda instance, context: _none_or(
+        field.get_attribute(instance), field.to_representation
+    )
+
+
+def _none_or(value, to_representation):
+    return None if value is None else to_representation(value)
+
+
+def compile_serializer(serializer_class):
+    """
+    Return `render(instance, request=None)` producing `serializer_class(instance).data`
+    """
+    fields = [
+        (name, _compile_field(serializer_class, field))
+        for name, field in serializer_class().fields.items()
+        if not field.write_only
+    ]
+
+    def render(instance, request=None):
+        context = _Context({"request": request})
+        return {name: getter(instance, context) for name, getter in fields}
+
+    return render
+
+
+serialize_user = compile_serializer(UserSerializer)
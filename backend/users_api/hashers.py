@@ -0,0 +1,43 @@
+"""
+Password hashers tuned for the host.
+
+`manage.py calibrate_hasher` measures the hashers on the host and writes their
+cost parameters to PASSWORD_HASHER_CALIBRATION_FILE; settings.py loads it into
+PASSWORD_HASHER_CALIBRATION and puts the chosen algorithm first in
+PASSWORD_HASHERS. Without calibration these hashers behave like Django's, and
+a calibration can only raise their cost above Django's defaults: a slow host
+never weakens the hashes it upgrades.
+
+Hashes made with other parameters keep working and are upgraded on the next
+successful login (see `hashing.must_update`).
+"""
+
+from django.conf import settings
+from django.contrib.auth.hashers import (
+    Argon2PasswordHasher,
+    PBKDF2PasswordHasher,
+    ScryptPasswordHasher,
+)
+
+
+def calibrated(key, default):
+    return max(getattr(settings, "PASSWORD_HASHER_CALIBRATION", {}).get(key, default), default)
+
+
+class CalibratedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    @property
+    def iterations(self):
+        return calibrated("pbkdf2_iterations", PBKDF2PasswordHasher.iterations)
+
+
+class CalibratedScryptPasswordHasher(ScryptPasswordHasher):
+    @property
+    def work_factor(self):
+        return calibrated("scrypt_work_factor", ScryptPasswordHasher.work_factor)
+
+
+class CalibratedArgon2PasswordHasher(Argon2PasswordHasher):
+    # Needs the argon2-cffi package
+    @property
+    def time_cost(self):
+        return calibrated("argon2_time_cost", Argon2PasswordHasher.time_cost)
@@ -0,0 +1,173 @@
+"""
+Password hashing executor.
+
+Password hashers are slow on purpose, so hashing on the request thread lets a
+burst of logins pin every worker. Hashing jobs are submitted to a process pool
+sized to the host's cores instead, and a semaphore bounds how many jobs may be
+waiting at once: when the queue is full the caller gets `HashingPoolBusy`
+(answered with a 503 by the views) rather than an ever growing latency.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import hashers
+
+from backend.metrics import observe_password_hash
+
+DEFAULTS = {
+    # Number of worker processes (None = one per core, 0 = hash inline)
+    "WORKERS": None,
+    # Number of jobs allowed to wait for a free worker
+    "QUEUE_DEPTH": 64,
+    # Seconds to wait for a queue slot before giving up
+    "QUEUE_TIMEOUT": 5,
+}
+
+_lock = threading.Lock()
+_executor = None
+_slots = None
+
+
+class HashingPoolBusy(Exception):
+    """Raised when the hashing queue is full."""
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, "PASSWORD_HASHING", {}))
+    if config["WORKERS"] is None:
+        config["WORKERS"] = os.cpu_count() or 1
+    return config
+
+
+def _init_worker(settings_module):
+    # Needed when processes are spawned rather than forked (e.g. macOS)
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", settings_module)
+    import django
+
+    django.setup()
+
+
+def _get_executor():
+    global _executor, _slots
+    if _slots is None:
+        with _lock:
+            if _slots is None:
+                config = get_config()
+                if config["WORKERS"]:
+                    _executor = ProcessPoolExecutor(
+                        max_workers=config["WORKERS"],
+                        initializer=_init_worker,
+                        initargs=(os.environ["DJANGO_SETTINGS_MODULE"],),
+                    )
+                _slots = threading.BoundedSemaphore(
+                    config["WORKERS"] + config["QUEUE_DEPTH"]
+                )
+    return _executor, _slots
+
+
+def shutdown():
+    """Stop the worker processes (a new pool is created on next use)."""
+    global _executor, _slots
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+        _executor = None
+        _slots = None
+
+
+def submit(fn, *args):
+    """
+    Submit a hashing job and return a `concurrent.futures.Future`.
+
+    Raises `HashingPoolBusy` if no queue slot frees up within QUEUE_TIMEOUT.
+    """
+    executor, slots = _get_executor()
+    if not slots.acquire(timeout=get_config()["QUEUE_TIMEOUT"]):
+        raise HashingPoolBusy("Password hashing queue is full")
+
+    if executor is None:
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            slots.release()
+        return future
+
+    try:
+        future = executor.submit(fn, *args)
+    except Exception:
+        slots.release()
+        raise
+    future.add_done_callback(lambda _: slots.release())
+    return future
+
+
+# === Jobs (run in the worker processes) === #
+def _check_password(password, encoded):
+    return hashers.check_password(password, encoded)
+
+
+def _make_password(password):
+    return hashers.make_password(password)
+
+
+def must_update(encoded):
+    """
+    Whether `encoded` was made with another hasher or other costs than the
+    current default one (e.g. before `calibrate_hasher` ran).
+    """
+    try:
+        hasher = hashers.identify_hasher(encoded)
+    except ValueError:
+        return False
+    default = hashers.get_hasher("default")
+    return hasher.algorithm != default.algorithm or default.must_update(encoded)
+
+
+# === Sync API === #
+def check_password(password, encoded):
+    """Pool-backed equivalent of `django.contrib.auth.hashers.check_password`."""
+    start = time.perf_counter()
+    result = submit(_check_password, password, encoded).result()
+    observe_password_hash("check", time.perf_counter() - start)
+    return result
+
+
+def make_password(password):
+    """Pool-backed equivalent of `django.contrib.auth.hashers.make_password`."""
+    start = time.perf_counter()
+    result = submit(_make_password, password).result()
+    observe_password_hash("make", time.perf_counter() - start)
+    return result
+
+
+def make_passwords(passwords):
+    """Hash many passwords at once, spreading them over the whole pool."""
+    futures = [submit(_make_password, password) for password in passwords]
+    return [future.result() for future in futures]
+
+
+# === Async API === #
+async def acheck_password(password, encoded):
+    start = time.perf_counter()
+    # Waiting for a queue slot blocks, so do it off the event loop
+    future = await asyncio.to_thread(submit, _check_password, password, encoded)
+    result = await asyncio.wrap_future(future)
+    observe_password_hash("check", time.perf_counter() - start)
+    return result
+
+
+async def amake_password(password):
+    start = time.perf_counter()
+    future = await asyncio.to_thread(submit, _make_password, password)
+    result = await asyncio.wrap_future(future)
+    observe_password_hash("make", time.perf_counter() - start)
+    return result
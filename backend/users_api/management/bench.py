@@ -0,0 +1,40 @@
+"""
+Fixture and timing shared by the bench_* management commands.
+"""
+
+import statistics
+import time
+
+from django.test import RequestFactory
+
+from users_api.models import AppUser
+
+
+def make_user():
+    """
+    Unsaved user: the benchmarks don't touch the database
+    """
+    return AppUser(
+        user_id=42,
+        email="bench@test.com",
+        username="bench",
+        avatar="media/bench.png",
+        avatar_hash="0123456789abcdef0123456789abcdef",
+    )
+
+
+def make_request():
+    return RequestFactory().get("/api/user", HTTP_HOST="localhost")
+
+
+def measure(function, iterations, rounds):
+    """
+    Return the median over `rounds` of the time of a call to `function`, in µs
+    """
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            function()
+        timings.append((time.perf_counter() - start) / iterations * 1e6)
+    return statistics.median(timings)
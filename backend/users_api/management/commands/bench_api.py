@@ -0,0 +1,226 @@
+import json
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import (
+    CaptureQueriesContext,
+    setup_test_environment,
+    teardown_test_environment,
+)
+from django.urls import reverse
+
+from users_api.models import AppUser, canonical_email
+
+PASSWORDS = ("Benchpassword1", "Benchpassword2")
+FLOWS = ("login", "register", "retrieve", "update", "change_password")
+DEFAULT_BASELINE = settings.BASE_DIR / "benchmarks" / "baseline.json"
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test the users_api endpoints against a temporary database seeded with "
+        "--users users: run each flow from --concurrency threads and report latency "
+        "percentiles, requests/s and queries per request. Compare with (or save) a baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=200, help="Seeded users")
+        parser.add_argument("--concurrency", type=int, default=4)
+        parser.add_argument("--requests", type=int, default=50, help="Requests per thread and flow")
+        parser.add_argument("--flows", nargs="+", choices=FLOWS, default=list(FLOWS))
+        parser.add_argument("--baseline", default=str(DEFAULT_BASELINE))
+        parser.add_argument(
+            "--save-baseline", action="store_true", help="Save the results as the new baseline"
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.25,
+            help="Allowed p95 / requests/s drift from the baseline (0.25 = 25%%)",
+        )
+
+    def handle(self, *args, **options):
+        if options["concurrency"] > options["users"]:
+            raise CommandError("--users must be at least --concurrency")
+
+        results = self.run_benchmark(options)
+        self.report(results)
+
+        baseline_path = Path(options["baseline"])
+        if options["save_baseline"]:
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            baseline_path.write_text(json.dumps(results, indent=2) + "\n")
+            self.stdout.write(self.style.SUCCESS(f"Baseline saved to {baseline_path}"))
+        elif baseline_path.exists():
+            regressions = self.compare(results, json.loads(baseline_path.read_text()), options)
+            if regressions:
+                raise CommandError("Regressions against the baseline:\n" + "\n".join(regressions))
+            self.stdout.write(self.style.SUCCESS("No regression against the baseline"))
+
+    # === Setup === #
+    def run_benchmark(self, options):
+        setup_test_environment()
+        # A file database: the in-memory test database doesn't cope with concurrent writers
+        tmp_dir = tempfile.TemporaryDirectory()
+        settings.DATABASES["default"].setdefault("TEST", {})["NAME"] = str(
+            Path(tmp_dir.name) / "bench.sqlite3"
+        )
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.seed(options["users"])
+            return {flow: self.run_flow(flow, options) for flow in options["flows"]}
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            tmp_dir.cleanup()
+
+    def seed(self, count):
+        # Every seeded user shares one hash, hashing N passwords would dominate the setup
+        password = make_password(PASSWORDS[0])
+        AppUser.objects.bulk_create(
+            (
+                AppUser(
+                    email=f"bench{i}@test.com",
+                    email_normalized=canonical_email(f"bench{i}@test.com"),
+                    username=f"bench{i}",
+                    password=password,
+                )
+                for i in range(count)
+            ),
+            batch_size=1000,
+        )
+
+    # === Flows === #
+    def run_flow(self, flow, options):
+        latencies = []
+        queries = []
+        errors = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(options["concurrency"])
+
+        def worker(index):
+            client = Client()
+            email = f"bench{index}@test.com"
+            state = {"password": PASSWORDS[0]}
+            if flow != "register":
+                self.login(client, email, state["password"])
+            local = []
+            local_queries = []
+            local_errors = 0
+            barrier.wait()
+            for i in range(options["requests"]):
+                start = time.perf_counter()
+                with CaptureQueriesContext(connection) as captured:
+                    try:
+                        response = self.request(flow, client, index, i, email, state)
+                    except Exception:
+                        # e.g. a 500 raised by the test client: counted, the run goes on
+                        response = None
+                local.append(time.perf_counter() - start)
+                local_queries.append(len(captured))
+                if response is None or response.status_code >= 400:
+                    local_errors += 1
+            connection.close()
+            with lock:
+                latencies.extend(local)
+                queries.extend(local_queries)
+                errors.append(local_errors)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(options["concurrency"])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        latencies_ms = sorted(latency * 1000 for latency in latencies)
+        if len(latencies_ms) >= 2:
+            quantiles = statistics.quantiles(latencies_ms, n=100, method="inclusive")
+        else:
+            # quantiles() needs two samples
+            quantiles = latencies_ms * 99 or [0] * 99
+        return {
+            "requests": len(latencies),
+            "errors": sum(errors),
+            "rps": round(len(latencies) / elapsed, 1),
+            "p50": round(quantiles[49], 2),
+            "p95": round(quantiles[94], 2),
+            "p99": round(quantiles[98], 2),
+            "queries_per_request": round(statistics.mean(queries or [0]), 2),
+        }
+
+    def login(self, client, email, password):
+        response = client.post(reverse("login"), {"email": email, "password": password})
+        if response.status_code != 200:
+            raise CommandError(f"Login failed for {email}: {response.status_code}")
+
+    def request(self, flow, client, index, i, email, state):
+        if flow == "login":
+            return client.post(reverse("login"), {"email": email, "password": state["password"]})
+        if flow == "register":
+            return client.post(
+                reverse("register"),
+                {
+                    "email": f"new{index}-{i}-{time.monotonic_ns()}@test.com",
+                    "username": f"new{index}",
+                    "password": PASSWORDS[0],
+                },
+            )
+        if flow == "retrieve":
+            return client.get(reverse("user"))
+        if flow == "update":
+            return client.put(
+                reverse("update"),
+                {"username": f"bench{index}-{i % 2}"},
+                content_type="application/json",
+            )
+        if flow == "change_password":
+            new_password = PASSWORDS[1] if state["password"] == PASSWORDS[0] else PASSWORDS[0]
+            response = client.post(
+                reverse("change_password"),
+                {"old_password": state["password"], "new_password": new_password},
+            )
+            if response.status_code == 200:
+                state["password"] = new_password
+            return response
+
+    # === Report === #
+    def report(self, results):
+        self.stdout.write(
+            f"{'flow':<16}{'requests':>9}{'errors':>8}{'req/s':>9}"
+            f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}"
+        )
+        for flow, result in results.items():
+            self.stdout.write(
+                f"{flow:<16}{result['requests']:>9}{result['errors']:>8}{result['rps']:>9}"
+                f"{result['p50']:>9}{result['p95']:>9}{result['p99']:>9}"
+                f"{result['queries_per_request']:>9}"
+            )
+
+    def compare(self, results, baseline, options):
+        tolerance = options["tolerance"]
+        regressions = []
+        for flow, result in results.items():
+            if flow not in baseline:
+                continue
+            base = baseline[flow]
+            if result["p95"] > base["p95"] * (1 + tolerance):
+                regressions.append(f"{flow}: p95 {result['p95']} ms (baseline {base['p95']} ms)")
+            if result["rps"] < base["rps"] * (1 - tolerance):
+                regressions.append(f"{flow}: {result['rps']} req/s (baseline {base['rps']} req/s)")
+            # Query counts are deterministic, any increase is a regression
+            if result["queries_per_request"] > base["queries_per_request"]:
+                regressions.append(
+                    f"{flow}: {result['queries_per_request']} queries/request "
+                    f"(baseline {base['queries_per_request']})"
+                )
+        return regressions
@@ -0,0 +1,51 @@
+import io
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.parsers import JSONParser
+
+from users_api import renderers
+from users_api.fast_serializers import serialize_user
+from users_api.management.bench import make_request, make_user, measure
+from users_api.serializers import UserSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the size and the encode/decode time of the user, login and error "
+        "payloads in JSON and MessagePack."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=20000)
+        parser.add_argument("--rounds", type=int, default=5)
+
+    def handle(self, *args, **options):
+        if renderers.msgpack is None:
+            raise CommandError("msgpack is not installed")
+        user = make_user()
+        request = make_request()
+        serializer = UserSerializer(data={"email": "bench.com", "username": "", "password": "a"})
+        serializer.is_valid()
+        payloads = {
+            # The login answers with the user too
+            "user / login": serialize_user(user, request),
+            "login error": {"error_msg": {"invalid_login": ["Invalid email or password"]}},
+            "validation errors": {"error_msg": serializer.errors},
+        }
+        iterations, rounds = options["iterations"], options["rounds"]
+        formats = {
+            "json": (renderers.FastJSONRenderer(), JSONParser()),
+            "msgpack": (renderers.MessagePackRenderer(), renderers.MessagePackParser()),
+        }
+
+        for name, data in payloads.items():
+            self.stdout.write(name)
+            for format_name, (renderer, parser) in formats.items():
+                content = renderer.render(data)
+                encode = measure(lambda: renderer.render(data), iterations, rounds)
+                # Decoded like a request body
+                decode = measure(lambda: parser.parse(io.BytesIO(content)), iterations, rounds)
+                self.stdout.write(
+                    f"  {format_name:<8} {len(content):5d} bytes  "
+                    f"encode {encode:6.2f} µs  decode {decode:6.2f} µs"
+                )
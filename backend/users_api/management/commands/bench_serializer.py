@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from users_api import renderers
+from users_api.fast_serializers import serialize_user
+from users_api.management.bench import make_request, make_user, measure
+from users_api.serializers import UserSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Microbenchmark of the user response body: UserSerializer + JSONRenderer "
+        "against the precompiled serializer + FastJSONRenderer (orjson when installed)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=20000)
+        parser.add_argument("--rounds", type=int, default=5)
+
+    def handle(self, *args, **options):
+        user = make_user()
+        request = make_request()
+        json_renderer = JSONRenderer()
+        fast_renderer = renderers.FastJSONRenderer()
+
+        def drf():
+            return json_renderer.render(UserSerializer(user, context={"request": request}).data)
+
+        def fast_dict():
+            return json_renderer.render(serialize_user(user, request))
+
+        def fast():
+            return fast_renderer.render(serialize_user(user, request))
+
+        if not drf() == fast_dict() == fast():
+            self.stderr.write("Outputs differ!")
+
+        baseline = None
+        for name, function in (
+            ("UserSerializer + JSONRenderer", drf),
+            ("serialize_user + JSONRenderer", fast_dict),
+            (
+                "serialize_user + FastJSONRenderer"
+                + ("" if renderers.orjson else " (orjson not installed)"),
+                fast,
+            ),
+        ):
+            per_call = measure(function, options["iterations"], options["rounds"])
+            baseline = baseline or per_call
+            self.stdout.write(
+                f"{name:<52} {per_call:8.2f} µs/response  "
+                f"saves {baseline - per_call:7.2f} µs  (x{baseline / per_call:.1f})"
+            )
@@ -0,0 +1,123 @@
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark concurrent SQLite reads/writes with each SQLITE_PROFILES entry: "
+        "a login-like write (user + session update) for every few user reads."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--requests", type=int, default=300, help="Requests per thread")
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument(
+            "--read-ratio", type=int, default=4, help="Reads per write (e.g. /api/user polls per login)"
+        )
+        parser.add_argument(
+            "--profiles", nargs="+", default=sorted(settings.SQLITE_PROFILES)
+        )
+
+    def handle(self, *args, **options):
+        for name in options["profiles"]:
+            profile = settings.SQLITE_PROFILES[name]
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                path = Path(tmp_dir) / "bench.sqlite3"
+                self.setup_database(path, options["users"], profile["PRAGMAS"])
+                result = self.run(path, profile, options)
+            self.stdout.write(
+                f"{name:<12} {result['rps']:>9.1f} req/s  "
+                f"writes p50 {result['p50']:.2f} ms  p95 {result['p95']:.2f} ms  "
+                f"p99 {result['p99']:.2f} ms  locked errors {result['errors']}"
+            )
+
+    def connect(self, path, pragmas):
+        # Same default timeout as Django's SQLite backend
+        conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        for pragma, value in pragmas.items():
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        return conn
+
+    def setup_database(self, path, users, pragmas):
+        conn = self.connect(path, pragmas)
+        conn.execute(
+            "CREATE TABLE users (id INTEGER PRIMARY KEY, email TEXT UNIQUE, last_login REAL)"
+        )
+        conn.execute(
+            "CREATE TABLE sessions (key TEXT PRIMARY KEY, data TEXT, expire_date REAL)"
+        )
+        conn.executemany(
+            "INSERT INTO users (id, email) VALUES (?, ?)",
+            ((i, f"user{i}@test.com") for i in range(users)),
+        )
+        conn.commit()
+        conn.close()
+
+    def run(self, path, profile, options):
+        pragmas = profile["PRAGMAS"]
+        # CONN_MAX_AGE = 0 means one connection per request
+        persistent = bool(profile["CONN_MAX_AGE"])
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+
+        def worker(thread_id):
+            conn = self.connect(path, pragmas) if persistent else None
+            local_latencies = []
+            local_errors = 0
+            for i in range(options["requests"]):
+                start = time.perf_counter()
+                request_conn = conn or self.connect(path, pragmas)
+                user_id = (thread_id * options["requests"] + i) % options["users"]
+                try:
+                    if i % (options["read_ratio"] + 1) == 0:
+                        request_conn.execute(
+                            "UPDATE users SET last_login = ? WHERE id = ?", (time.time(), user_id)
+                        )
+                        request_conn.execute(
+                            "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)",
+                            (f"session-{user_id}", "x" * 200, time.time() + 3600),
+                        )
+                        request_conn.commit()
+                        local_latencies.append(time.perf_counter() - start)
+                    else:
+                        request_conn.execute(
+                            "SELECT * FROM users WHERE id = ?", (user_id,)
+                        ).fetchone()
+                except sqlite3.OperationalError:
+                    request_conn.rollback()
+                    local_errors += 1
+                finally:
+                    if not persistent:
+                        request_conn.close()
+            if conn:
+                conn.close()
+            with lock:
+                latencies.extend(local_latencies)
+                errors.append(local_errors)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(options["threads"])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        latencies_ms = sorted(latency * 1000 for latency in latencies) or [0]
+        quantiles = statistics.quantiles(latencies_ms, n=100) if len(latencies_ms) > 1 else latencies_ms * 99
+        return {
+            "rps": options["threads"] * options["requests"] / elapsed,
+            "p50": quantiles[49],
+            "p95": quantiles[94],
+            "p99": quantiles[98],
+            "errors": sum(errors),
+        }
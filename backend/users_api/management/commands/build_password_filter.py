@@ -0,0 +1,69 @@
+import time
+
+from django.contrib.auth.password_validation import CommonPasswordValidator
+from django.core.management.base import BaseCommand, CommandError
+
+from users_api import bloom, password_filter
+
+
+class Command(BaseCommand):
+    help = (
+        "Compile a list of passwords (one per line, gzipped or not; Django's common "
+        "passwords by default) or of SHA-1 hashes (--sha1, e.g. Pwned Passwords' "
+        '"HASH:count" lines) into the Bloom filter file read by the password validation.'
+    )
+
+    def add_arguments(self, parser):
+        config = password_filter.get_config()
+        parser.add_argument(
+            "source",
+            nargs="?",
+            default=CommonPasswordValidator().DEFAULT_PASSWORD_LIST_PATH,
+        )
+        parser.add_argument("--sha1", action="store_true", help="The source lists SHA-1 hashes")
+        parser.add_argument("--output", default=config["PATH"])
+        parser.add_argument("--error-rate", type=float, default=config["ERROR_RATE"])
+        parser.add_argument(
+            "--capacity",
+            type=int,
+            help="Number of entries of the source (counted with a first pass by default)",
+        )
+
+    def handle(self, *args, **options):
+        if not options["output"]:
+            raise CommandError("Set PASSWORD_FILTER['PATH'] or pass --output")
+        if not 0 < options["error_rate"] < 1:
+            raise CommandError("--error-rate must be between 0 and 1")
+        source = options["source"]
+        capacity = options["capacity"]
+        if capacity is None:
+            capacity = sum(1 for _ in password_filter.read_passwords(source))
+        start = time.perf_counter()
+        if options["sha1"]:
+            digests = (self.parse_hash(line) for line in password_filter.read_passwords(source))
+            flags = 0
+        else:
+            digests = (
+                bloom.digest(password.lower())
+                for password in password_filter.read_passwords(source)
+            )
+            flags = password_filter.LOWERCASE
+        count = bloom.build(options["output"], digests, capacity, options["error_rate"], flags)
+        num_bits, num_hashes = bloom.optimal_size(capacity, options["error_rate"])
+        if count > capacity:
+            self.stderr.write(
+                f"{count} entries for a capacity of {capacity}: the error rate is higher"
+            )
+        self.stdout.write(
+            f"Wrote {count} entries to {options['output']} ({num_bits // 8} bytes, "
+            f"{num_hashes} probes) in {time.perf_counter() - start:.1f}s"
+        )
+
+    def parse_hash(self, line):
+        try:
+            item_digest = bytes.fromhex(line.partition(":")[0])
+        except ValueError:
+            item_digest = b""
+        if len(item_digest) != 20:
+            raise CommandError(f"Not a SHA-1 hash: {line!r}")
+        return item_digest
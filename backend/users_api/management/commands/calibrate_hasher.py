@@ -0,0 +1,153 @@
+import json
+import os
+import platform
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import (
+    Argon2PasswordHasher,
+    PBKDF2PasswordHasher,
+    ScryptPasswordHasher,
+)
+from django.core.management.base import BaseCommand
+
+from users_api.hashers import CalibratedPBKDF2PasswordHasher, CalibratedScryptPasswordHasher
+
+PASSWORD = "Calibration-password-1"
+SALT = "calibrationsalt0123456"
+
+# Lowest acceptable cost per algorithm: Django's defaults, at or above the
+# OWASP password storage cheat sheet (the hashers never go below them)
+MINIMUMS = {
+    "argon2": Argon2PasswordHasher.time_cost,  # with Django's 100 MiB memory cost
+    "scrypt": ScryptPasswordHasher.work_factor,  # N, r=8, p=1
+    "pbkdf2_sha256": PBKDF2PasswordHasher.iterations,
+}
+
+# Memory-hard algorithms first
+PREFERENCE = ("argon2", "scrypt", "pbkdf2_sha256")
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the password hashers on this host, pick for each the highest cost "
+        "fitting the latency budget and write the result to PASSWORD_HASHER_CALIBRATION_FILE. "
+        "The preferred algorithm is the strongest one meeting its minimum cost within budget."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--target-ms", type=float, default=250, help="Latency budget of one hash"
+        )
+        parser.add_argument("--rounds", type=int, default=3, help="Measures per setting")
+        parser.add_argument("--output", default=str(settings.PASSWORD_HASHER_CALIBRATION_FILE))
+
+    def handle(self, *args, **options):
+        self.rounds = options["rounds"]
+        target = options["target_ms"] / 1000
+        results = {}
+        for algorithm, calibrate in (
+            ("pbkdf2_sha256", self.calibrate_pbkdf2),
+            ("scrypt", self.calibrate_scrypt),
+            ("argon2", self.calibrate_argon2),
+        ):
+            try:
+                cost, seconds = calibrate(target)
+            except (ImportError, ValueError) as e:
+                self.stdout.write(f"{algorithm:<14} unavailable ({e})")
+                continue
+            results[algorithm] = {"cost": cost, "ms": round(seconds * 1000, 1)}
+            fits = cost >= MINIMUMS[algorithm]
+            self.stdout.write(
+                f"{algorithm:<14} cost {cost:<10} {seconds * 1000:8.1f} ms"
+                + ("" if fits else f"  (below minimum {MINIMUMS[algorithm]})")
+            )
+
+        candidates = [a for a in PREFERENCE if a in results and results[a]["cost"] >= MINIMUMS[a]]
+        if candidates:
+            algorithm = candidates[0]
+        else:
+            # Nothing fits the budget: stay safe rather than fast
+            algorithm = "pbkdf2_sha256"
+            results[algorithm]["cost"] = MINIMUMS[algorithm]
+            self.stderr.write(
+                f"No hasher reaches its minimum cost within {options['target_ms']} ms, "
+                f"using pbkdf2_sha256 with {MINIMUMS[algorithm]} iterations"
+            )
+
+        calibration = {
+            "algorithm": algorithm,
+            "target_ms": options["target_ms"],
+            "host": platform.node(),
+            "cpu_count": os.cpu_count(),
+            "calibrated_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "measurements": results,
+        }
+        for name, key in (
+            ("pbkdf2_sha256", "pbkdf2_iterations"),
+            ("scrypt", "scrypt_work_factor"),
+            ("argon2", "argon2_time_cost"),
+        ):
+            if name in results:
+                calibration[key] = max(results[name]["cost"], MINIMUMS[name])
+
+        with open(options["output"], "w") as f:
+            json.dump(calibration, f, indent=2)
+            f.write("\n")
+        self.stdout.write(
+            self.style.SUCCESS(f"Preferred hasher: {algorithm}, calibration written to {options['output']}")
+        )
+
+    def measure(self, encode):
+        durations = []
+        for _ in range(self.rounds):
+            start = time.perf_counter()
+            encode()
+            durations.append(time.perf_counter() - start)
+        return statistics.median(durations)
+
+    def calibrate_pbkdf2(self, target):
+        hasher = CalibratedPBKDF2PasswordHasher()
+        # Cost is linear in the number of iterations
+        probe = 100000
+        seconds = self.measure(lambda: hasher.encode(PASSWORD, SALT, iterations=probe))
+        iterations = max(int(probe * target / seconds) // 1000 * 1000, 1000)
+        seconds = self.measure(lambda: hasher.encode(PASSWORD, SALT, iterations=iterations))
+        return iterations, seconds
+
+    def calibrate_scrypt(self, target):
+        hasher = CalibratedScryptPasswordHasher()
+        # Work factor must be a power of 2: double it while it fits the budget
+        work_factor = 2**10
+        best = None
+        while work_factor <= 2**20:
+            try:
+                seconds = self.measure(lambda: hasher.encode(PASSWORD, SALT, n=work_factor))
+            except ValueError:
+                # OpenSSL refuses work factors needing more memory than it allows
+                if best is None:
+                    raise
+                break
+            if seconds > target and best:
+                break
+            best = (work_factor, seconds)
+            if seconds > target:
+                break
+            work_factor *= 2
+        return best
+
+    def calibrate_argon2(self, target):
+        # Plain hasher: time_cost is a class attribute that can be overridden per instance
+        hasher = Argon2PasswordHasher()
+        hasher._load_library()
+        best = None
+        for time_cost in range(1, 11):
+            hasher.time_cost = time_cost
+            seconds = self.measure(lambda: hasher.encode(PASSWORD, SALT))
+            if seconds > target and best:
+                break
+            best = (time_cost, seconds)
+            if seconds > target:
+                break
+        return best
@@ -0,0 +1,23 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from users_api import export
+
+
+class Command(BaseCommand):
+    help = "Export all users as CSV or JSONL, streaming the table in chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=sorted(export.RENDERERS), default="csv")
+        parser.add_argument("--output", help="Output file (defaults to stdout)")
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        content, _ = export.export(options["format"], options["chunk_size"])
+        if options["output"]:
+            with open(options["output"], "w", newline="", encoding="utf-8") as f:
+                f.writelines(content)
+        else:
+            for part in content:
+                self.stdout.write(part, ending="")
@@ -0,0 +1,72 @@
+import json
+import sys
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users_api import bulk
+
+
+class Command(BaseCommand):
+    help = (
+        "Import users from a CSV or JSONL file (columns: email, username, password). "
+        "The file is streamed, so its size doesn't matter."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to import, '-' for stdin")
+        parser.add_argument(
+            "--format", choices=sorted(bulk.READERS), help="Defaults to the file extension"
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Users validated, hashed and inserted per transaction",
+        )
+        parser.add_argument("--rejects", help="Write rejected rows to this JSONL file")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or Path(path).suffix.lstrip(".").lower()
+        if fmt not in bulk.READERS:
+            raise CommandError("Unknown format, use --format csv or --format jsonl")
+
+        f = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8")
+        rejects_file = open(options["rejects"], "w") if options["rejects"] else None
+        created_count = rejected_count = read_count = 0
+        seen_emails = set()
+        start = time.perf_counter()
+        try:
+            rows = bulk.READERS[fmt](f)
+            for chunk in bulk.iter_chunks(rows, options["chunk_size"]):
+                line_numbers, chunk = zip(*chunk)
+                created, rejects = bulk.create_users(list(chunk), seen_emails)
+                created_count += len(created)
+                rejected_count += len(rejects)
+                for index, errors in rejects:
+                    reject = {"line": line_numbers[index], "errors": errors}
+                    if rejects_file:
+                        rejects_file.write(json.dumps(reject) + "\n")
+                    else:
+                        self.stderr.write(f"Rejected line {reject['line']}: {json.dumps(errors)}")
+                read_count += len(chunk)
+
+                elapsed = time.perf_counter() - start
+                self.stdout.write(
+                    f"{read_count} rows read, {created_count} users created, "
+                    f"{rejected_count} rejected ({created_count / elapsed:.1f} users/s)"
+                )
+        finally:
+            if f is not sys.stdin:
+                f.close()
+            if rejects_file:
+                rejects_file.close()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {created_count} users in {time.perf_counter() - start:.1f}s, "
+                f"{rejected_count} rejected"
+            )
+        )
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from users_api import purge
+from users_api.models import PurgeJob
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the pending purge jobs of deleted accounts, including retries of failed "
+        "attempts and jobs abandoned by a crashed worker."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=float,
+            help="Keep running and look for due jobs every INTERVAL seconds",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            job_ids = purge.due_jobs()
+            for job_id in job_ids:
+                state = purge.run_job(job_id)
+                if state:
+                    job = PurgeJob.objects.get(pk=job_id)
+                    self.stdout.write(
+                        f"User {job.user_id}: {state} "
+                        f"(attempt {job.attempts}, progress {job.progress})"
+                    )
+            if not options["interval"]:
+                if not job_ids:
+                    self.stdout.write("No purge job due")
+                return
+            time.sleep(options["interval"])
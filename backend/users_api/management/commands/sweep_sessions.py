@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from backend import metrics
+from users_api import sweeper
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete expired sessions in small batches with pauses in between, instead of "
+        "clearsessions' single DELETE. With --daemon, sweep again every --interval seconds."
+    )
+
+    def add_arguments(self, parser):
+        config = sweeper.get_config()
+        parser.add_argument("--batch-size", type=int, default=config["BATCH_SIZE"])
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=config["PAUSE"],
+            help="Seconds to sleep between two batches",
+        )
+        parser.add_argument("--daemon", action="store_true", help="Keep sweeping")
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=config["INTERVAL"],
+            help="Seconds between two sweeps in daemon mode",
+        )
+
+    def handle(self, *args, **options):
+        self.verbosity = options["verbosity"]
+        while True:
+            deleted = sweeper.sweep(
+                batch_size=options["batch_size"],
+                pause=options["pause"],
+                progress=self.progress,
+            )
+            self.stdout.write(f"Deleted {deleted} expired sessions")
+            metrics.flush(force=True)
+            if not options["daemon"]:
+                return
+            time.sleep(options["interval"])
+
+    def progress(self, batches, deleted):
+        if self.verbosity > 1:
+            self.stdout.write(f"Batch {batches}: {deleted} sessions deleted so far")
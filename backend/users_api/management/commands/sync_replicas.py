@@ -0,0 +1,48 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Replication stand-in for local SQLite replicas: copy the primary database "
+        "into every DATABASE_REPLICAS file with SQLite's online backup API."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=float,
+            help="Keep running and sync every INTERVAL seconds",
+        )
+
+    def handle(self, *args, **options):
+        primary = settings.DATABASES["default"]
+        if not primary["ENGINE"].endswith("sqlite3"):
+            raise CommandError("Only SQLite databases can be synced with this command")
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError("No replica configured (see DJANGO_DB_REPLICAS)")
+
+        while True:
+            start = time.perf_counter()
+            for alias in settings.DATABASE_REPLICAS:
+                self.sync(primary["NAME"], settings.DATABASES[alias]["NAME"])
+            self.stdout.write(
+                f"Synced {len(settings.DATABASE_REPLICAS)} replicas "
+                f"in {(time.perf_counter() - start) * 1000:.1f} ms"
+            )
+            if not options["interval"]:
+                return
+            time.sleep(options["interval"])
+
+    def sync(self, source_path, target_path):
+        # Copy into the replica in place, so open connections see the new data
+        source = sqlite3.connect(source_path)
+        target = sqlite3.connect(target_path, timeout=30)
+        try:
+            source.backup(target)
+        finally:
+            source.close()
+            target.close()
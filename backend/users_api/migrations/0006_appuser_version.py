@@ -0,0 +1,23 @@
+# Generated by Django 5.0.14 on 2026-10-18 19:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users_api", "0005_appuser_avatar"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="appuser",
+            name="avatar",
+            field=models.ImageField(default="default.png", upload_to="media/"),
+        ),
+        migrations.AddField(
+            model_name="appuser",
+            name="version",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
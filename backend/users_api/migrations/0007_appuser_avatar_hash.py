@@ -0,0 +1,20 @@
+# Generated by Django 5.0.14 on 2026-10-18 19:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users_api", "0006_appuser_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="appuser",
+            name="avatar_hash",
+            field=models.CharField(
+                blank=True, default="", editable=False, max_length=64
+            ),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.0.14 on 2026-10-18 19:20
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_email_normalized(apps, schema_editor):
+    AppUser = apps.get_model("users_api", "AppUser")
+    db_alias = schema_editor.connection.alias
+    users = AppUser.objects.using(db_alias).only("user_id", "email").order_by("user_id")
+    batch = []
+    for user in users.iterator(chunk_size=1000):
+        user.email_normalized = user.email.strip().lower()
+        batch.append(user)
+        if len(batch) >= 1000:
+            AppUser.objects.using(db_alias).bulk_update(batch, ["email_normalized"])
+            batch = []
+    if batch:
+        AppUser.objects.using(db_alias).bulk_update(batch, ["email_normalized"])
+
+    # The former email constraint was case-sensitive: list the accounts the new
+    # one would reject instead of failing on an IntegrityError
+    duplicates = (
+        AppUser.objects.using(db_alias)
+        .values("email_normalized")
+        .annotate(count=Count("user_id"))
+        .filter(count__gt=1)
+        .values_list("email_normalized", flat=True)
+    )
+    conflicts = []
+    for email in duplicates:
+        users = AppUser.objects.using(db_alias).filter(email_normalized=email).order_by("user_id")
+        conflicts.append(", ".join(f"{user.email} (id {user.user_id})" for user in users))
+    if conflicts:
+        raise RuntimeError(
+            "These accounts only differ by the case of their email, merge or rename "
+            "them before migrating again:\n  " + "\n  ".join(conflicts)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users_api", "0007_appuser_avatar_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="appuser",
+            name="email_normalized",
+            field=models.CharField(editable=False, max_length=50, null=True),
+        ),
+        migrations.RunPython(backfill_email_normalized, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="appuser",
+            name="email_normalized",
+            field=models.CharField(editable=False, max_length=50, unique=True),
+        ),
+    ]
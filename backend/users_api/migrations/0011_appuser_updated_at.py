@@ -0,0 +1,21 @@
+# Generated by Django 5.0.14 on 2026-10-18 20:37
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users_api", "0010_purgejob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="appuser",
+            name="updated_at",
+            field=models.DateTimeField(
+                db_index=True, default=django.utils.timezone.now, editable=False
+            ),
+        ),
+    ]
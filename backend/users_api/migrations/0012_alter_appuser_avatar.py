@@ -0,0 +1,21 @@
+# Generated by Django 5.0.14 on 2026-10-18 20:46
+
+import users_api.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users_api", "0011_appuser_updated_at"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="appuser",
+            name="avatar",
+            field=models.ImageField(
+                default="default.png", upload_to=users_api.models.avatar_upload_to
+            ),
+        ),
+    ]
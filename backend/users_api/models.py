@@ -1,11 +1,37 @@
-from django.db import models
+import hashlib
+import os
+
+from django.db import DatabaseError, models
 from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 
+
+class VersionConflict(DatabaseError):
+    "The user row was saved by someone else since it was loaded"
+
+
+def canonical_email(email):
+    "Case-insensitive lookup key of an email address"
+    return (email or "").strip().lower()
+
+
+def avatar_upload_to(instance, filename):
+    "Name an uploaded avatar after its content, so it can be cached forever (see backend/media.py)"
+    digest = hashlib.sha256()
+    for chunk in instance.avatar.file.chunks():
+        digest.update(chunk)
+    extension = os.path.splitext(filename)[1].lower()
+    return f"media/{digest.hexdigest()[:32]}{extension}"
+
+
 # === User Model Manager === #
 class AppUserManager(BaseUserManager):
+    def get_by_natural_key(self, email):
+        # Used by the auth backend (e.g. admin login), case-insensitive like the API
+        return self.get(email_normalized=canonical_email(email))
+
     def create_user(self, email, username, password=None, **extra_fields):
         if not email:
             raise ValueError("An email is required.")
@@ -46,11 +72,19 @@ class AppUserManager(BaseUserManager):
 class AppUser(AbstractBaseUser, PermissionsMixin):
     user_id = models.AutoField(primary_key=True)
     email = models.EmailField(max_length=50, unique=True)
+    # Lowercased email, used for every lookup and uniqueness check
+    email_normalized = models.CharField(max_length=50, unique=True, editable=False)
     username = models.CharField(max_length=50)
-    avatar = models.ImageField(upload_to="media/", default="default.png")
+    avatar = models.ImageField(upload_to=avatar_upload_to, default="default.png")
+    # Content hash of the avatar whose derivatives are ready (see avatars.py)
+    avatar_hash = models.CharField(max_length=64, blank=True, default="", editable=False)
     is_active = models.BooleanField(default=True)
     is_admin = models.BooleanField(default=False)
     date_joined = models.DateTimeField(default=timezone.now)
+    # Change counter, bumped whenever a field exposed by the API is saved
+    version = models.PositiveIntegerField(default=0, editable=False)
+    # Time of the last version bump (e.g. read by the email availability filter)
+    updated_at = models.DateTimeField(default=timezone.now, db_index=True, editable=False)
 
     # Define the user model manager
     objects = AppUserManager()
@@ -58,9 +92,50 @@ class AppUser(AbstractBaseUser, PermissionsMixin):
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = ["username"]
 
+    # Fields rendered by UserSerializer, saving one of them changes the ETag
+    VERSIONED_FIELDS = {"email", "username", "avatar"}
+
     def __str__(self):
         return self.email
 
+    def save(self, *args, **kwargs):
+        self.email_normalized = canonical_email(self.email)
+        update_fields = kwargs.get("update_fields")
+        bumped = update_fields is None or self.VERSIONED_FIELDS.intersection(update_fields)
+        if not bumped:
+            return super().save(*args, **kwargs)
+        if update_fields is not None:
+            kwargs["update_fields"] = {*update_fields, "version", "updated_at", "email_normalized"}
+        previous = self.version
+        self.version += 1
+        self.updated_at = timezone.now()
+        # Existing rows are only updated at the version read (see _do_update)
+        self._expected_version = None if self._state.adding else previous
+        try:
+            super().save(*args, **kwargs)
+        except BaseException:
+            self.version = previous
+            raise
+        finally:
+            self._expected_version = None
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        # Compare-and-swap: two saves never get the same version
+        expected = getattr(self, "_expected_version", None)
+        if expected is None:
+            return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+        updated = super()._do_update(
+            base_qs.filter(version=expected), using, pk_val, values, update_fields, forced_update
+        )
+        if not updated:
+            raise VersionConflict(f"User {pk_val} is no longer at version {expected}")
+        return updated
+
+    @property
+    def etag(self):
+        "ETag of the user's API representation"
+        return f'"{self.user_id}-{self.version}"'
+
     def has_perm(self, perm, obj=None):
         "Does the user have a specific permission?"
         # Simplest possible answer: Yes, always
@@ -78,3 +153,46 @@ class AppUser(AbstractBaseUser, PermissionsMixin):
         # Simplest possible answer: All admins are staff
         return self.is_admin
 
+
+
+class UserSession(models.Model):
+    """
+    Session keys of a user, recorded at login so that every session of many
+    users can be deleted at once (see bulk_ops.invalidate_sessions)
+    """
+
+    user = models.ForeignKey(AppUser, on_delete=models.CASCADE, related_name="session_keys")
+    session_key = models.CharField(max_length=40, unique=True)
+    created = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.session_key}"
+
+
+class PurgeJob(models.Model):
+    """
+    Removal of a deleted account and everything attached to it (see purge.py)
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATES = [(PENDING, "Pending"), (RUNNING, "Running"), (DONE, "Done"), (FAILED, "Failed")]
+
+    # Not a foreign key: the job outlives the user row
+    user_id = models.IntegerField(unique=True)
+    state = models.CharField(max_length=10, choices=STATES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Step -> number of items removed so far
+    progress = models.JSONField(default=dict)
+    last_error = models.TextField(blank=True, default="")
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    created = models.DateTimeField(default=timezone.now)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["state", "next_attempt_at"])]
+
+    def __str__(self):
+        return f"Purge of user {self.user_id}: {self.state}"
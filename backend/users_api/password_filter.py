@@ -0,0 +1,109 @@
+"""
+Screening of common and breached passwords.
+
+Django's `CommonPasswordValidator` loads its gzipped list into a set in every
+process. `manage.py build_password_filter` compiles a list once, offline, into
+a Bloom filter file (see bloom.py) that the workers memory-map: Django's list
+by default, or any list of passwords or SHA-1 hashes (e.g. the hundreds of
+millions of Pwned Passwords). A lookup is a few bit probes whatever the size
+of the list, and 1 password in 1000 (ERROR_RATE) is rejected by mistake.
+
+Plain text lists are lowercased, like Django does (the LOWERCASE flag of the
+file); hash lists are matched against the exact password. The file is opened
+again when it's rebuilt. Without it, Django's list is used.
+"""
+
+import gzip
+import os
+
+from django.conf import settings
+from django.contrib.auth.password_validation import CommonPasswordValidator
+from django.core.exceptions import ValidationError
+from django.utils.translation import gettext as _
+
+from backend.logging_config import logger
+
+from . import bloom
+
+DEFAULTS = {
+    # Filter file written by build_password_filter (None = Django's list)
+    "PATH": None,
+    # False positive rate of the filters built
+    "ERROR_RATE": 0.001,
+}
+
+# Flag of the filter file: the items are lowercased passwords
+LOWERCASE = 1
+
+_filter = None
+# (path, inode, mtime) of the file mapped, False before the first lookup
+_filter_stat = False
+_common_passwords = None
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, "PASSWORD_FILTER", {}))
+    return config
+
+
+def read_passwords(path):
+    """
+    Yield the stripped lines of a text file, gzipped or not
+    """
+    with open(path, "rb") as f:
+        gzipped = f.read(2) == b"\x1f\x8b"
+    opener = gzip.open if gzipped else open
+    with opener(path, "rt", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
+
+
+def get_filter():
+    """
+    Return the memory-mapped filter, or None when it isn't built
+    """
+    global _filter, _filter_stat
+    path = get_config()["PATH"]
+    try:
+        stat = os.stat(path) if path else None
+    except FileNotFoundError:
+        stat = None
+    key = stat and (path, stat.st_ino, stat.st_mtime_ns)
+    if key != _filter_stat:
+        _filter = bloom.load(path) if stat else None
+        _filter_stat = key
+        if path and not stat:
+            logger.warning("Password filter %s not found, using Django's list", path)
+    return _filter
+
+
+def get_common_passwords():
+    global _common_passwords
+    if _common_passwords is None:
+        _common_passwords = CommonPasswordValidator().passwords
+    return _common_passwords
+
+
+def is_common(password):
+    password_filter = get_filter()
+    if password_filter is None:
+        return password.lower().strip() in get_common_passwords()
+    if password_filter.flags & LOWERCASE:
+        return password.lower().strip() in password_filter
+    return password in password_filter
+
+
+class FilterPasswordValidator:
+    """
+    `CommonPasswordValidator` backed by the password filter
+    """
+
+    def validate(self, password, user=None):
+        if is_common(password):
+            raise ValidationError(_("This password is too common."), code="password_too_common")
+
+    def get_help_text(self):
+        return _("Your password can’t be a commonly used password.")
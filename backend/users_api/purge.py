@@ -0,0 +1,264 @@
+"""
+Background purge of deleted accounts.
+
+Deleting an account on the request path only deactivates the user and
+records a `PurgeJob`. The job is then run by a background thread once the
+transaction commits (or by `manage.py purge_accounts`, which also retries
+failed attempts) and removes, in batches:
+
+1. every recorded session of the user,
+2. the avatar and its derivatives (unless another user shares them),
+3. the rows referencing the user (groups, permissions, admin log),
+4. the user row itself.
+
+Each step is idempotent, so a job interrupted midway is simply run again.
+Failed attempts are retried with an exponential backoff up to MAX_ATTEMPTS.
+Reactivating the account (bulk "activate") cancels its waiting job, and a
+job stops before any step once the user is active again.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.admin.models import LogEntry
+from django.contrib.sessions.models import Session
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from backend import routers
+from backend.logging_config import logger
+
+from . import avatars, session_backend, signed_session, user_cache
+from .models import AppUser, PurgeJob, UserSession
+
+DEFAULTS = {
+    # Run jobs in a background thread once the deletion commits (False = inline)
+    "ASYNC": True,
+    "WORKERS": 1,
+    # Rows deleted per statement
+    "BATCH_SIZE": 500,
+    "MAX_ATTEMPTS": 5,
+    # Seconds before the first retry, doubled on every failed attempt
+    "RETRY_DELAY": 60,
+    # Seconds after which a running job is considered abandoned
+    "STALE_AFTER": 600,
+}
+
+_lock = threading.Lock()
+_executor = None
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, "ACCOUNT_PURGE", {}))
+    return config
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=get_config()["WORKERS"], thread_name_prefix="purge"
+                )
+    return _executor
+
+
+# === Request path === #
+def soft_delete(user):
+    """
+    Deactivate `user` and enqueue the purge of the account
+    """
+    with transaction.atomic():
+        AppUser.objects.filter(pk=user.pk).update(is_active=False)
+        user.is_active = False
+        signed_session.revoke(user.pk)
+        user_cache.invalidate(user.pk)
+        job, _ = PurgeJob.objects.update_or_create(
+            user_id=user.pk,
+            defaults={
+                "state": PurgeJob.PENDING,
+                "attempts": 0,
+                "next_attempt_at": timezone.now(),
+            },
+        )
+    schedule(job.pk)
+    return job
+
+
+def cancel(*user_ids):
+    """
+    Drop the waiting purge jobs of reactivated users (a running job stops by itself)
+    """
+    return PurgeJob.objects.filter(
+        user_id__in=user_ids, state__in=(PurgeJob.PENDING, PurgeJob.FAILED)
+    ).delete()[0]
+
+
+def schedule(job_id):
+    if get_config()["ASYNC"]:
+        transaction.on_commit(lambda: _get_executor().submit(_run, job_id))
+    else:
+        transaction.on_commit(lambda: run_job(job_id))
+
+
+def _run(job_id):
+    try:
+        run_job(job_id)
+    except Exception:
+        logger.exception("Purge job %s crashed", job_id)
+    finally:
+        # Worker threads get their own connection, don't leak it
+        connection.close()
+
+
+# === Steps === #
+def purge_sessions(user_id, batch_size):
+    deleted = 0
+    while True:
+        session_keys = list(
+            UserSession.objects.filter(user_id=user_id).values_list("session_key", flat=True)[
+                :batch_size
+            ]
+        )
+        if not session_keys:
+            return deleted
+        with transaction.atomic():
+            Session.objects.filter(session_key__in=session_keys).delete()
+            UserSession.objects.filter(session_key__in=session_keys).delete()
+        session_backend.evict(session_keys)
+        deleted += len(session_keys)
+
+
+def purge_files(user_id, batch_size):
+    user = AppUser.objects.filter(pk=user_id).only("avatar", "avatar_hash").first()
+    if user is None:
+        return 0
+    others = AppUser.objects.exclude(pk=user_id)
+    names = []
+    default_avatar = AppUser._meta.get_field("avatar").default
+    if user.avatar and user.avatar.name != default_avatar:
+        if not others.filter(avatar=user.avatar.name).exists():
+            names.append(user.avatar.name)
+    # Derivatives are content addressed, other users may have uploaded the same image
+    if user.avatar_hash and not others.filter(avatar_hash=user.avatar_hash).exists():
+        for formats in avatars.derivative_names(user.avatar_hash).values():
+            names.extend(formats.values())
+    deleted = 0
+    for name in names:
+        if default_storage.exists(name):
+            default_storage.delete(name)
+            deleted += 1
+    return deleted
+
+
+def purge_related(user_id, batch_size):
+    deleted = 0
+    for model, field in (
+        (AppUser.groups.through, "appuser_id"),
+        (AppUser.user_permissions.through, "appuser_id"),
+        (LogEntry, "user_id"),
+    ):
+        while True:
+            ids = list(
+                model.objects.filter(**{field: user_id}).values_list("pk", flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            deleted += model.objects.filter(pk__in=ids).delete()[0]
+    return deleted
+
+
+def purge_user(user_id, batch_size):
+    # Only while still deactivated, checked by the DELETE itself
+    return AppUser.objects.filter(pk=user_id, is_active=False).delete()[0]
+
+
+STEPS = (
+    ("sessions", purge_sessions),
+    ("files", purge_files),
+    ("related", purge_related),
+    ("user", purge_user),
+)
+
+
+# === Jobs === #
+def is_reactivated(user_id):
+    return AppUser.objects.filter(pk=user_id, is_active=True).exists()
+
+
+# Jobs run right after the deletion, reads must see it
+@routers.primary()
+def claim(job_id):
+    """
+    Mark a job as running, unless another worker has it
+    """
+    config = get_config()
+    stale = timezone.now() - timedelta(seconds=config["STALE_AFTER"])
+    return bool(
+        PurgeJob.objects.filter(
+            Q(state=PurgeJob.PENDING) | Q(state=PurgeJob.RUNNING, updated__lt=stale),
+            pk=job_id,
+        ).update(state=PurgeJob.RUNNING, updated=timezone.now())
+    )
+
+
+@routers.primary()
+def run_job(job_id):
+    """
+    Run a purge job, return its final state
+    """
+    if not claim(job_id):
+        return None
+    config = get_config()
+    job = PurgeJob.objects.get(pk=job_id)
+    job.attempts += 1
+    job.save(update_fields=["attempts", "updated"])
+    try:
+        for step, run_step in STEPS:
+            if is_reactivated(job.user_id):
+                job.delete()
+                logger.info("Purge of user %s cancelled: reactivated", job.user_id)
+                return None
+            job.progress[step] = job.progress.get(step, 0) + run_step(
+                job.user_id, config["BATCH_SIZE"]
+            )
+            job.save(update_fields=["progress", "updated"])
+    except Exception as e:
+        logger.exception("Purge of user %s failed (attempt %s)", job.user_id, job.attempts)
+        job.last_error = repr(e)
+        if job.attempts >= config["MAX_ATTEMPTS"]:
+            job.state = PurgeJob.FAILED
+        else:
+            job.state = PurgeJob.PENDING
+            delay = config["RETRY_DELAY"] * 2 ** (job.attempts - 1)
+            job.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+        job.save(update_fields=["state", "last_error", "next_attempt_at", "updated"])
+        return job.state
+
+    job.state = PurgeJob.DONE
+    job.save(update_fields=["state", "updated"])
+    logger.info("User %s purged: %s", job.user_id, job.progress)
+    return job.state
+
+
+@routers.primary()
+def due_jobs():
+    """
+    IDs of the jobs waiting for an attempt, including abandoned running jobs
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=get_config()["STALE_AFTER"])
+    return list(
+        PurgeJob.objects.filter(
+            Q(state=PurgeJob.PENDING, next_attempt_at__lte=now)
+            | Q(state=PurgeJob.RUNNING, updated__lt=stale)
+        )
+        .order_by("next_attempt_at")
+        .values_list("pk", flat=True)
+    )
@@ -0,0 +1,107 @@
+"""
+Response renderers and request parsers.
+
+`FastJSONRenderer` produces the same bytes as DRF's `JSONRenderer` with
+orjson when it is installed (several times faster on the user payloads), and
+is DRF's renderer otherwise. Indented output (browsable API, `; indent=`)
+always goes through DRF.
+
+`MessagePackRenderer` / `MessagePackParser` speak `application/msgpack` for
+the internal services and mobile clients, when msgpack is installed (they are
+only registered in REST_FRAMEWORK then). Clients opt in with the `Accept` and
+`Content-Type` headers; JSON stays the default. Values are converted like in
+JSON (datetimes as ISO 8601 strings, decimals and UUIDs as strings), so both
+formats carry the same data.
+"""
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.utils.mediatypes import media_type_matches, order_by_precedence
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+
+class FastJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None
+            or not self.compact
+            or self.ensure_ascii
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b""
+        ret = orjson.dumps(
+            data,
+            # Types orjson doesn't know, and datetimes (DRF writes UTC as "Z"),
+            # are converted like DRF does
+            default=JSONEncoder().default,
+            option=orjson.OPT_PASSTHROUGH_DATETIME,
+        )
+        # Same escaping as JSONRenderer, keeps the output a strict JavaScript subset
+        if b"\xe2\x80\xa8" in ret or b"\xe2\x80\xa9" in ret:
+            ret = ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+        return ret
+
+
+def packb(data):
+    return msgpack.packb(data, default=JSONEncoder().default)
+
+
+def unpackb(content):
+    # Raises ValueError on malformed or truncated content, like json.loads
+    try:
+        return msgpack.unpackb(content, raw=False)
+    except TypeError as e:
+        # e.g. a map key that isn't hashable
+        raise ValueError(str(e))
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = MSGPACK_MEDIA_TYPE
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return packb(data)
+
+
+class MessagePackParser(BaseParser):
+    media_type = MSGPACK_MEDIA_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return unpackb(stream.read())
+        except ValueError as e:
+            raise ParseError(f"MessagePack parse error - {e}")
+
+
+def negotiate(accept):
+    """
+    Renderer for the Accept header of a non-DRF view, chosen like DRF's
+    content negotiation; JSON when nothing else matches
+    """
+    candidates = (FastJSONRenderer, MessagePackRenderer) if msgpack else (FastJSONRenderer,)
+    accepts = [token.strip() for token in (accept or "*/*").split(",")]
+    for media_type_set in order_by_precedence(accepts):
+        for renderer in candidates:
+            for media_type in media_type_set:
+                if media_type_matches(renderer.media_type, media_type):
+                    return renderer()
+    return FastJSONRenderer()
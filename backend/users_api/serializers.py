@@ -2,24 +2,63 @@ from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from rest_framework.exceptions import ValidationError
 from django.contrib.auth.password_validation import validate_password
-from .models import AppUser
+from django.db import IntegrityError, transaction
+from .models import AppUser, canonical_email
+from . import avatars, bulk_ops, hashing, password_filter
 import re
 
 UserModel = get_user_model()
 
+EMAIL_TAKEN = "app user with this email already exists."
+
+
+def insert_user(user):
+    """
+    Save a new user with a single INSERT: the unique constraints on the email
+    columns stand in for a uniqueness query.
+    """
+    try:
+        # Savepoint, so a duplicate doesn't break the caller's transaction
+        with transaction.atomic():
+            user.save(force_insert=True)
+    except IntegrityError:
+        raise ValidationError({"email": [EMAIL_TAKEN]})
+
+
 class UserSerializer(serializers.ModelSerializer):
+    avatar_thumbnails = serializers.SerializerMethodField()
+
     class Meta:
         model = AppUser
-        fields = ("user_id", "email", "username", "avatar", "password")
-        extra_kwargs = {"password": {"write_only": True}}
+        fields = ("user_id", "email", "username", "avatar", "avatar_thumbnails", "password")
+        extra_kwargs = {
+            "password": {"write_only": True},
+            # Uniqueness is checked case-insensitively by validate_email
+            "email": {"validators": []},
+        }
+
+    def get_avatar_thumbnails(self, instance):
+        # Empty until the background worker generated the derivatives
+        if not instance.avatar_hash:
+            return {}
+        request = self.context.get("request")
+        thumbnails = {}
+        for size, names in avatars.derivative_names(instance.avatar_hash).items():
+            urls = {}
+            for fmt, name in names.items():
+                url = instance.avatar.storage.url(name)
+                urls[fmt] = request.build_absolute_uri(url) if request else url
+            thumbnails[str(size)] = urls
+        return thumbnails
 
     def create(self, validated_data):
-        user = AppUser.objects.create(
+        # Hashing runs in the worker pool, before the insert so the user is written once
+        user = AppUser(
             email=validated_data["email"],
             username=validated_data["username"],
+            password=hashing.make_password(validated_data["password"]),
         )
-        user.set_password(validated_data["password"])
-        user.save()
+        insert_user(user)
         return user
 
     def update(self, instance, validated_data):
@@ -27,9 +66,21 @@ class UserSerializer(serializers.ModelSerializer):
         instance.username = validated_data.get("username", instance.username)
         if instance.avatar:
             instance.avatar = validated_data.get("avatar", instance.avatar)
+            if "avatar" in validated_data:
+                # Derivatives of the previous avatar no longer apply
+                instance.avatar_hash = ""
         instance.save()
         return instance
     
+    def validate_email(self, value):
+        # New users are checked by the unique constraint on insert (see insert_user)
+        if self.instance is None:
+            return value
+        users = AppUser.objects.filter(email_normalized=canonical_email(value))
+        if users.exclude(pk=self.instance.pk).exists():
+            raise ValidationError(EMAIL_TAKEN)
+        return value
+
     def validate_username(self, value):
         username_pattern = r"^[a-zA-Z0-9_.-]+$"
         username = value.strip()
@@ -49,6 +100,19 @@ class UserSerializer(serializers.ModelSerializer):
             raise ValidationError("Please choose another password, min 8 characters")
         if not any(char.isupper() for char in password) or not any(char.isdigit() for char in password):
             raise ValidationError("Please choose another password, at least one uppercase letter and one number")
+        if password_filter.is_common(value):
+            raise ValidationError("Please choose another password, this one is too common")
         return value
-    
 
+
+class BulkActionSerializer(serializers.Serializer):
+    action = serializers.ChoiceField(choices=sorted(bulk_ops.ACTIONS))
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False)
+    filter = serializers.DictField(required=False)
+
+    def validate(self, data):
+        if ("ids" in data) == ("filter" in data):
+            raise ValidationError("Provide either ids or filter")
+        if "filter" in data and not data["filter"]:
+            raise ValidationError("An empty filter would select every user")
+        return data
@@ -0,0 +1,156 @@
+"""
+Session engine keeping decoded sessions in memory in front of the database.
+
+Enable it with `SESSION_ENGINE = "users_api.session_backend"`.
+
+Lookups go through three tiers: a per-process LRU, an optional shared Django
+cache (e.g. a `FileBasedCache` so every worker on the host shares it) and
+finally the `django_session` table, which is only read on a miss or once the
+cached entry has expired. Saves that would write back the same data are
+skipped, and expiry-only refreshes are written at most once per
+`WRITE_INTERVAL`.
+
+Deleting a session (logout, `cycle_key`) evicts it from the local and shared
+tiers, but other processes keep their local copy until its TTL runs out, so
+keep `TTL` short when running several workers.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.contrib.sessions.backends.db import SessionStore as DBStore
+from django.core.cache import caches
+from django.utils import timezone
+
+from .cache import LRUCache
+
+KEY_PREFIX = "users_api.session_backend."
+
+DEFAULTS = {
+    # Size and lifetime (seconds) of the per-process tier
+    "MAX_ENTRIES": 10000,
+    "TTL": 60,
+    # Alias from CACHES used as the shared tier (None = disabled)
+    "SHARED_CACHE_ALIAS": None,
+    # Minimum delay (seconds) between two expiry-only writes of a session
+    "WRITE_INTERVAL": 300,
+}
+
+_local_cache = None
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, "SESSION_CACHE", {}))
+    return config
+
+
+def get_local_cache():
+    global _local_cache
+    if _local_cache is None:
+        config = get_config()
+        _local_cache = LRUCache(max_entries=config["MAX_ENTRIES"], ttl=config["TTL"])
+    return _local_cache
+
+
+def evict(session_keys):
+    """
+    Drop sessions deleted behind the engine's back (e.g. by a bulk delete)
+    from this process's tier and the shared tier
+    """
+    local_cache = get_local_cache()
+    for session_key in session_keys:
+        local_cache.delete(session_key)
+    alias = get_config()["SHARED_CACHE_ALIAS"]
+    if alias:
+        caches[alias].delete_many([KEY_PREFIX + session_key for session_key in session_keys])
+
+
+class SessionStore(DBStore):
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        self._config = get_config()
+        alias = self._config["SHARED_CACHE_ALIAS"]
+        self._shared_cache = caches[alias] if alias else None
+        # (data, expire_date) of the row as last read from or written to the db
+        self._persisted = None
+
+    # === Cache tiers === #
+    def _cache_get(self, session_key):
+        local_cache = get_local_cache()
+        entry = local_cache.get(session_key)
+        if entry is None and self._shared_cache is not None:
+            entry = self._shared_cache.get(KEY_PREFIX + session_key)
+            if entry is not None:
+                local_cache.set(session_key, entry)
+        if entry is None:
+            return None
+        if entry[1] <= timezone.now():
+            self._cache_delete(session_key)
+            return None
+        return entry
+
+    def _cache_set(self, session_key, entry):
+        get_local_cache().set(session_key, entry)
+        if self._shared_cache is not None:
+            timeout = (entry[1] - timezone.now()).total_seconds()
+            self._shared_cache.set(KEY_PREFIX + session_key, entry, max(timeout, 0))
+
+    def _cache_delete(self, session_key):
+        get_local_cache().delete(session_key)
+        if self._shared_cache is not None:
+            self._shared_cache.delete(KEY_PREFIX + session_key)
+
+    # === SessionBase API === #
+    def load(self):
+        entry = self._cache_get(self.session_key) if self.session_key else None
+        if entry is None:
+            s = self._get_session_from_db()
+            if not s:
+                return {}
+            entry = (self.decode(s.session_data), s.expire_date)
+            self._cache_set(s.session_key, entry)
+        self._persisted = entry
+        # The cached dict is shared between requests, hand out a copy
+        return dict(entry[0])
+
+    def exists(self, session_key):
+        return self._cache_get(session_key) is not None or super().exists(session_key)
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        data = self._get_session(no_load=must_create)
+        expire_date = self.get_expiry_date()
+
+        # Coalesce writes that would leave the row unchanged
+        if not must_create and self._persisted is not None:
+            persisted_data, persisted_expiry = self._persisted
+            write_interval = timedelta(seconds=self._config["WRITE_INTERVAL"])
+            if (
+                persisted_data == data
+                and abs(expire_date - persisted_expiry) < write_interval
+            ):
+                return
+
+        super().save(must_create=must_create)
+        entry = (dict(data), expire_date)
+        self._persisted = entry
+        self._cache_set(self.session_key, entry)
+
+    def delete(self, session_key=None):
+        session_key = session_key or self.session_key
+        super().delete(session_key)
+        if session_key:
+            self._cache_delete(session_key)
+
+    def cycle_key(self):
+        from .bulk_ops import rekey_session
+
+        session_key = self.session_key
+        super().cycle_key()
+        # e.g. update_session_auth_hash after a password change. Anonymous
+        # sessions (the cycle_key of a login) have no tracked row
+        if session_key and SESSION_KEY in self:
+            rekey_session(session_key, self.session_key)
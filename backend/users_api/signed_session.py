@@ -0,0 +1,186 @@
+"""
+Stateless signed-cookie authentication for read endpoints.
+
+With SIGNED_SESSION["ENABLED"], a login also sets a short-lived cookie holding
+the user's public fields and the time it was issued, signed with SECRET_KEY.
+`SignedCookieAuthentication` accepts it on GET/HEAD/OPTIONS requests after
+checking the HMAC and a denylist, so `/api/user` is answered without reading
+the session or the user row. Other methods, and reads without a valid cookie,
+fall through to the regular `SessionAuthentication`; those reads issue a fresh
+cookie.
+
+Revocation is per user: `revoke(user_id)` records in a cache the time before
+which the user's cookies are refused (one small entry per user, expiring
+with the cookies). It runs whenever a user is saved, logs out, is
+deactivated or deleted (a password change saves the user too).
+DENYLIST_CACHE_ALIAS must be a cache the worker processes share, otherwise a
+worker could accept a revoked cookie until it expires: a system check refuses
+process-local backends.
+"""
+
+import time
+
+from django.conf import settings
+from django.core import checks, signing
+from django.core.cache import caches
+from rest_framework.authentication import BaseAuthentication
+
+from .models import AppUser
+
+DEFAULTS = {
+    "ENABLED": False,
+    "COOKIE_NAME": "user_token",
+    # Lifetime of a cookie (seconds)
+    "MAX_AGE": 300,
+    # Alias from CACHES holding the revocations
+    "DENYLIST_CACHE_ALIAS": "default",
+}
+
+SALT = "users_api.signed_session"
+DENYLIST_PREFIX = "users_api.signed_session.revoked."
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+# Cache backends each process has its own copy of (or none)
+PROCESS_LOCAL_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+# Claim -> AppUser field
+CLAIMS = {
+    "uid": "user_id",
+    "email": "email",
+    "name": "username",
+    "avatar": "avatar",
+    "ahash": "avatar_hash",
+    "v": "version",
+    "admin": "is_admin",
+}
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, "SIGNED_SESSION", {}))
+    return config
+
+
+def is_enabled():
+    return get_config()["ENABLED"]
+
+
+def get_denylist():
+    return caches[get_config()["DENYLIST_CACHE_ALIAS"]]
+
+
+def check_denylist_cache(app_configs, **kwargs):
+    """
+    System check: revocations must reach every worker process
+    """
+    config = get_config()
+    if not config["ENABLED"]:
+        return []
+    alias = config["DENYLIST_CACHE_ALIAS"]
+    backend = settings.CACHES.get(alias, {}).get("BACKEND")
+    if backend is None or backend in PROCESS_LOCAL_CACHES:
+        return [
+            checks.Error(
+                f"SIGNED_SESSION['DENYLIST_CACHE_ALIAS'] ({alias!r}) is not a cache shared "
+                "by the worker processes: they would accept revoked cookies.",
+                hint="Point it to a FileBasedCache, Redis or Memcached entry of CACHES.",
+                id="users_api.E001",
+            )
+        ]
+    return []
+
+
+# === Tokens === #
+def make_token(user):
+    claims = {claim: getattr(user, field) for claim, field in CLAIMS.items()}
+    claims["avatar"] = user.avatar.name if user.avatar else ""
+    # Full precision, so a cookie issued right after a revocation is accepted
+    claims["iat"] = time.time()
+    return signing.dumps(claims, salt=SALT, compress=True)
+
+
+def read_token(token):
+    """
+    Return the claims of a valid, unexpired and unrevoked token, or None
+    """
+    try:
+        claims = signing.loads(token, salt=SALT, max_age=get_config()["MAX_AGE"])
+    except signing.BadSignature:
+        return None
+    revoked_at = get_denylist().get(DENYLIST_PREFIX + str(claims["uid"]))
+    if revoked_at is not None and claims["iat"] <= revoked_at:
+        return None
+    return claims
+
+
+def user_from_claims(claims):
+    """
+    Build the user from the token alone (no query)
+    """
+    user = AppUser(
+        **{field: claims[claim] for claim, field in CLAIMS.items()}, is_active=True
+    )
+    # Behave like a user loaded from the database
+    user._state.adding = False
+    user.signed_session_claims = claims
+    return user
+
+
+def revoke(*user_ids):
+    """
+    Refuse the cookies issued so far to `user_ids`
+    """
+    if not user_ids or not is_enabled():
+        return
+    now = time.time()
+    get_denylist().set_many(
+        {DENYLIST_PREFIX + str(user_id): now for user_id in user_ids},
+        timeout=get_config()["MAX_AGE"],
+    )
+
+
+def revoke_on_change(sender, instance, update_fields=None, **kwargs):
+    """`post_save` / `post_delete` receiver: the cookies would carry stale fields"""
+    # Every login saves last_login, which isn't in the cookie
+    if update_fields is not None and set(update_fields) <= {"last_login"}:
+        return
+    revoke(instance.pk)
+
+
+# === Cookies === #
+def set_cookie(response, user):
+    if not is_enabled():
+        return response
+    config = get_config()
+    response.set_cookie(
+        config["COOKIE_NAME"],
+        make_token(user),
+        max_age=config["MAX_AGE"],
+        secure=settings.SESSION_COOKIE_SECURE,
+        httponly=True,
+        samesite="Lax",
+    )
+    return response
+
+
+def delete_cookie(response):
+    if is_enabled():
+        response.delete_cookie(get_config()["COOKIE_NAME"], samesite="Lax")
+    return response
+
+
+class SignedCookieAuthentication(BaseAuthentication):
+    """
+    Authenticate reads from the signed cookie, without touching the database
+    """
+
+    def authenticate(self, request):
+        if not is_enabled() or request.method not in SAFE_METHODS:
+            return None
+        token = request.COOKIES.get(get_config()["COOKIE_NAME"])
+        claims = read_token(token) if token else None
+        if claims is None:
+            return None
+        return (user_from_claims(claims), claims)
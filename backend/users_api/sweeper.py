@@ -0,0 +1,95 @@
+"""
+Incremental deletion of expired sessions.
+
+`clearsessions` deletes every expired row in one statement, holding SQLite's
+write lock for as long as it takes. The sweeper deletes them BATCH_SIZE at a
+time instead, oldest first through the `expire_date` index, and sleeps PAUSE
+seconds between two batches so requests can write in between. Run it with
+`manage.py sweep_sessions` (`--daemon` to keep sweeping every INTERVAL).
+"""
+
+import time
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.db import transaction
+from django.utils import timezone
+
+from backend import metrics
+from backend.logging_config import logger
+
+from . import session_backend
+from .models import UserSession
+
+DEFAULTS = {
+    # Sessions deleted per statement
+    "BATCH_SIZE": 500,
+    # Seconds to sleep between two batches
+    "PAUSE": 0.1,
+    # Seconds between two sweeps in daemon mode
+    "INTERVAL": 300,
+}
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, "SESSION_SWEEPER", {}))
+    return config
+
+
+def delete_batch(now, batch_size):
+    """
+    Delete up to `batch_size` sessions expired before `now`, return how many
+    """
+    session_keys = list(
+        Session.objects.filter(expire_date__lt=now)
+        .order_by("expire_date")
+        .values_list("session_key", flat=True)[:batch_size]
+    )
+    if not session_keys:
+        return 0
+    with transaction.atomic():
+        # Still expired: a session extended since the SELECT is kept
+        deleted = Session.objects.filter(
+            session_key__in=session_keys, expire_date__lt=now
+        ).delete()[0]
+        UserSession.objects.filter(session_key__in=session_keys).exclude(
+            session_key__in=Session.objects.filter(session_key__in=session_keys).values("session_key")
+        ).delete()
+    session_backend.evict(session_keys)
+    metrics.registry.inc("expired_sessions_deleted_total", {}, deleted)
+    return deleted
+
+
+def sweep(batch_size=None, pause=None, progress=None):
+    """
+    Delete every session expired when the sweep starts.
+
+    `progress(batches, deleted)` is called after each batch. Returns the
+    number of sessions deleted.
+    """
+    config = get_config()
+    batch_size = batch_size or config["BATCH_SIZE"]
+    pause = config["PAUSE"] if pause is None else pause
+    # Sessions expiring during the sweep are left for the next one
+    now = timezone.now()
+    start = time.monotonic()
+    batches = deleted = 0
+    while True:
+        count = delete_batch(now, batch_size)
+        if not count:
+            break
+        batches += 1
+        deleted += count
+        if progress:
+            progress(batches, deleted)
+        if count < batch_size:
+            break
+        time.sleep(pause)
+    logger.info(
+        "Session sweep: %s expired sessions deleted in %s batches (%.1f s)",
+        deleted,
+        batches,
+        time.monotonic() - start,
+    )
+    return deleted
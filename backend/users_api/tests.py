@@ -1,8 +1,57 @@
 from django.urls import reverse
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APITestCase, APIClient
-from django.contrib.auth import get_user_model
+from rest_framework.throttling import ScopedRateThrottle
+from django.contrib.auth import get_user_model, hashers
+import contextlib
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
 import unittest
+from datetime import timedelta
+from unittest import mock
+from django.conf import settings
+from django.contrib.auth.password_validation import validate_password
+from django.core.exceptions import ValidationError
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.contrib.sessions.models import Session
+from django.test import RequestFactory, TransactionTestCase, override_settings
+from django.db.models import F
+from django.utils import timezone
+from PIL import Image
+from backend import logging_config, metrics, routers
+from backend.sqlite import set_pragmas
+from django.test.utils import CaptureQueriesContext
+from . import (
+    availability,
+    avatars,
+    bulk,
+    bloom,
+    bulk_ops,
+    export,
+    hashing,
+    password_filter,
+    purge,
+    renderers,
+    session_backend,
+    signed_session,
+    sweeper,
+    user_cache,
+)
+from .fast_serializers import serialize_user
+from .models import PurgeJob, UserSession, VersionConflict
+from .serializers import UserSerializer
 
 TEST_USER = {"email": "test@test.com", "username": "test", "password": "Testpassword2"}
 
@@ -41,6 +90,14 @@ class TestUserRegister(APITestCase):
         )
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_register_single_insert(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.register_url, TEST_USER)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        # No uniqueness SELECT, no UPDATE after the INSERT
+        statements = [q["sql"].split()[0] for q in queries]
+        self.assertEqual([s for s in statements if s not in ("SAVEPOINT", "RELEASE")], ["INSERT"])
+
     def test_no_username(self):
         response = self.client.post(
             self.register_url,
@@ -284,4 +341,1474 @@ class TestChangePasswordView(APITestCase):
         self.assertEqual(
             response.data["error_msg"]["password"][0], "Please choose another password, min 8 characters"
         )
-        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestPasswordHashing(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email=TEST_USER["email"],
+            username=TEST_USER["username"],
+            password=TEST_USER["password"],
+        )
+        self.login_url = reverse("login")
+
+    def test_pool_hash_roundtrip(self):
+        encoded = hashing.make_password(TEST_USER["password"])
+        self.assertTrue(hashing.check_password(TEST_USER["password"], encoded))
+        self.assertFalse(hashing.check_password("wrongpassword", encoded))
+
+    def test_pool_checks_existing_hash(self):
+        self.assertTrue(hashing.check_password(TEST_USER["password"], self.user.password))
+
+    def test_login_when_pool_busy(self):
+        with mock.patch.object(hashing, "submit", side_effect=hashing.HashingPoolBusy):
+            response = self.client.post(
+                self.login_url,
+                {"email": TEST_USER["email"], "password": TEST_USER["password"]},
+            )
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(
+            response.data["error_msg"]["server_busy"][0], "Server is busy, please try again later"
+        )
+        self.assertEqual(response["Retry-After"], "1")
+
+    def test_login_rehashes_outdated_hash(self):
+        self.user.password = hashers.PBKDF2PasswordHasher().encode(
+            TEST_USER["password"], hashers.PBKDF2PasswordHasher().salt(), iterations=1000
+        )
+        self.user.save(update_fields=["password"])
+        self.assertTrue(hashing.must_update(self.user.password))
+
+        response = self.client.post(
+            self.login_url,
+            {"email": TEST_USER["email"], "password": TEST_USER["password"]},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertFalse(hashing.must_update(self.user.password))
+        self.assertTrue(self.user.check_password(TEST_USER["password"]))
+        # The session stays valid with the new hash
+        response = self.client.get(reverse("user"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_calibrated_hasher_parameters(self):
+        iterations = hashers.PBKDF2PasswordHasher.iterations + 1000
+        with override_settings(PASSWORD_HASHER_CALIBRATION={"pbkdf2_iterations": iterations}):
+            encoded = hashers.make_password(TEST_USER["password"])
+            self.assertTrue(encoded.startswith(f"pbkdf2_sha256${iterations}$"))
+            self.assertFalse(hashing.must_update(encoded))
+        self.assertTrue(hashing.must_update(encoded))
+        # Never below Django's cost
+        with override_settings(PASSWORD_HASHER_CALIBRATION={"pbkdf2_iterations": 1000}):
+            encoded = hashers.make_password(TEST_USER["password"])
+        self.assertTrue(encoded.startswith(f"pbkdf2_sha256${hashers.PBKDF2PasswordHasher.iterations}$"))
+
+    def test_calibrate_hasher_command(self):
+        output = os.path.join(tempfile.mkdtemp(), "calibration.json")
+        self.addCleanup(shutil.rmtree, os.path.dirname(output))
+        call_command(
+            "calibrate_hasher",
+            target_ms=1,
+            rounds=1,
+            output=output,
+            stdout=io.StringIO(),
+            stderr=io.StringIO(),
+        )
+        with open(output) as f:
+            calibration = json.load(f)
+        # Nothing reaches its minimum cost in 1 ms: fall back to a safe PBKDF2
+        self.assertEqual(calibration["algorithm"], "pbkdf2_sha256")
+        self.assertEqual(calibration["pbkdf2_iterations"], hashers.PBKDF2PasswordHasher.iterations)
+        self.assertIn("scrypt", calibration["measurements"])
+
+
+class TestSessionBackend(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email=TEST_USER["email"],
+            username=TEST_USER["username"],
+            password=TEST_USER["password"],
+        )
+        self.login_url = reverse("login")
+        self.retrieve_url = reverse("user")
+        self.logout_url = reverse("logout")
+
+    def login(self):
+        self.client.post(
+            self.login_url,
+            {"email": TEST_USER["email"], "password": TEST_USER["password"]},
+        )
+
+    def session_queries(self, queries):
+        return [q["sql"] for q in queries if "django_session" in q["sql"]]
+
+    def test_authenticated_reads_skip_session_table(self):
+        self.login()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.retrieve_url)
+            self.client.get(self.retrieve_url)
+        self.assertEqual(self.session_queries(queries), [])
+
+    def test_reads_from_db_on_cache_miss(self):
+        self.login()
+        session_backend.get_local_cache().clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.retrieve_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(self.session_queries(queries)), 1)
+
+    def test_unchanged_session_is_not_written(self):
+        self.login()
+        session_key = self.client.session.session_key
+        store = session_backend.SessionStore(session_key)
+        store.load()
+        with CaptureQueriesContext(connection) as queries:
+            store.save()
+        self.assertEqual(self.session_queries(queries), [])
+
+    def test_logout_evicts_session(self):
+        self.login()
+        session_key = self.client.session.session_key
+        self.client.post(self.logout_url)
+        self.assertFalse(session_backend.SessionStore().exists(session_key))
+
+
+class TestUserCache(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email=TEST_USER["email"],
+            username=TEST_USER["username"],
+            password=TEST_USER["password"],
+        )
+        self.client.post(
+            reverse("login"), {"email": TEST_USER["email"], "password": TEST_USER["password"]}
+        )
+
+    def change_elsewhere(self, **fields):
+        # Like another worker: the row changes, this process keeps its cached copy
+        get_user_model().objects.filter(pk=self.user.pk).update(**fields)
+
+    def test_writes_ignore_the_cached_copy(self):
+        etag = self.client.get(reverse("user"))["ETag"]
+        self.change_elsewhere(username="other", version=F("version") + 1)
+        response = self.client.put(reverse("update"), {"email": "new@test.com"}, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        response = self.client.put(reverse("update"), {"email": "new@test.com"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["username"], "other")
+        self.change_elsewhere(username="again")
+        response = self.client.post(
+            reverse("change_password"),
+            {"old_password": TEST_USER["password"], "new_password": "Newpassword2"},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.email, self.user.username), ("new@test.com", "again"))
+
+    def test_stale_saves_conflict(self):
+        stale = get_user_model().objects.get(pk=self.user.pk)
+        self.user.username = "first"
+        # A single UPDATE, guarded by the version read
+        with self.assertNumQueries(1):
+            self.user.save()
+        stale.email = "second@test.com"
+        with self.assertRaises(VersionConflict), transaction.atomic():
+            stale.save()
+        self.assertEqual(stale.version, self.user.version - 1)
+        self.assertEqual(get_user_model().objects.get(pk=self.user.pk).email, TEST_USER["email"])
+
+    def test_repeat_requests_skip_the_database(self):
+        self.client.get(reverse("user"))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("user"))
+        self.assertEqual(response.data["email"], TEST_USER["email"])
+
+    def test_save_invalidates(self):
+        self.client.get(reverse("user"))
+        self.user.username = "renamed"
+        self.user.save()
+        response = self.client.get(reverse("user"))
+        self.assertEqual(response.data["username"], "renamed")
+
+    def test_password_change_logs_out_other_sessions(self):
+        other_client = APIClient()
+        other_client.post(
+            reverse("login"), {"email": TEST_USER["email"], "password": TEST_USER["password"]}
+        )
+        other_client.get(reverse("user"))
+        self.client.post(
+            reverse("change_password"),
+            {"old_password": TEST_USER["password"], "new_password": "Newpassword3"},
+        )
+        self.assertEqual(self.client.get(reverse("user")).status_code, status.HTTP_200_OK)
+        self.assertEqual(other_client.get(reverse("user")).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_cached_copies_are_independent(self):
+        self.client.get(reverse("user"))
+        session = self.client.session
+        first = user_cache.get(session)
+        first.username = "changed"
+        self.assertEqual(user_cache.get(session).username, TEST_USER["username"])
+
+
+@override_settings(SIGNED_SESSION={"ENABLED": True})
+class TestSignedSession(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email=TEST_USER["email"],
+            username=TEST_USER["username"],
+            password=TEST_USER["password"],
+        )
+        response = self.client.post(
+            reverse("login"), {"email": TEST_USER["email"], "password": TEST_USER["password"]}
+        )
+        self.token = response.cookies["user_token"].value
+
+    def cookie_client(self, token):
+        # No session cookie: only the signed cookie authenticates
+        client = APIClient()
+        client.cookies["user_token"] = token
+        return client
+
+    def test_read_without_database(self):
+        expected = self.client.get(reverse("user")).data
+        client = self.cookie_client(self.token)
+        with self.assertNumQueries(0):
+            response = client.get(reverse("user"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, expected)
+        self.assertEqual(response["ETag"], self.user.etag)
+
+    def test_writes_need_the_session(self):
+        response = self.cookie_client(self.token).put(
+            reverse("update"), {"username": "new"}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_update_revokes_and_reissues(self):
+        response = self.client.put(reverse("update"), {"username": "new"}, format="json")
+        new_token = response.cookies["user_token"].value
+        self.assertEqual(self.cookie_client(self.token).get(reverse("user")).status_code, 403)
+        response = self.cookie_client(new_token).get(reverse("user"))
+        self.assertEqual(response.data["username"], "new")
+
+    def test_logout_revokes(self):
+        self.client.post(reverse("logout"))
+        response = self.cookie_client(self.token).get(reverse("user"))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_invalid_cookie_falls_back_to_session(self):
+        self.client.cookies["user_token"] = self.token[:-2] + "xx"
+        response = self.client.get(reverse("user"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # A valid cookie is issued again
+        self.assertIn("user_token", response.cookies)
+
+    def test_expired_cookie(self):
+        with override_settings(SIGNED_SESSION={"ENABLED": True, "MAX_AGE": -1}):
+            response = self.cookie_client(self.token).get(reverse("user"))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_denylist_cache_check(self):
+        # The test settings use the process-local LocMemCache
+        errors = signed_session.check_denylist_cache(None)
+        self.assertEqual([error.id for error in errors], ["users_api.E001"])
+        shared = {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": "/tmp"}
+        with override_settings(CACHES={"default": shared}):
+            self.assertEqual(signed_session.check_denylist_cache(None), [])
+        with override_settings(SIGNED_SESSION={"ENABLED": False}):
+            self.assertEqual(signed_session.check_denylist_cache(None), [])
+
+
+class TestSessionSweeper(APITestCase):
+    def create_sessions(self, count, expire_date):
+        Session.objects.bulk_create(
+            Session(
+                session_key=f"{expire_date.timestamp():.0f}-{i}",
+                session_data="",
+                expire_date=expire_date,
+            )
+            for i in range(count)
+        )
+
+    def test_sweep_in_batches(self):
+        now = timezone.now()
+        self.create_sessions(5, now - timedelta(days=1))
+        self.create_sessions(2, now + timedelta(days=1))
+        batches = []
+        with mock.patch("users_api.sweeper.time.sleep") as sleep:
+            deleted = sweeper.sweep(
+                batch_size=2, pause=1, progress=lambda *args: batches.append(args)
+            )
+        self.assertEqual(deleted, 5)
+        self.assertEqual(batches, [(1, 2), (2, 4), (3, 5)])
+        self.assertEqual(sleep.call_count, 2)
+        self.assertFalse(Session.objects.filter(expire_date__lt=now).exists())
+        self.assertEqual(Session.objects.count(), 2)
+
+    def test_session_extended_during_the_batch(self):
+        now = timezone.now()
+        self.create_sessions(2, now - timedelta(days=1))
+        user = get_user_model().objects.create_user(**TEST_USER)
+        extended = Session.objects.first()
+        UserSession.objects.create(user=user, session_key=extended.session_key)
+
+        @contextlib.contextmanager
+        def extended_meanwhile():
+            # The user was active between the SELECT and the DELETE
+            Session.objects.filter(pk=extended.pk).update(expire_date=now + timedelta(days=1))
+            with transaction.atomic():
+                yield
+
+        with mock.patch.object(sweeper, "transaction", mock.Mock(atomic=extended_meanwhile)):
+            self.assertEqual(sweeper.delete_batch(now, 10), 1)
+        self.assertEqual(list(Session.objects.all()), [extended])
+        self.assertTrue(UserSession.objects.filter(session_key=extended.session_key).exists())
+
+    def test_sweep_command(self):
+        self.create_sessions(3, timezone.now() - timedelta(days=1))
+        stdout = io.StringIO()
+        call_command("sweep_sessions", pause=0, stdout=stdout)
+        self.assertIn("Deleted 3 expired sessions", stdout.getvalue())
+        self.assertFalse(Session.objects.exists())
+
+
+class TestUserETag(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email=TEST_USER["email"],
+            username=TEST_USER["username"],
+            password=TEST_USER["password"],
+        )
+        self.login_url = reverse("login")
+        self.retrieve_url = reverse("user")
+        self.update_url = reverse("update")
+        self.client.post(
+            self.login_url,
+            {"email": TEST_USER["email"], "password": TEST_USER["password"]},
+        )
+
+    def test_not_modified(self):
+        etag = self.client.get(self.retrieve_url)["ETag"]
+        response = self.client.get(self.retrieve_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["ETag"], etag)
+
+    def test_etag_changes_after_update(self):
+        etag = self.client.get(self.retrieve_url)["ETag"]
+        self.client.put(self.update_url, {"username": "newusername"})
+        response = self.client.get(self.retrieve_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.data["username"], "newusername")
+
+    def test_login_does_not_change_etag(self):
+        etag = self.client.get(self.retrieve_url)["ETag"]
+        self.client.post(
+            self.login_url,
+            {"email": TEST_USER["email"], "password": TEST_USER["password"]},
+        )
+        self.assertEqual(self.client.get(self.retrieve_url)["ETag"], etag)
+
+    def test_update_with_stale_etag(self):
+        etag = self.client.get(self.retrieve_url)["ETag"]
+        self.client.put(self.update_url, {"username": "newusername"}, HTTP_IF_MATCH=etag)
+        response = self.client.put(self.update_url, {"username": "other"}, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(
+            response.data["error_msg"]["precondition"][0],
+            "User was modified, please reload and try again",
+        )
+
+    def put_with_concurrent_save(self, data, **extra):
+        # Another request saves the user after this one read it
+        is_valid = UserSerializer.is_valid
+        saves = []
+
+        def validate_and_save_elsewhere(serializer, *args, **kwargs):
+            if not saves:
+                other = get_user_model().objects.get(pk=self.user.pk)
+                other.username = "elsewhere"
+                other.save()
+                saves.append(other)
+            return is_valid(serializer, *args, **kwargs)
+
+        with mock.patch.object(
+            UserSerializer, "is_valid", autospec=True, side_effect=validate_and_save_elsewhere
+        ):
+            return self.client.put(self.update_url, data, **extra)
+
+    def test_concurrent_update(self):
+        etag = self.client.get(self.retrieve_url)["ETag"]
+        response = self.put_with_concurrent_save({"email": "new@test.com"}, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(response["ETag"], f'"{self.user.pk}-2"')
+        # Without If-Match, applied to the row saved concurrently
+        response = self.put_with_concurrent_save({"email": "new@test.com"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["username"], "elsewhere")
+        self.assertEqual(response["ETag"], f'"{self.user.pk}-4"')
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.email, self.user.version), ("new@test.com", 4))
+
+
+def make_image(name="avatar.png", size=(600, 400)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, "red").save(buffer, format="PNG")
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+
+class TestAvatarDerivatives(APITestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.settings_override = override_settings(
+            MEDIA_ROOT=media_root, AVATAR_DERIVATIVES={"ASYNC": False}
+        )
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email=TEST_USER["email"],
+            username=TEST_USER["username"],
+            password=TEST_USER["password"],
+        )
+        self.client.post(
+            reverse("login"),
+            {"email": TEST_USER["email"], "password": TEST_USER["password"]},
+        )
+
+    def test_derivatives_generated(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(reverse("update"), {"avatar": make_image()})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["avatar_thumbnails"], {})
+
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.avatar_hash)
+        response = self.client.get(reverse("user"))
+        self.assertEqual(set(response.data["avatar_thumbnails"]), {"64", "128", "256"})
+        for size, names in avatars.derivative_names(self.user.avatar_hash).items():
+            with default_storage.open(names["webp"]) as f:
+                self.assertEqual(Image.open(f).size, (size, size))
+            self.assertTrue(default_storage.exists(names["jpeg"]))
+
+    def test_same_content_shares_derivatives(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(reverse("update"), {"avatar": make_image("first.png")})
+        self.user.refresh_from_db()
+        first_hash = self.user.avatar_hash
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(reverse("update"), {"avatar": make_image("second.png")})
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.avatar_hash, first_hash)
+
+
+class TestAccountPurge(APITestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.settings_override = override_settings(
+            MEDIA_ROOT=media_root,
+            AVATAR_DERIVATIVES={"ASYNC": False},
+            ACCOUNT_PURGE={"ASYNC": False},
+        )
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+        self.user = get_user_model().objects.create_user(
+            email=TEST_USER["email"],
+            username=TEST_USER["username"],
+            password=TEST_USER["password"],
+        )
+        self.user.avatar = make_image()
+        self.user.save()
+        avatars.generate_derivatives(self.user.pk)
+        self.user.refresh_from_db()
+
+        self.client = APIClient()
+        self.other_client = APIClient()
+        for client in (self.client, self.other_client):
+            client.post(
+                reverse("login"),
+                {"email": TEST_USER["email"], "password": TEST_USER["password"]},
+            )
+
+    def test_delete_is_soft(self):
+        response = self.client.delete(reverse("delete"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertEqual(PurgeJob.objects.get(user_id=self.user.pk).state, PurgeJob.PENDING)
+        # Every session is refused right away, logging in again too
+        response = self.other_client.get(reverse("user"))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.post(
+            reverse("login"), {"email": TEST_USER["email"], "password": TEST_USER["password"]}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_purge(self):
+        files = [self.user.avatar.name] + [
+            name
+            for formats in avatars.derivative_names(self.user.avatar_hash).values()
+            for name in formats.values()
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse("delete"))
+
+        self.assertFalse(get_user_model().objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(Session.objects.exists())
+        self.assertFalse(any(default_storage.exists(name) for name in files))
+        job = PurgeJob.objects.get(user_id=self.user.pk)
+        self.assertEqual(job.state, PurgeJob.DONE)
+        self.assertEqual(job.progress, {"sessions": 1, "files": 7, "related": 0, "user": 1})
+
+    def test_purge_retried(self):
+        storage = mock.Mock(**{"exists.return_value": True, "delete.side_effect": OSError("disk")})
+        with mock.patch("users_api.purge.default_storage", storage):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.delete(reverse("delete"))
+        job = PurgeJob.objects.get(user_id=self.user.pk)
+        self.assertEqual((job.state, job.attempts), (PurgeJob.PENDING, 1))
+        self.assertIn("disk", job.last_error)
+        self.assertEqual(job.progress, {"sessions": 1})
+        # Not due before the backoff delay
+        self.assertEqual(purge.due_jobs(), [])
+
+        PurgeJob.objects.filter(pk=job.pk).update(next_attempt_at=timezone.now())
+        call_command("purge_accounts", stdout=io.StringIO())
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.attempts), (PurgeJob.DONE, 2))
+        self.assertFalse(get_user_model().objects.filter(pk=self.user.pk).exists())
+
+    def test_reactivated_before_purge(self):
+        # Jobs not run: the deletion doesn't commit
+        self.client.delete(reverse("delete"))
+        bulk_ops.apply("activate", [self.user.pk])
+        self.assertFalse(PurgeJob.objects.exists())
+
+        job = purge.soft_delete(self.user)
+        # e.g. reactivated from the admin change form
+        get_user_model().objects.filter(pk=self.user.pk).update(is_active=True)
+        self.assertIsNone(purge.run_job(job.pk))
+        self.assertFalse(PurgeJob.objects.exists())
+        self.assertTrue(default_storage.exists(self.user.avatar.name))
+        self.assertTrue(UserSession.objects.filter(user=self.user).exists())
+        self.assertTrue(get_user_model().objects.get(pk=self.user.pk).is_active)
+
+
+class TestMediaServing(APITestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.settings_override = override_settings(MEDIA_ROOT=media_root)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+        self.client = APIClient()
+        self.content = bytes(range(256)) * 4
+        default_storage.save("media/avatar.png", io.BytesIO(self.content))
+        self.hashed_name = "avatars/%s-64.webp" % ("a" * 32)
+        default_storage.save(self.hashed_name, io.BytesIO(self.content))
+
+    def get(self, path, **headers):
+        return self.client.get(settings.MEDIA_URL + path, **headers)
+
+    def test_full_file(self):
+        response = self.get("media/avatar.png")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(response["Cache-Control"], "public, max-age=3600")
+
+    def test_hashed_file_is_immutable(self):
+        response = self.get(self.hashed_name)
+        self.assertEqual(response["Cache-Control"], "public, max-age=31536000, immutable")
+
+    def test_uploaded_avatar_is_immutable(self):
+        user = get_user_model().objects.create_user(**TEST_USER)
+        for _ in range(2):
+            # The same content twice: the storage adds a suffix to the name
+            user.avatar = make_image()
+            user.save()
+            response = self.get(user.avatar.name)
+            self.assertEqual(response["Cache-Control"], "public, max-age=31536000, immutable")
+        self.assertRegex(user.avatar.name, r"^media/[0-9a-f]{32}_\w{7}\.png$")
+
+    def test_range(self):
+        response = self.get("media/avatar.png", HTTP_RANGE="bytes=10-19")
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b"".join(response.streaming_content), self.content[10:20])
+        self.assertEqual(response["Content-Range"], "bytes 10-19/1024")
+        self.assertEqual(response["Content-Length"], "10")
+
+    def test_suffix_range(self):
+        response = self.get("media/avatar.png", HTTP_RANGE="bytes=-4")
+        self.assertEqual(b"".join(response.streaming_content), self.content[-4:])
+
+    def test_unsatisfiable_range(self):
+        response = self.get("media/avatar.png", HTTP_RANGE="bytes=5000-")
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response["Content-Range"], "bytes */1024")
+
+    def test_not_modified(self):
+        response = self.get("media/avatar.png")
+        response = self.get("media/avatar.png", HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        etag = response["ETag"]
+        response = self.get("media/avatar.png", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.get("media/avatar.png", HTTP_IF_NONE_MATCH=f'"other", W/{etag}')
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_accel_redirect(self):
+        with override_settings(MEDIA_SERVING={"SENDFILE": "x-accel-redirect"}):
+            response = self.get("media/avatar.png")
+        self.assertEqual(response["X-Accel-Redirect"], "/protected-media/media/avatar.png")
+        self.assertEqual(response.content, b"")
+
+    def test_path_traversal(self):
+        response = self.get("../settings.py")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class TestImportUsers(APITestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        get_user_model().objects.create_user(
+            email=TEST_USER["email"],
+            username=TEST_USER["username"],
+            password=TEST_USER["password"],
+        )
+
+    def write(self, name, content):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def test_import_csv(self):
+        path = self.write(
+            "users.csv",
+            "email,username,password\n"
+            "one@test.com,one,Testpassword2\n"
+            "two@test.com,two,Testpassword2\n"
+            "bad@test.com,bad,2short\n"
+            "test@test.com,dup,Testpassword2\n"
+            "one@test.com,dup,Testpassword2\n",
+        )
+        rejects = os.path.join(self.tmp_dir, "rejects.jsonl")
+        call_command("import_users", path, chunk_size=2, rejects=rejects, stdout=io.StringIO())
+
+        user = get_user_model().objects.get(email="one@test.com")
+        self.assertTrue(user.check_password("Testpassword2"))
+        self.assertTrue(get_user_model().objects.filter(email="two@test.com").exists())
+        self.assertEqual(get_user_model().objects.count(), 3)
+        with open(rejects) as f:
+            # Lines of the file, header included
+            self.assertEqual([json.loads(line)["line"] for line in f], [4, 5, 6])
+
+    def test_import_jsonl(self):
+        path = self.write(
+            "users.jsonl",
+            '{"email": "one@test.com", "username": "one", "password": "Testpassword2"}\n'
+            '{"email": "not-an-email", "username": "two", "password": "Testpassword2"}\n'
+            "\n"
+            "not json\n",
+        )
+        stderr = io.StringIO()
+        call_command("import_users", path, stdout=io.StringIO(), stderr=stderr)
+        self.assertTrue(get_user_model().objects.filter(email="one@test.com").exists())
+        self.assertIn("Enter a valid email address.", stderr.getvalue())
+        self.assertIn("Rejected line 2", stderr.getvalue())
+        # Blank lines are skipped but counted
+        self.assertIn("Rejected line 4", stderr.getvalue())
+
+
+class TestBatchRegister(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        get_user_model().objects.create_superuser(
+            email="admin@test.com", username="admin", password=TEST_USER["password"]
+        )
+        self.client.post(
+            reverse("login"), {"email": "admin@test.com", "password": TEST_USER["password"]}
+        )
+        self.batch_url = reverse("register_batch")
+
+    def test_batch_register(self):
+        users = [
+            {"email": "one@test.com", "username": "one", "password": TEST_USER["password"]},
+            {"email": "bad", "username": "two", "password": TEST_USER["password"]},
+            {"email": "Admin@test.com", "username": "dup", "password": TEST_USER["password"]},
+            {"email": "three@test.com", "username": "three", "password": TEST_USER["password"]},
+        ]
+        response = self.client.post(self.batch_url, {"users": users}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(
+            [(item["index"], item["email"]) for item in response.data["created"]],
+            [(0, "one@test.com"), (3, "three@test.com")],
+        )
+        self.assertEqual([item["index"] for item in response.data["errors"]], [1, 2])
+        self.assertEqual(
+            response.data["errors"][1]["errors"]["email"][0],
+            "app user with this email already exists.",
+        )
+        user = get_user_model().objects.get(email="three@test.com")
+        self.assertTrue(user.check_password(TEST_USER["password"]))
+
+    def test_batch_register_all_created(self):
+        users = [{"email": "one@test.com", "username": "one", "password": TEST_USER["password"]}]
+        response = self.client.post(self.batch_url, {"users": users}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["errors"], [])
+
+    def test_batch_register_empty(self):
+        response = self.client.post(self.batch_url, {"users": []}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_batch_register_not_admin(self):
+        self.client.logout()
+        response = self.client.post(self.batch_url, {"users": [TEST_USER]}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_concurrent_duplicates(self):
+        users = get_user_model().objects
+        real_bulk_create = users.bulk_create
+        # Each attempt collides with an email registered in the meantime
+        collisions = iter(["a@test.com", "b@test.com"])
+
+        def bulk_create(objs):
+            email = next(collisions, None)
+            if email is None:
+                return real_bulk_create(objs)
+            users.create_user(email=email, username="other", password=TEST_USER["password"])
+            raise IntegrityError("UNIQUE constraint failed: users_api_appuser.email_normalized")
+
+        rows = [{**TEST_USER, "email": email} for email in ("a@test.com", "b@test.com", "c@test.com")]
+        with (
+            mock.patch.object(users, "bulk_create", side_effect=bulk_create),
+            # Keep the concurrent users, the savepoint would roll them back
+            mock.patch.object(bulk, "transaction", mock.Mock(atomic=contextlib.nullcontext)),
+        ):
+            created, rejects = bulk.create_users(rows)
+        self.assertEqual([user.email for user in created], ["c@test.com"])
+        self.assertEqual([index for index, _ in rejects], [0, 1])
+
+
+class TestBulkUserActions(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = get_user_model().objects.create_superuser(
+            email="admin@test.com", username="admin", password=TEST_USER["password"]
+        )
+        self.client.post(
+            reverse("login"), {"email": "admin@test.com", "password": TEST_USER["password"]}
+        )
+        self.users = [
+            get_user_model().objects.create_user(
+                email=f"user{i}@spam.com", username=f"user{i}", password=TEST_USER["password"]
+            )
+            for i in range(3)
+        ]
+        self.user_client = APIClient()
+        self.user_client.post(
+            reverse("login"), {"email": "user0@spam.com", "password": TEST_USER["password"]}
+        )
+        self.bulk_url = reverse("bulk_users")
+
+    def test_deactivate_ids(self):
+        ids = [user.pk for user in self.users[:2]]
+        response = self.client.post(
+            self.bulk_url, {"action": "deactivate", "ids": ids}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["changed"], 2)
+        self.assertEqual(response.data["sessions_deleted"], 1)
+        self.assertEqual(
+            list(get_user_model().objects.filter(is_active=False).values_list("pk", flat=True)),
+            ids,
+        )
+        self.assertFalse(UserSession.objects.filter(user_id__in=ids).exists())
+        response = self.user_client.get(reverse("user"))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_deactivate_after_password_change(self):
+        old_key = self.user_client.session.session_key
+        response = self.user_client.post(
+            reverse("change_password"),
+            {"old_password": TEST_USER["password"], "new_password": "Newpassword2"},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # update_session_auth_hash rotated the key, the new one is tracked
+        new_key = self.user_client.session.session_key
+        self.assertNotEqual(new_key, old_key)
+        self.assertEqual(
+            list(UserSession.objects.filter(user=self.users[0]).values_list("session_key", flat=True)),
+            [new_key],
+        )
+        response = self.client.post(
+            self.bulk_url, {"action": "deactivate", "ids": [self.users[0].pk]}, format="json"
+        )
+        self.assertEqual(response.data["sessions_deleted"], 1)
+        self.assertFalse(Session.objects.filter(session_key=new_key).exists())
+
+    def test_login_switching_users(self):
+        # login() flushes the session of the previous user
+        with CaptureQueriesContext(connection) as queries:
+            self.user_client.post(
+                reverse("login"), {"email": "user1@spam.com", "password": TEST_USER["password"]}
+            )
+        session_key = self.user_client.session.session_key
+        self.assertEqual(
+            list(UserSession.objects.filter(user=self.users[1]).values_list("session_key", flat=True)),
+            [session_key],
+        )
+        self.assertFalse(
+            [q for q in queries if q["sql"].startswith('UPDATE "users_api_usersession"')]
+        )
+
+    def test_delete_filter_in_chunks(self):
+        user_ids = bulk_ops.select_users(filters={"email__iendswith": "@spam.com"})
+        with CaptureQueriesContext(connection) as queries:
+            changed, sessions = bulk_ops.apply("delete", user_ids, chunk_size=2)
+        self.assertEqual((changed, sessions), (3, 1))
+        # One DELETE of users per chunk
+        user_deletes = [
+            q for q in queries if q["sql"].startswith('DELETE FROM "users_api_appuser" ')
+        ]
+        self.assertEqual(len(user_deletes), 2)
+        self.assertEqual(list(get_user_model().objects.all()), [self.admin])
+        self.assertEqual(Session.objects.count(), 1)
+
+    def test_demote_excludes_self(self):
+        response = self.client.post(
+            self.bulk_url, {"action": "demote", "filter": {"is_admin": True}}, format="json"
+        )
+        self.assertEqual(response.data["matched"], 0)
+        self.admin.refresh_from_db()
+        self.assertTrue(self.admin.is_admin)
+
+    def test_invalid_requests(self):
+        for data in (
+            {"action": "delete"},
+            {"action": "delete", "filter": {}},
+            {"action": "delete", "filter": {"password": "x"}},
+            {"action": "explode", "ids": [1]},
+        ):
+            response = self.client.post(self.bulk_url, data, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(get_user_model().objects.count(), 4)
+
+    def test_admin_action(self):
+        response = self.client.post(
+            reverse("admin:users_api_appuser_changelist"),
+            {"action": "promote_users", "_selected_action": [self.users[0].pk, self.users[1].pk]},
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(get_user_model().objects.filter(is_admin=True).count(), 3)
+
+    def test_logout_forgets_session(self):
+        self.user_client.post(reverse("logout"))
+        self.assertFalse(UserSession.objects.filter(user=self.users[0]).exists())
+
+
+class TestUserExport(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = get_user_model().objects.create_superuser(
+            email="admin@test.com", username="admin", password=TEST_USER["password"]
+        )
+        for i in range(5):
+            get_user_model().objects.create(email=f"user{i}@test.com", username=f"user{i}")
+        self.export_url = reverse("export")
+
+    def login(self, email):
+        self.client.post(reverse("login"), {"email": email, "password": TEST_USER["password"]})
+
+    def test_export_csv(self):
+        self.login("admin@test.com")
+        response = self.client.get(self.export_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], ",".join(export.FIELDS))
+        self.assertEqual(len(lines), 7)
+
+    def test_export_jsonl_in_chunks(self):
+        lines = "".join(export.export("jsonl", chunk_size=2)[0]).splitlines()
+        emails = [json.loads(line)["email"] for line in lines]
+        self.assertEqual(emails, ["admin@test.com"] + [f"user{i}@test.com" for i in range(5)])
+
+    def test_export_command(self):
+        stdout = io.StringIO()
+        call_command("export_users", format="jsonl", stdout=stdout)
+        self.assertEqual(len(stdout.getvalue().splitlines()), 6)
+
+    def test_not_admin(self):
+        get_user_model().objects.create_user(
+            email=TEST_USER["email"], username=TEST_USER["username"], password=TEST_USER["password"]
+        )
+        self.login(TEST_USER["email"])
+        response = self.client.get(self.export_url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class TestCaseInsensitiveEmail(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email=TEST_USER["email"],
+            username=TEST_USER["username"],
+            password=TEST_USER["password"],
+        )
+
+    def test_login_mixed_case(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse("login"), {"email": "Test@TEST.com", "password": TEST_USER["password"]}
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("email_normalized", queries[0]["sql"])
+
+    def test_register_mixed_case_duplicate(self):
+        response = self.client.post(reverse("register"), {**TEST_USER, "email": "TEST@test.com"})
+        self.assertEqual(
+            response.data["error_msg"]["email"][0], "app user with this email already exists."
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_update_keeps_own_email(self):
+        self.client.post(reverse("login"), {"email": TEST_USER["email"], "password": TEST_USER["password"]})
+        response = self.client.put(reverse("update"), {"email": "Test@test.com"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.email_normalized, "test@test.com")
+
+    def test_natural_key(self):
+        self.assertEqual(get_user_model().objects.get_by_natural_key("TEST@test.com"), self.user)
+
+
+@override_settings(ROOT_URLCONF="users_api.async_urls")
+class TestAsyncViews(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email=TEST_USER["email"],
+            username=TEST_USER["username"],
+            password=TEST_USER["password"],
+        )
+
+    def login(self):
+        return self.client.post(
+            reverse("login"),
+            {"email": TEST_USER["email"], "password": TEST_USER["password"]},
+            format="json",
+        )
+
+    def test_register(self):
+        response = self.client.post(
+            reverse("register"),
+            {"email": "new@test.com", "username": "new", "password": TEST_USER["password"]},
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        user = get_user_model().objects.get(email="new@test.com")
+        self.assertTrue(user.check_password(TEST_USER["password"]))
+
+    def test_register_existing_email(self):
+        response = self.client.post(reverse("register"), TEST_USER)
+        self.assertEqual(
+            response.json()["error_msg"]["email"][0], "app user with this email already exists."
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_login_and_retrieve(self):
+        response = self.login()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["email"], TEST_USER["email"])
+        response = self.client.get(reverse("user"))
+        self.assertEqual(response.json()["username"], TEST_USER["username"])
+        response = self.client.get(reverse("user"), HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_bad_login(self):
+        response = self.client.post(
+            reverse("login"), {"email": TEST_USER["email"], "password": "wrongpassword"}
+        )
+        self.assertEqual(
+            response.json()["error_msg"]["invalid_login"][0], "Invalid email or password"
+        )
+
+    def test_not_logged_in(self):
+        response = self.client.get(reverse("user"))
+        self.assertEqual(response.json()["detail"], "Authentication credentials were not provided.")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_update(self):
+        self.login()
+        response = self.client.put(reverse("update"), {"username": "newusername"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["username"], "newusername")
+
+    def test_update_like_the_sync_view(self):
+        self.login()
+        etag = self.client.get(reverse("user"))["ETag"]
+        response = self.client.put(reverse("update"), {"username": "newusername"}, HTTP_IF_MATCH=etag)
+        self.user.refresh_from_db()
+        self.assertEqual(response["ETag"], self.user.etag)
+        self.assertEqual(
+            response.json(), serialize_user(self.user, RequestFactory().get("/"))
+        )
+        response = self.client.put(reverse("update"), {"username": "other"}, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+    @override_settings(SIGNED_SESSION={"ENABLED": True})
+    def test_signed_cookie_set_and_revoked(self):
+        token = self.login().cookies["user_token"].value
+        self.assertIsNotNone(signed_session.read_token(token))
+        response = self.client.post(reverse("logout"))
+        self.assertEqual(response.cookies["user_token"].value, "")
+        self.assertIsNone(signed_session.read_token(token))
+
+    def test_change_password_and_logout(self):
+        self.login()
+        response = self.client.post(
+            reverse("change_password"),
+            {"old_password": TEST_USER["password"], "new_password": "Newpassword2"},
+        )
+        self.assertEqual(response.json()["success_msg"], "Password updated successfully")
+        # Still logged in after the password change
+        self.assertEqual(self.client.get(reverse("user")).status_code, status.HTTP_200_OK)
+        response = self.client.post(reverse("logout"))
+        self.assertEqual(response.json()["success_msg"], "User logged out successfully")
+        self.assertEqual(self.client.get(reverse("user")).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_bad_new_password(self):
+        self.login()
+        response = self.client.post(
+            reverse("change_password"),
+            {"old_password": TEST_USER["password"], "new_password": "2short"},
+        )
+        self.assertEqual(
+            response.json()["error_msg"]["password"][0],
+            "Please choose another password, min 8 characters",
+        )
+
+    @override_settings(ACCOUNT_PURGE={"ASYNC": False})
+    def test_delete(self):
+        self.login()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(reverse("delete"))
+        self.assertEqual(response.json()["message"], "User account deleted successfully")
+        self.assertFalse(get_user_model().objects.filter(pk=self.user.pk).exists())
+
+
+class TestSQLitePragmas(APITestCase):
+    def setUp(self):
+        # The test connection is shared with the other tests: restore its pragmas
+        with connection.cursor() as cursor:
+            previous = {
+                pragma: cursor.execute(f"PRAGMA {pragma}").fetchone()[0]
+                for pragma in ("cache_size", "busy_timeout")
+            }
+        self.addCleanup(
+            override_settings(SQLITE_PRAGMAS=previous)(set_pragmas), sender=None, connection=connection
+        )
+
+    @override_settings(SQLITE_PRAGMAS={"cache_size": -1234, "busy_timeout": 4321})
+    def test_pragmas_applied(self):
+        set_pragmas(sender=None, connection=connection)
+        with connection.cursor() as cursor:
+            self.assertEqual(cursor.execute("PRAGMA cache_size").fetchone()[0], -1234)
+            self.assertEqual(cursor.execute("PRAGMA busy_timeout").fetchone()[0], 4321)
+
+
+@override_settings(DATABASE_REPLICAS=["replica1"])
+class TestReplicaRouter(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.router = routers.ReplicaRouter()
+        self.real_is_available = routers.is_available
+        patcher = mock.patch.object(routers, "is_available", return_value=True)
+        self.is_available = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(self.router.db_for_read(get_user_model()), "replica1")
+        self.assertEqual(self.router.db_for_write(get_user_model()), "default")
+
+    def test_sessions_read_from_primary(self):
+        self.assertEqual(self.router.db_for_read(Session), "default")
+
+    def test_unavailable_replica(self):
+        self.is_available.return_value = False
+        self.assertEqual(self.router.db_for_read(get_user_model()), "default")
+
+    def test_pinned_during_and_after_write(self):
+        get_user_model().objects.create_user(
+            email=TEST_USER["email"], username=TEST_USER["username"], password=TEST_USER["password"]
+        )
+        response = self.client.post(
+            reverse("login"),
+            {"email": TEST_USER["email"], "password": TEST_USER["password"]},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.cookies["pin_primary"]["max-age"], 5)
+
+        middleware = routers.PrimaryPinMiddleware(lambda request: None)
+        factory = RequestFactory()
+        self.assertTrue(middleware.must_pin(factory.post("/")))
+        self.assertFalse(middleware.must_pin(factory.get("/")))
+        request = factory.get("/")
+        request.COOKIES["pin_primary"] = "1"
+        self.assertTrue(middleware.must_pin(request))
+
+    def test_background_jobs_read_from_primary(self):
+        with routers.primary():
+            self.assertEqual(self.router.db_for_read(get_user_model()), "default")
+        self.assertEqual(self.router.db_for_read(get_user_model()), "replica1")
+        # "replica1" isn't configured: any read routed to it would raise
+        self.assertIsNone(avatars.generate_derivatives(0))
+        self.assertEqual(purge.due_jobs(), [])
+
+    def test_missing_sqlite_replica(self):
+        self.addCleanup(routers._down_until.clear)
+        replica = {"ENGINE": "django.db.backends.sqlite3", "NAME": "/nonexistent/replica.sqlite3"}
+        with mock.patch.dict(settings.DATABASES, {"replica_missing": replica}):
+            self.assertFalse(self.real_is_available("replica_missing"))
+
+
+class TestMetrics(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        get_user_model().objects.create_user(
+            email=TEST_USER["email"], username=TEST_USER["username"], password=TEST_USER["password"]
+        )
+
+    def test_scrape(self):
+        self.client.post(
+            reverse("login"), {"email": TEST_USER["email"], "password": TEST_USER["password"]}
+        )
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        body = response.content.decode()
+        self.assertIn('http_requests_total{method="POST",status="200",view="login"}', body)
+        self.assertIn('http_request_duration_seconds_bucket{view="login",le="+Inf"}', body)
+        self.assertIn('db_queries_total{view="login"}', body)
+        self.assertIn('password_hash_duration_seconds_count{operation="check"}', body)
+
+    def test_large_values(self):
+        registry = metrics.Registry()
+        registry.inc("http_requests_total", {"view": "user"}, 1234567)
+        registry.observe("http_request_duration_seconds", {"view": "user"}, 1234567.125)
+        body = registry.render()
+        self.assertIn('http_requests_total{view="user"} 1234567.0\n', body)
+        self.assertIn('http_request_duration_seconds_sum{view="user"} 1234567.125\n', body)
+
+    def test_forbidden(self):
+        response = self.client.get(reverse("metrics"), REMOTE_ADDR="10.0.0.1")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_multiprocess_merge(self):
+        metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, metrics_dir)
+        other = metrics.Registry()
+        other.inc("http_requests_total", {"view": "user", "method": "GET", "status": 200}, 3)
+        other.observe("http_request_duration_seconds", {"view": "user"}, 0.02)
+        with open(os.path.join(metrics_dir, "1.json"), "w") as f:
+            json.dump(other.snapshot(), f)
+        with override_settings(METRICS={"MULTIPROCESS_DIR": metrics_dir}):
+            merged = metrics.collect()
+        labels = (("method", "GET"), ("status", 200), ("view", "user"))
+        self.assertGreaterEqual(merged.counters[("http_requests_total", labels)], 3)
+        self.assertIn('http_request_duration_seconds_bucket{view="user",le="0.025"}', merged.render())
+
+
+class TestLogging(APITestCase):
+    def test_request_id_header(self):
+        response = self.client.get(reverse("user"), HTTP_X_REQUEST_ID="abc-123")
+        self.assertEqual(response["X-Request-ID"], "abc-123")
+        response = self.client.get(reverse("user"), HTTP_X_REQUEST_ID="bad id\n")
+        self.assertRegex(response["X-Request-ID"], r"^[0-9a-f]{32}$")
+
+    def test_json_format(self):
+        record = logging.LogRecord(
+            "backend.logging_config", logging.INFO, __file__, 1, "User updated: %s", ("a@b.com",), None
+        )
+        token = logging_config.request_id.set("abc-123")
+        try:
+            logging_config.RequestIdFilter().filter(record)
+        finally:
+            logging_config.request_id.reset(token)
+        entry = json.loads(logging_config.JSONFormatter().format(record))
+        self.assertEqual(entry["message"], "User updated: a@b.com")
+        self.assertEqual(entry["request_id"], "abc-123")
+        self.assertEqual(entry["level"], "INFO")
+
+    def test_exception_field(self):
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            record = logging.LogRecord(
+                "backend.logging_config", logging.ERROR, __file__, 1, "Purge of user %s failed", (42,), sys.exc_info()
+            )
+        # Queued as is, formatted by the listener
+        queued = logging_config.queue_handler.prepare(record)
+        entry = json.loads(logging_config.JSONFormatter().format(queued))
+        self.assertEqual(entry["message"], "Purge of user 42 failed")
+        self.assertIn("ValueError: boom", entry["exception"])
+
+    def test_logger_setup(self):
+        # Records are only queued on the request thread, the listener writes them
+        self.assertEqual(logging_config.logger.handlers, [logging_config.queue_handler])
+        self.assertEqual(logging_config.listener.handlers, (logging_config.stream_handler,))
+        self.assertEqual(logging.getLevelName(logging_config.logger.level), settings.LOG_LEVEL)
+
+
+class TestFastSerializer(APITestCase):
+    def setUp(self):
+        self.request = RequestFactory().get(reverse("user"))
+
+    def assertSameBody(self, user, request):
+        expected = JSONRenderer().render(UserSerializer(user, context={"request": request}).data)
+        self.assertEqual(JSONRenderer().render(serialize_user(user, request)), expected)
+        self.assertEqual(renderers.FastJSONRenderer().render(serialize_user(user, request)), expected)
+
+    def test_same_output_as_serializer(self):
+        user = get_user_model().objects.create_user(**TEST_USER)
+        self.assertSameBody(user, self.request)
+        self.assertSameBody(user, None)
+        user.username = "tést    \U0001f600"
+        user.avatar = "media/test.png"
+        user.avatar_hash = "0123456789abcdef0123456789abcdef"
+        self.assertSameBody(user, self.request)
+        self.assertSameBody(user, None)
+
+    def test_retrieve_response(self):
+        user = get_user_model().objects.create_user(**TEST_USER)
+        self.client.force_authenticate(user)
+        response = self.client.get(reverse("user"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.json(), UserSerializer(user, context={"request": response.wsgi_request}).data
+        )
+
+
+@unittest.skipUnless(renderers.msgpack, "msgpack is not installed")
+class TestMessagePack(APITestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(**TEST_USER)
+
+    def post(self, url, data):
+        return self.client.post(
+            url,
+            renderers.packb(data),
+            content_type="application/msgpack",
+            HTTP_ACCEPT="application/msgpack",
+        )
+
+    def check_login_and_errors(self):
+        response = self.post(reverse("login"), {"email": TEST_USER["email"], "password": TEST_USER["password"]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "application/msgpack")
+        self.assertEqual(renderers.unpackb(response.content)["email"], TEST_USER["email"])
+        response = self.client.get(reverse("user"), HTTP_ACCEPT="application/msgpack")
+        self.assertEqual(renderers.unpackb(response.content), self.client.get(reverse("user")).json())
+
+        response = self.post(reverse("register"), {**TEST_USER, "email": "test.com"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            renderers.unpackb(response.content)["error_msg"]["email"], ["Enter a valid email address."]
+        )
+        response = self.post(reverse("logout"), {})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.post(
+            reverse("login"), b"\xc1", content_type="application/msgpack", HTTP_ACCEPT="application/msgpack"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("detail", renderers.unpackb(response.content))
+
+    def test_views(self):
+        self.check_login_and_errors()
+
+    @override_settings(ROOT_URLCONF="users_api.async_urls")
+    def test_async_views(self):
+        self.check_login_and_errors()
+
+    def test_json_by_default(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(reverse("user"), HTTP_ACCEPT="*/*")
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(renderers.negotiate("application/msgpack, */*").media_type, "application/msgpack")
+        self.assertEqual(renderers.negotiate(None).media_type, "application/json")
+
+
+class TestPasswordFilter(APITestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.path = os.path.join(self.tmp_dir, "password_filter.bloom")
+
+    def build(self, lines, *args):
+        source = os.path.join(self.tmp_dir, "source.txt")
+        with open(source, "w") as f:
+            f.write("\n".join(lines))
+        call_command("build_password_filter", source, "--output", self.path, *args, stdout=io.StringIO())
+
+    def test_bloom_filter(self):
+        bloom_filter = bloom.BloomFilter.for_capacity(1000, 0.01)
+        for i in range(1000):
+            bloom_filter.add(f"item{i}")
+        self.assertTrue(all(f"item{i}" in bloom_filter for i in range(1000)))
+        false_positives = sum(f"other{i}" in bloom_filter for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_register_and_change_password(self):
+        self.build(["hunter2summer", "qwerty"])
+        get_user_model().objects.create_user(**TEST_USER)
+        with override_settings(PASSWORD_FILTER={"PATH": self.path}):
+            response = self.client.post(
+                reverse("register"), {**TEST_USER, "email": "new@test.com", "password": "Hunter2Summer"}
+            )
+            self.assertEqual(
+                response.data["error_msg"]["password"][0],
+                "Please choose another password, this one is too common",
+            )
+            self.client.post(reverse("login"), {"email": TEST_USER["email"], "password": TEST_USER["password"]})
+            response = self.client.post(
+                reverse("change_password"),
+                {"old_password": TEST_USER["password"], "new_password": "Hunter2Summer"},
+            )
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            response = self.client.post(
+                reverse("change_password"),
+                {"old_password": TEST_USER["password"], "new_password": "Newpassword2"},
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_sha1_list(self):
+        digest = hashlib.sha1(b"Sup3rSecret").hexdigest().upper()
+        self.build([f"{digest}:42"], "--sha1")
+        with override_settings(PASSWORD_FILTER={"PATH": self.path}):
+            self.assertTrue(password_filter.is_common("Sup3rSecret"))
+            self.assertFalse(password_filter.is_common("sup3rsecret"))
+            with self.assertRaises(ValidationError):
+                validate_password("Sup3rSecret")
+
+    def test_django_list_without_filter(self):
+        with override_settings(PASSWORD_FILTER={"PATH": self.path}):
+            self.assertTrue(password_filter.is_common("Password123"))
+            self.assertFalse(password_filter.is_common(TEST_USER["password"]))
+
+
+@override_settings(EMAIL_AVAILABILITY={"ASYNC": False, "REFRESH_INTERVAL": 60})
+class TestEmailAvailability(APITestCase):
+    def setUp(self):
+        self.url = reverse("email_availability")
+        self.user = get_user_model().objects.create_user(**TEST_USER)
+        availability.reset()
+        # Throttling history
+        caches["shared"].clear()
+
+    def check(self, email):
+        response = self.client.get(self.url, {"email": email})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data["available"]
+
+    def test_available_and_taken(self):
+        self.assertFalse(self.check("TEST@test.com"))
+        # Absent from the filter: no query
+        with self.assertNumQueries(0):
+            self.assertTrue(self.check("new@test.com"))
+        response = self.client.get(self.url, {"email": "test.com"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["error_msg"]["email"], ["Enter a valid email address."])
+
+    def test_filter_updated(self):
+        self.assertTrue(self.check("new@test.com"))
+        self.client.post(reverse("register"), {**TEST_USER, "email": "New@test.com"})
+        self.assertFalse(self.check("new@test.com"))
+        bulk.create_users([{**TEST_USER, "email": "bulk@test.com"}])
+        self.assertFalse(self.check("bulk@test.com"))
+        self.user.delete()
+        self.assertTrue(self.check("test@test.com"))
+
+    def test_registered_by_another_worker(self):
+        self.assertTrue(self.check("other@test.com"))
+        # Not seen by this process' filter
+        User = get_user_model()
+        User.objects.bulk_create(
+            [User(email="other@test.com", email_normalized="other@test.com", username="other")]
+        )
+        with override_settings(EMAIL_AVAILABILITY={"ASYNC": False, "REFRESH_INTERVAL": 0}):
+            self.assertFalse(self.check("Other@test.com"))
+            self.assertTrue(self.check("changed@test.com"))
+            # Email changed by a save in another worker
+            User.objects.filter(pk=self.user.pk).update(
+                email="changed@test.com", email_normalized="changed@test.com", updated_at=timezone.now()
+            )
+            self.assertFalse(self.check("changed@test.com"))
+
+    def test_saves_keeping_the_email(self):
+        self.check("new@test.com")
+        count = availability._count
+        self.user.username = "renamed"
+        self.user.save()
+        self.assertEqual(availability._count, count)
+
+    def test_answered_by_the_database_until_built(self):
+        with override_settings(EMAIL_AVAILABILITY={"ASYNC": True}), mock.patch.object(
+            availability.threading, "Thread"
+        ) as thread, mock.patch.object(availability, "_thread_pid", None):
+            self.assertFalse(self.check("test@test.com"))
+            self.assertTrue(self.check("new@test.com"))
+            self.assertIsNone(availability.get_filter())
+        thread.return_value.start.assert_called_once_with()
+
+    def test_throttled(self):
+        with mock.patch.object(ScopedRateThrottle, "THROTTLE_RATES", {"availability": "2/minute"}):
+            self.check("new@test.com")
+            self.check("new@test.com")
+            response = self.client.get(self.url, {"email": "new@test.com"})
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            # The header is set by the client, not by a proxy (NUM_PROXIES = 0)
+            response = self.client.get(
+                self.url, {"email": "new@test.com"}, HTTP_X_FORWARDED_FOR="203.0.113.7"
+            )
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_throttle_cache_check(self):
+        self.assertEqual(availability.check_throttle_cache(None), [])
+        with override_settings(EMAIL_AVAILABILITY={"THROTTLE_CACHE_ALIAS": "default"}):
+            errors = availability.check_throttle_cache(None)
+        self.assertEqual([error.id for error in errors], ["users_api.E002"])
+
+
+class TestEmailNormalizedMigration(TransactionTestCase):
+    before = [("users_api", "0007_appuser_avatar_hash")]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_case_variant_duplicates(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        AppUser = executor.loader.project_state(self.before).apps.get_model("users_api", "AppUser")
+        first = AppUser.objects.create(email="Foo@test.com", username="foo", password="!")
+        second = AppUser.objects.create(email="foo@test.com", username="foo", password="!")
+        executor = MigrationExecutor(connection)
+        message = f"Foo@test.com (id {first.pk}), foo@test.com (id {second.pk})"
+        with self.assertRaisesMessage(RuntimeError, message):
+            executor.migrate([("users_api", "0008_appuser_email_normalized")])
+        AppUser.objects.filter(email="Foo@test.com").delete()
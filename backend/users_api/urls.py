@@ -9,7 +9,11 @@ urlpatterns = [
     path("login", views.UserLogin.as_view(), name="login"),
     path("logout", views.UserLogout.as_view(), name="logout"),
     path("register", views.UserCreateView.as_view(), name="register"),
+    path("register/batch", views.UserBatchCreateView.as_view(), name="register_batch"),
+    path("register/availability", views.EmailAvailabilityView.as_view(), name="email_availability"),
     path("update", views.UserUpdateView.as_view(), name="update"),
     path("change_password", views.ChangePasswordView.as_view(), name="change_password"),
     path("delete", views.UserDeleteView.as_view(), name="delete"),
+    path("export", views.UserExportView.as_view(), name="export"),
+    path("users/bulk", views.UserBulkActionView.as_view(), name="bulk_users"),
 ]
@@ -0,0 +1,124 @@
+"""
+Authenticated user cache.
+
+Django's `get_user` loads the `AppUser` row on every request once the session
+is read. `CachedSessionAuthentication` looks the user up in a per-process LRU
+first (and an optional shared Django cache, e.g. a `FileBasedCache` common to
+the workers of a host), keyed by user id and checked against the session auth
+hash stored in the session: after a password change the old entry no longer
+matches and the user is loaded again.
+
+Entries are dropped when a user is saved or deleted (`post_save` /
+`post_delete`) and by the set-based updates that bypass those signals (bulk
+operations, soft delete, avatar derivatives). Other processes keep their
+local copy until its TTL runs out, so the cache only answers reads (GET, HEAD,
+OPTIONS): writes load the user from the database, and must not save a copy
+read before it.
+"""
+
+import copy
+
+from django.conf import settings
+from django.contrib.auth import HASH_SESSION_KEY, SESSION_KEY
+from django.core.cache import caches
+from django.utils.crypto import constant_time_compare
+from rest_framework.authentication import SessionAuthentication
+
+from .cache import LRUCache
+
+KEY_PREFIX = "users_api.user_cache."
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+DEFAULTS = {
+    # Size and lifetime (seconds) of the per-process tier
+    "MAX_ENTRIES": 10000,
+    "TTL": 30,
+    # Alias from CACHES used as the shared tier (None = disabled)
+    "SHARED_CACHE_ALIAS": None,
+}
+
+_local_cache = None
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, "USER_CACHE", {}))
+    return config
+
+
+def get_local_cache():
+    global _local_cache
+    if _local_cache is None:
+        config = get_config()
+        _local_cache = LRUCache(max_entries=config["MAX_ENTRIES"], ttl=config["TTL"])
+    return _local_cache
+
+
+def get_shared_cache():
+    alias = get_config()["SHARED_CACHE_ALIAS"]
+    return caches[alias] if alias else None
+
+
+def get(session):
+    """
+    Return a copy of the cached user logged in `session`, or None
+    """
+    user_id = session.get(SESSION_KEY)
+    session_hash = session.get(HASH_SESSION_KEY)
+    if user_id is None or session_hash is None:
+        return None
+    local_cache = get_local_cache()
+    entry = local_cache.get(user_id)
+    shared_cache = get_shared_cache()
+    if entry is None and shared_cache is not None:
+        entry = shared_cache.get(KEY_PREFIX + user_id)
+        if entry is not None:
+            local_cache.set(user_id, entry)
+    if entry is None or not constant_time_compare(entry[0], session_hash):
+        return None
+    # Every request gets its own instance, views modify request.user
+    return copy.copy(entry[1])
+
+
+def store(user):
+    entry = (user.get_session_auth_hash(), copy.copy(user))
+    user_id = str(user.pk)
+    get_local_cache().set(user_id, entry)
+    shared_cache = get_shared_cache()
+    if shared_cache is not None:
+        shared_cache.set(KEY_PREFIX + user_id, entry, get_config()["TTL"])
+
+
+def invalidate(*user_ids):
+    local_cache = get_local_cache()
+    for user_id in user_ids:
+        local_cache.delete(str(user_id))
+    shared_cache = get_shared_cache()
+    if shared_cache is not None:
+        shared_cache.delete_many([KEY_PREFIX + str(user_id) for user_id in user_ids])
+
+
+def invalidate_on_change(sender, instance, **kwargs):
+    """`post_save` / `post_delete` receiver"""
+    invalidate(instance.pk)
+
+
+class CachedSessionAuthentication(SessionAuthentication):
+    """
+    `SessionAuthentication` reading the user from the cache for reads
+    """
+
+    def authenticate(self, request):
+        session = getattr(request._request, "session", None)
+        if session is None or request.method not in SAFE_METHODS:
+            return super().authenticate(request)
+        user = get(session)
+        if user is None:
+            result = super().authenticate(request)
+            if result is not None:
+                store(result[0])
+            return result
+        # Spare the lazy user of AuthenticationMiddleware its query too
+        request._request.user = user
+        self.enforce_csrf(request)
+        return (user, None)
@@ -1,13 +1,89 @@
 from django.contrib.auth import login, logout
 from backend.logging_config import logger
 from backend.settings import DEBUG
-from rest_framework.authentication import SessionAuthentication
+from rest_framework.exceptions import ValidationError
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from .serializers import UserSerializer
+from .fast_serializers import serialize_user
+from .serializers import BulkActionSerializer, UserSerializer
 from rest_framework import permissions, status, generics
-from .models import AppUser
+from .models import AppUser, VersionConflict, canonical_email
 from django.contrib.auth import update_session_auth_hash
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.utils.http import parse_etags
+from . import availability, avatars, bulk, bulk_ops, export, hashing, purge, signed_session
+from .user_cache import CachedSessionAuthentication
+
+
+def hashing_busy_response():
+    """
+    Response sent when the password hashing queue is full
+    """
+    return Response(
+        {"error_msg": {"server_busy": ["Server is busy, please try again later"]}},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": "1"},
+    )
+
+
+def etag_matches(header, etag):
+    """
+    Check an If-Match / If-None-Match header value against an ETag
+    """
+    if not header:
+        return False
+    etags = parse_etags(header)
+    return "*" in etags or etag in (e.removeprefix("W/") for e in etags)
+
+
+def update_user(request, data, response_class=Response):
+    """
+    Apply a profile update to the current row of the user, checked against
+    If-Match. Shared by the sync and async views, which pass their response
+    class.
+    """
+    # Reject writes based on a stale copy of the user
+    if_match = request.headers.get("If-Match")
+    while True:
+        # The current row, not the copy authenticated (possibly cached)
+        user = AppUser.objects.get(pk=request.user.pk)
+        if if_match and not etag_matches(if_match, user.etag):
+            return response_class(
+                {"error_msg": {"precondition": ["User was modified, please reload and try again"]}},
+                status=status.HTTP_412_PRECONDITION_FAILED,
+                headers={"ETag": user.etag},
+            )
+        serializer = UserSerializer(
+            user,
+            data=data,
+            partial=True,
+            context={"request": request},  # Must provide context to get the full URL of the avatar
+        )
+        if not serializer.is_valid():
+            return response_class(
+                {"error_msg": serializer.errors}, status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            # Savepoint, so a conflict doesn't break the caller's transaction
+            with transaction.atomic():
+                user = serializer.save()
+            break
+        except VersionConflict:
+            # Saved concurrently since it was read: check and apply again
+            continue
+    logger.info("User updated: %s", user)
+    if "avatar" in serializer.validated_data:
+        avatars.schedule_derivatives(user)
+    response = response_class(
+        serialize_user(user, request),
+        status=status.HTTP_200_OK,
+        headers={"ETag": user.etag},
+    )
+    # Saving revoked the previous cookie
+    return signed_session.set_cookie(response, user)
 
 
 class UserRetrieveView(generics.RetrieveAPIView):
@@ -16,14 +92,29 @@ class UserRetrieveView(generics.RetrieveAPIView):
     """
 
     permission_classes = (permissions.IsAuthenticated,)
-    authentication_classes = (SessionAuthentication,)
+    # The signed cookie, when enabled, spares the session and user queries
+    authentication_classes = (
+        signed_session.SignedCookieAuthentication,
+        CachedSessionAuthentication,
+    )
     serializer_class = UserSerializer
 
     def get_object(self):
         if DEBUG:
-            logger.debug(f"User logged: {self.request.user}")
+            logger.debug("User logged: %s", self.request.user)
         return self.request.user
 
+    def retrieve(self, request, *args, **kwargs):
+        user = self.get_object()
+        # Answer polls with 304 when the user didn't change (no serialization)
+        if etag_matches(request.headers.get("If-None-Match"), user.etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": user.etag})
+        response = Response(serialize_user(user, request), headers={"ETag": user.etag})
+        if request.auth is None:
+            # Authenticated by the session (no valid cookie): let the next reads skip it
+            signed_session.set_cookie(response, user)
+        return response
+
 
 class UserCreateView(generics.CreateAPIView):
     """
@@ -36,15 +127,68 @@ class UserCreateView(generics.CreateAPIView):
 
     def post(self, request):
         serializer = UserSerializer(data=request.data)
-        if serializer.is_valid():
-            user = serializer.create(request.data)
-            if user:
-                logger.info(f"New user created: {user}")
-                return Response(status=status.HTTP_201_CREATED)
-        else:
+        if not serializer.is_valid():
             return Response(
                 {"error_msg": serializer.errors}, status=status.HTTP_400_BAD_REQUEST
             )
+        try:
+            user = serializer.save()
+        except hashing.HashingPoolBusy:
+            return hashing_busy_response()
+        except ValidationError as e:
+            # Email taken, detected by the insert
+            return Response({"error_msg": e.detail}, status=status.HTTP_400_BAD_REQUEST)
+        logger.info("New user created: %s", user)
+        return Response(status=status.HTTP_201_CREATED)
+
+
+class UserBatchCreateView(APIView):
+    """
+    Create many users in one transaction (admin only)
+    """
+
+    permission_classes = (permissions.IsAdminUser,)
+    authentication_classes = (CachedSessionAuthentication,)
+    max_users = 1000
+
+    def post(self, request):
+        rows = request.data.get("users") if isinstance(request.data, dict) else None
+        if not isinstance(rows, list) or not rows:
+            return Response(
+                {"error_msg": {"users": ["Provide a non-empty list of users"]}},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(rows) > self.max_users:
+            return Response(
+                {"error_msg": {"users": [f"At most {self.max_users} users per request"]}},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            created, rejects = bulk.create_users(rows)
+        except hashing.HashingPoolBusy:
+            return hashing_busy_response()
+
+        # Users are created in the order of the rows that weren't rejected
+        rejected = {index for index, _ in rejects}
+        indexes = [index for index in range(len(rows)) if index not in rejected]
+        logger.info("Batch registration: %s created, %s rejected", len(created), len(rejects))
+        if not rejects:
+            response_status = status.HTTP_201_CREATED
+        elif created:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response(
+            {
+                "created": [
+                    {"index": index, "user_id": user.user_id, "email": user.email}
+                    for index, user in zip(indexes, created)
+                ],
+                "errors": [{"index": index, "errors": errors} for index, errors in rejects],
+            },
+            status=response_status,
+        )
 
 
 class UserUpdateView(generics.UpdateAPIView):
@@ -53,29 +197,14 @@ class UserUpdateView(generics.UpdateAPIView):
     """
 
     permission_classes = (permissions.IsAuthenticated,)
-    authentication_classes = (SessionAuthentication,)
+    authentication_classes = (CachedSessionAuthentication,)
     serializer_class = UserSerializer
 
     def get_object(self):
         return self.request.user
 
     def put(self, request):
-        serializer = UserSerializer(
-            request.user,
-            data=request.data,
-            partial=True,
-            context={
-                "request": request
-            },  # Must provide context to get the full URL of the avatar
-        )
-        if serializer.is_valid():
-            logger.info(f"User updated: {request.user}")
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        else:
-            return Response(
-                {"error_msg": serializer.errors}, status=status.HTTP_400_BAD_REQUEST
-            )
+        return update_user(request, request.data)
 
 
 class ChangePasswordView(generics.UpdateAPIView):
@@ -84,15 +213,19 @@ class ChangePasswordView(generics.UpdateAPIView):
     """
 
     permission_classes = (permissions.IsAuthenticated,)
-    authentication_classes = (SessionAuthentication,)
+    authentication_classes = (CachedSessionAuthentication,)
 
     def post(self, request, *args, **kwargs):
         user = request.user
         old_password = request.data.get("old_password")
         new_password = request.data.get("new_password")
-        if not user.check_password(old_password):
+        try:
+            valid_password = hashing.check_password(old_password, user.password)
+        except hashing.HashingPoolBusy:
+            return hashing_busy_response()
+        if not valid_password:
             if DEBUG:
-                logger.debug(f"Invalid old password: {old_password}")
+                logger.debug("Invalid old password: %s", old_password)
             return Response(
                 {"error_msg": {"password" : ["Invalid old password"]}}, status=status.HTTP_400_BAD_REQUEST
             )
@@ -102,19 +235,24 @@ class ChangePasswordView(generics.UpdateAPIView):
             serializer.validate_password(new_password)
         except Exception as e:
             if DEBUG:
-                logger.debug(f"Invalid new password: {new_password}")
+                logger.debug("Invalid new password: %s", new_password)
             error_msg = e.args # Get the error message (the exception is a tuple)
             return Response(
                 {"error_msg": {"password": [error_msg[0]]}}, status=status.HTTP_400_BAD_REQUEST
             )
-        user.set_password(new_password)
-        user.save()
-        logger.info(f"Password updated: {user}")
+        try:
+            user.password = hashing.make_password(new_password)
+        except hashing.HashingPoolBusy:
+            return hashing_busy_response()
+        # Only the password: the other fields may have changed since authentication
+        user.save(update_fields=["password"])
+        logger.info("Password updated: %s", user)
         # Update session to prevent logging out the user after changing the password
         update_session_auth_hash(request, user)
-        return Response(
+        response = Response(
             {"success_msg": "Password updated successfully"}, status=status.HTTP_200_OK
         )
+        return signed_session.set_cookie(response, user)
         
 
 
@@ -124,7 +262,7 @@ class UserDeleteView(generics.DestroyAPIView):
     """
 
     permission_classes = (permissions.IsAuthenticated,)
-    authentication_classes = (SessionAuthentication,)
+    authentication_classes = (CachedSessionAuthentication,)
     serializer_class = UserSerializer
 
     def get_object(self):
@@ -132,16 +270,49 @@ class UserDeleteView(generics.DestroyAPIView):
 
     def delete(self, request):
         user = self.get_object()
-        user.delete()
-        logger.info(f"User account deleted: {user}")
-        return Response(
+        # Deactivate now, sessions, files and rows are removed in the background
+        purge.soft_delete(user)
+        logout(request)
+        logger.info("User account deleted: %s", user)
+        response = Response(
             {"message": "User account deleted successfully"}, status=status.HTTP_200_OK
         )
+        return signed_session.delete_cookie(response)
+
+
+class EmailAvailabilityView(APIView):
+    """
+    Tell whether an email is still available, for the live validation of the
+    register form (answered from an in-memory filter, see availability.py)
+    """
+
+    permission_classes = (permissions.AllowAny,)
+    # No session to read, clients are throttled by IP address
+    authentication_classes = ()
+    throttle_classes = (availability.AvailabilityThrottle,)
+    throttle_scope = "availability"
+    max_length = AppUser._meta.get_field("email").max_length
+
+    def get(self, request):
+        email = request.query_params.get("email", "")
+        if len(email) > self.max_length:
+            message = f"Ensure this field has no more than {self.max_length} characters."
+            return Response(
+                {"error_msg": {"email": [message]}}, status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            validate_email(email)
+        except DjangoValidationError:
+            return Response(
+                {"error_msg": {"email": ["Enter a valid email address."]}},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return Response({"email": email, "available": not availability.is_taken(email)})
 
 
 class UserLogin(APIView):
     permission_classes = (permissions.AllowAny,)
-    authentication_classes = (SessionAuthentication,)
+    authentication_classes = (CachedSessionAuthentication,)
 
     def post(self, request):
         # Check if the user exists and the password is correct
@@ -153,37 +324,110 @@ class UserLogin(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        user = AppUser.objects.filter(email=email).first()
-        if not user or not user.check_password(password):
+        user = AppUser.objects.filter(email_normalized=canonical_email(email)).first()
+        try:
+            valid_password = (
+                user and user.is_active and hashing.check_password(password, user.password)
+            )
+        except hashing.HashingPoolBusy:
+            return hashing_busy_response()
+        if not valid_password:
             return Response(
                 {"error_msg": {"invalid_login": ["Invalid email or password"]}},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
+        # The password is known: upgrade hashes made with an outdated hasher or cost
+        if hashing.must_update(user.password):
+            try:
+                user.password = hashing.make_password(password)
+                user.save(update_fields=["password"])
+            except hashing.HashingPoolBusy:
+                pass  # Upgraded on a later login
+
         # Log the user in
         login(request, user)
-        serializer = UserSerializer(
-            user, context={"request": request}
-        )  # Must provide context to get the full URL of the avatar
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        # Must provide the request to get the full URL of the avatar
+        response = Response(serialize_user(user, request), status=status.HTTP_200_OK)
+        return signed_session.set_cookie(response, user)
 
 
 class UserLogout(APIView):
     permission_classes = (permissions.AllowAny,)
-    authentication_classes = (SessionAuthentication,)
+    authentication_classes = (CachedSessionAuthentication,)
 
     def post(self, request):
         if request.user.is_authenticated:
+            signed_session.revoke(request.user.pk)
             logout(request)
             if DEBUG:
-                logger.debug(f"User logged out: {request.user}")
-            return Response(
+                logger.debug("User logged out: %s", request.user)
+            response = Response(
                 {"success_msg": "User logged out successfully"},
                 status=status.HTTP_200_OK,
             )
+            return signed_session.delete_cookie(response)
 
         if DEBUG:
-            logger.debug(f"User is not logged in")
+            logger.debug("User is not logged in")
         return Response(
             {"error_msg": {"logout_error" : ["User is not logged in"]}}, status=status.HTTP_400_BAD_REQUEST
         )
+
+
+class UserExportView(APIView):
+    """
+    Stream every user as CSV or JSONL (admin only)
+    """
+
+    permission_classes = (permissions.IsAdminUser,)
+    authentication_classes = (CachedSessionAuthentication,)
+
+    def get(self, request):
+        # Not "format", which DRF reserves for renderer selection
+        file_format = request.query_params.get("file_format", "csv")
+        if file_format not in export.RENDERERS:
+            return Response(
+                {"error_msg": {"file_format": ["Choose one of: csv, jsonl"]}},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        content, content_type = export.export(file_format)
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response["Content-Disposition"] = f'attachment; filename="users.{file_format}"'
+        return response
+
+
+class UserBulkActionView(APIView):
+    """
+    Activate, deactivate, promote, demote or delete many users at once (admin only)
+    """
+
+    permission_classes = (permissions.IsAdminUser,)
+    authentication_classes = (CachedSessionAuthentication,)
+
+    def post(self, request):
+        serializer = BulkActionSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {"error_msg": serializer.errors}, status=status.HTTP_400_BAD_REQUEST
+            )
+        data = serializer.validated_data
+        try:
+            # Admins can't lock themselves out
+            user_ids = bulk_ops.select_users(
+                data.get("ids"), data.get("filter"), exclude=request.user.pk
+            )
+        except (ValueError, DjangoValidationError) as e:
+            return Response(
+                {"error_msg": {"filter": [str(e)]}}, status=status.HTTP_400_BAD_REQUEST
+            )
+        changed, sessions = bulk_ops.apply(data["action"], user_ids)
+        return Response(
+            {
+                "action": data["action"],
+                "matched": len(user_ids),
+                "changed": changed,
+                "sessions_deleted": sessions,
+            },
+            status=status.HTTP_200_OK,
+        )